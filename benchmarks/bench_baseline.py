@@ -0,0 +1,61 @@
+"""
+Benchmark of the batched baseline engine (`raman.baseline`) against the per-spectrum `rampy.baseline` path.
+
+    python -m benchmarks.bench_baseline
+"""
+from raman.baseline import poly_baseline, als_baseline
+
+import numpy as np
+from rampy import baseline  # type: ignore
+
+from time import perf_counter
+
+
+def make_stack(n_spectra: int, seed: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    x = np.arange(200, 2001, 1.0)
+    t = (x - x.mean()) / x.std()
+    coef = rng.normal(size=(n_spectra, 4)) * np.array([1000, 300, 100, 30])
+    fluorescence = coef @ np.vstack([t**0, t, t**2, t**3]) + 5000
+    peaks = rng.uniform(100, 1000, size=(n_spectra, 1)) * np.exp(-(((x - 1125) / 8) ** 2))
+    noise = rng.normal(scale=20, size=(n_spectra, x.shape[0]))
+    return x, fluorescence + peaks + noise
+
+
+def run(n_spectra: int = 500, order: int = 3, lam: float = 1e6) -> dict[str, float]:
+    x, Y = make_stack(n_spectra)
+    roi = np.array([[200, 1000], [1200, 2000]])
+    timing: dict[str, float] = {}
+
+    start = perf_counter()
+    for y in Y:
+        baseline(x, y, roi=roi, method="poly", polynomial_order=order)
+    timing["rampy poly"] = perf_counter() - start
+
+    start = perf_counter()
+    poly_baseline(x, Y, order=order, roi=roi)
+    timing["batched poly"] = perf_counter() - start
+
+    start = perf_counter()
+    for y in Y:
+        baseline(x, y, method="als", lam=lam, p=0.01, niter=10)
+    timing["rampy als"] = perf_counter() - start
+
+    start = perf_counter()
+    als_baseline(Y, lam=lam, p=0.01, niter=10, method="asls")
+    timing["batched asls"] = perf_counter() - start
+
+    start = perf_counter()
+    als_baseline(Y, lam=lam, niter=10, method="arpls")
+    timing["batched arpls"] = perf_counter() - start
+    return timing
+
+
+def main(n_spectra: int = 500):
+    print(f"baseline: {n_spectra} spectra")
+    for name, seconds in run(n_spectra=n_spectra).items():
+        print(f"  {name:<14} {seconds:8.3f} s  {1e3 * seconds / n_spectra:8.3f} ms/spectrum")
+
+
+if __name__ == "__main__":
+    main()
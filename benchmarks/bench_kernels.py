@@ -0,0 +1,119 @@
+"""
+Benchmark of the stack kernels (`raman.kernels`) against the per-spectrum loops they replace,
+with the NumPy backend and, when it is installed, the experimental Numba backend (timed after a warm-up call that
+compiles it, and checked against the NumPy results).
+
+    python -m benchmarks.bench_kernels
+    RAMAN_KERNELS=numpy python -m raman.cli benchmark kernels
+"""
+from raman import kernels
+
+import numpy as np
+from rampy.spectranization import despiking  # type: ignore
+from scipy.interpolate import interp1d  # type: ignore
+
+from time import perf_counter
+from typing import Callable
+
+
+def make_stack(n_spectra: int, n_spikes: int = 3, seed: int = 0) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    x = np.arange(200, 2001, 1.0)
+    bands = rng.uniform(100, 1000, size=(n_spectra, 1)) * np.exp(-(((x - 1125) / 8) ** 2))
+    Y = 5000 + bands + rng.normal(scale=20, size=(n_spectra, x.shape[0]))
+    # Cosmic spikes of 1 to 3 points: (row, start, stop)
+    rows = np.repeat(np.arange(n_spectra), n_spikes)
+    starts = rng.integers(10, x.shape[0] - 20, size=rows.shape[0])
+    stops = starts + rng.integers(1, 4, size=rows.shape[0])
+    for r, start, stop in zip(rows, starts, stops):
+        Y[r, start:stop] += rng.uniform(2000, 20000)
+    return x, Y, np.column_stack([rows, starts, stops])
+
+
+def _repair_loop(Y: np.ndarray, regions: np.ndarray):
+    # `Sample.remove_spike` before the kernel: one interp1d per region
+    for r, start, stop in regions:
+        region = np.arange(start, stop)
+        window = np.concat([region - len(region), region + len(region)])
+        Y[r, region] = interp1d(window, Y[r, window], kind="linear")(region)
+
+
+def _pairwise(Y: np.ndarray, weights: np.ndarray, codes: np.ndarray, n_groups: int) -> list[np.ndarray]:
+    # `accumulate` before the kernel: `a | b` folded over every group
+    means = []
+    for g in range(n_groups):
+        rows = np.flatnonzero(codes == g)
+        y, total = Y[rows[0]], weights[rows[0]]
+        for r in rows[1:]:
+            y = (total * y + weights[r] * Y[r]) / (total + weights[r])
+            total += weights[r]
+        means.append(y)
+    return means
+
+
+def _time(func: Callable, repeat: int = 1) -> float:
+    start = perf_counter()
+    for _ in range(repeat):
+        func()
+    return (perf_counter() - start) / repeat
+
+
+def check_backends(x: np.ndarray, Y: np.ndarray, regions: np.ndarray, weights: np.ndarray, codes: np.ndarray, bands: list):
+    """
+    Raise when the Numba kernels do not give the NumPy results (up to the rounding of the sums).
+    """
+    outputs: dict[str, list] = {}
+    for backend in ["numpy", "numba"]:
+        with kernels.use_backend(backend):
+            outputs[backend] = [
+                kernels.repair_spikes(Y.copy(), *regions.T),
+                kernels.despike(Y, neigh=4, threshold=3),
+                *kernels.weighted_sum(Y, codes, weights, 50),
+                kernels.band_means(x, Y, bands),
+                kernels.band_integrals(x, Y, bands),
+            ]
+    names = ["repair_spikes", "despike", "weighted_sum", "weighted_sum totals", "band_means", "band_integrals"]
+    for name, expected, result in zip(names, outputs["numpy"], outputs["numba"]):
+        if np.allclose(result, expected, rtol=1e-9, atol=1e-9) == False:
+            raise AssertionError(f"The numba {name} differs from numpy by up to {np.abs(result - expected).max()}")
+
+
+def run(n_spectra: int = 2000) -> dict[str, float]:
+    x, Y, regions = make_stack(n_spectra)
+    weights = np.random.default_rng(1).integers(1, 4, size=n_spectra).astype(np.float64)
+    codes = np.arange(n_spectra) % 50
+    bands = [(400, 600), (800, 900), (1000, 1200), (1400, 1700)]
+    timing: dict[str, float] = {}
+
+    timing["repair loop"] = _time(lambda: _repair_loop(Y.copy(), regions))
+    timing["despike loop"] = _time(lambda: [despiking(x, y, neigh=4, threshold=3) for y in Y])
+    timing["accumulate loop"] = _time(lambda: _pairwise(Y, weights, codes, 50))
+    timing["bands loop"] = _time(lambda: [Y[:, (x >= low) & (x <= high)].mean(axis=1) for low, high in bands])
+
+    backends = ["numpy"] + (["numba"] if kernels.NUMBA_AVAILABLE else [])
+    for backend in backends:
+        with kernels.use_backend(backend):
+            if backend == "numba":
+                # Compile every kernel once, outside the timing
+                kernels.repair_spikes(Y.copy()[:1], regions[:1, 0] * 0, regions[:1, 1], regions[:1, 2])
+                kernels.despike(Y[:2], neigh=4, threshold=3)
+                kernels.weighted_sum(Y[:2], codes[:2], weights[:2], 50)
+                kernels.band_means(x, Y[:2], bands)
+                kernels.band_integrals(x, Y[:2], bands)
+                check_backends(x, Y, regions, weights, codes, bands)
+            timing[f"repair {backend}"] = _time(lambda: kernels.repair_spikes(Y.copy(), *regions.T))
+            timing[f"despike {backend}"] = _time(lambda: kernels.despike(Y, neigh=4, threshold=3))
+            timing[f"accumulate {backend}"] = _time(lambda: kernels.weighted_sum(Y, codes, weights, 50), repeat=5)
+            timing[f"bands {backend}"] = _time(lambda: kernels.band_means(x, Y, bands), repeat=5)
+            timing[f"integrals {backend}"] = _time(lambda: kernels.band_integrals(x, Y, bands), repeat=5)
+    return timing
+
+
+def main(n_spectra: int = 2000):
+    print(f"kernels: {n_spectra} spectra, numba {'available' if kernels.NUMBA_AVAILABLE else 'not installed'}")
+    for name, seconds in run(n_spectra=n_spectra).items():
+        print(f"  {name:<20} {seconds:8.4f} s  {1e3 * seconds / n_spectra:8.4f} ms/spectrum")
+
+
+if __name__ == "__main__":
+    main()
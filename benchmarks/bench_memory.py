@@ -0,0 +1,39 @@
+"""
+Memory held by `Sample` objects for an archive of spectra.
+
+    python -m benchmarks.bench_memory
+"""
+from raman.sample import Sample
+
+import numpy as np
+
+import tracemalloc
+
+
+def measure(n_samples: int, n_shifts: int = 2000, **kwargs) -> float:
+    """
+    Return the bytes held per `Sample` when `n_samples` are kept alive.
+    """
+    rng = np.random.default_rng(0)
+    x = np.linspace(100, 2800, n_shifts)
+    y = rng.normal(loc=1000, scale=5, size=n_shifts)
+    tracemalloc.start()
+    samples = [Sample(x=x, y=y, interpolate=False, **kwargs) for _ in range(n_samples)]
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del samples
+    return current / n_samples
+
+
+def main(n_samples: int = 2000):
+    print(f"memory: {n_samples} samples")
+    for label, kwargs in [
+        ("float64", {}),
+        ("float32", {"dtype": np.float32}),
+        ("float32 no original", {"dtype": np.float32, "keep_original": False}),
+    ]:
+        print(f"  {label:<20} {measure(n_samples, **kwargs) / 1024:8.1f} KiB/sample")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Lazy (`raman.plan.LazySample`) against eager (`Sample`) preprocessing on every file of `data/pilot`, for several
+regions of interest: the time of both and the largest difference between their results, relative to the range of
+the eager spectrum. Raises when a lazy run fails or differs from the eager one. Files not named like the pilot
+spectra (calibration exports) are skipped.
+
+    python -m benchmarks.bench_plan
+
+Each lazy sample collected on its own builds the fused operators of its own plan; `collect_all` shares them.
+"""
+from raman.sample import read_txt, parse_filename
+from raman.plan import LazySample, collect_all
+
+import numpy as np
+
+from pathlib import Path
+from time import perf_counter
+
+PILOT_FORMAT: list[str] = ["name", "grating", "laser", "exposure", "accumulation", "year", "month", "date", "hour", "minute", "second", "01"]
+
+ROIS: list[tuple[float, float]] = [(400, 1800), (700, 1500), (850, 1200), (1000, 1100), (1400, 1500)]
+
+
+def run(folder: str | Path = "data/pilot", rois: list[tuple[float, float]] = ROIS, tolerance: float = 1e-9) -> dict[str, float]:
+    paths, skipped = [], 0
+    for path in sorted(Path(folder).rglob("*.txt")):
+        try:
+            parse_filename(path, name_format=PILOT_FORMAT)
+        except ValueError:
+            skipped += 1
+            continue
+        paths.append(path)
+    if len(paths) == 0:
+        raise FileNotFoundError(f"No .txt file in {Path(folder).as_posix()}")
+    timing = {"eager": 0.0, "lazy collect": 0.0, "lazy collect_all": 0.0}
+    worst, failures = 0.0, []
+    for low, high in rois:
+        start = perf_counter()
+        eager = [read_txt(path, name_format=PILOT_FORMAT) for path in paths]
+        for sample in eager:
+            sample.extract_range(low=low, high=high)
+        timing["eager"] += perf_counter() - start
+
+        lazy: list = []
+        start = perf_counter()
+        for path in paths:
+            try:
+                lazy.append(LazySample.read_txt(path, name_format=PILOT_FORMAT).extract_range(low, high).collect())
+            except Exception as error:
+                lazy.append(f"{type(error).__name__}: {error}")
+        timing["lazy collect"] += perf_counter() - start
+
+        start = perf_counter()
+        batched = collect_all(LazySample.read_txt(path, name_format=PILOT_FORMAT).extract_range(low, high) for path in paths)
+        timing["lazy collect_all"] += perf_counter() - start
+
+        for path, expected, single, batch in zip(paths, eager, lazy, batched):
+            for mode, result in [("collect", single), ("collect_all", batch)]:
+                where = f"{path.as_posix()} [{low:g}, {high:g}] {mode}"
+                if isinstance(result, str):
+                    failures.append(f"{where}: {result}")
+                    continue
+                if result.x.shape != expected.x.shape or np.allclose(result.x, expected.x) == False:
+                    failures.append(f"{where}: the Raman Shift differs")
+                    continue
+                difference = np.abs(result.y - expected.y).max() / max(float(np.ptp(expected.y)), 1e-300)
+                worst = max(worst, difference)
+                if difference > tolerance:
+                    failures.append(f"{where}: differs by {difference:.2e} of the range")
+    if failures:
+        raise AssertionError(f"{len(failures)} lazy runs of {len(paths) * len(rois)} do not match:\n" + "\n".join(failures))
+    return {**timing, "runs": len(paths) * len(rois), "skipped": skipped, "max relative difference": worst}
+
+
+def main():
+    result = run()
+    print(f"plan: {result['runs']} runs on data/pilot ({result['skipped']} files skipped), lazy matches eager within {result['max relative difference']:.1e}")
+    for name in ["eager", "lazy collect", "lazy collect_all"]:
+        print(f"  {name:<17} {result[name]:8.3f} s")
+
+
+if __name__ == "__main__":
+    main()
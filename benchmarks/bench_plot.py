@@ -0,0 +1,51 @@
+"""
+Benchmark of drawing a stack of spectra with one `plt.plot` per spectrum versus `raman.figure.plot_stack`.
+
+    python -m benchmarks.bench_plot
+"""
+from raman.figure import plot_stack
+
+import matplotlib
+
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import numpy as np
+from matplotlib import colormaps
+
+from time import perf_counter
+
+
+def run(n_spectra: int = 500, n_shifts: int = 2000) -> dict[str, float]:
+    rng = np.random.default_rng(0)
+    x = np.arange(n_shifts, dtype=np.float64)
+    Y = rng.normal(loc=1000, scale=5, size=(n_spectra, n_shifts)).cumsum(axis=1)
+    glucose = rng.uniform(70, 200, size=n_spectra)
+    timing: dict[str, float] = {}
+
+    start = perf_counter()
+    fig = plt.figure(figsize=(10, 6))
+    colors = colormaps["viridis"]((glucose - glucose.min()) / np.ptp(glucose))
+    for y, color, value in zip(Y, colors, glucose):
+        plt.plot(x, y, color=color, label=f"{value:.0f}", linewidth=0.8, alpha=0.8)
+    plt.legend()
+    fig.canvas.draw()
+    plt.close(fig)
+    timing["plt.plot"] = perf_counter() - start
+
+    start = perf_counter()
+    fig = plt.figure(figsize=(10, 6))
+    plot_stack(x, Y, values=glucose, colorbar="glucose")
+    fig.canvas.draw()
+    plt.close(fig)
+    timing["plot_stack"] = perf_counter() - start
+    return timing
+
+
+def main(n_spectra: int = 500):
+    print(f"plot: {n_spectra} spectra")
+    for name, seconds in run(n_spectra=n_spectra).items():
+        print(f"  {name:<14} {seconds:8.3f} s")
+
+
+if __name__ == "__main__":
+    main()
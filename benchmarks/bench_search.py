@@ -0,0 +1,46 @@
+"""
+Top-k queries against a large `raman.search.SpectrumIndex`, with full spectra and with PCA compression.
+
+    python -m benchmarks.bench_search
+"""
+from raman.search import SpectrumIndex
+
+import numpy as np
+
+from time import perf_counter
+
+
+def run(n_library: int = 100_000, n_queries: int = 100, n_shifts: int = 1400, k: int = 5) -> dict[str, tuple[float, float]]:
+    """
+    Return (seconds to build, seconds per query) for every configuration.
+    """
+    rng = np.random.default_rng(0)
+    x = np.arange(n_shifts, dtype=np.float64)
+    # Smooth random spectra, so that a few principal components carry most of the signal
+    Y = rng.normal(size=(n_library, n_shifts // 20)).repeat(20, axis=1) + 5
+    queries = Y[:n_queries] + rng.normal(scale=0.01, size=(n_queries, n_shifts))
+    timing: dict[str, tuple[float, float]] = {}
+    for label, kwargs in [
+        ("cosine", {"metric": "cosine"}),
+        ("sam", {"metric": "sam"}),
+        ("cosine pca-32", {"metric": "cosine", "n_components": 32}),
+    ]:
+        start = perf_counter()
+        index = SpectrumIndex(x, **kwargs)
+        for block in range(0, n_library, 10_000):
+            index.add(Y[block : block + 10_000])
+        build = perf_counter() - start
+        start = perf_counter()
+        index.query(queries, k=k)
+        timing[label] = (build, (perf_counter() - start) / n_queries)
+    return timing
+
+
+def main(n_library: int = 100_000):
+    print(f"search: {n_library} library spectra")
+    for label, (build, query) in run(n_library=n_library).items():
+        print(f"  {label:<16} build {build:7.2f} s   query {query * 1000:7.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""
+Benchmark of sending spectrum stacks to worker processes by pickling versus through shared memory (`raman.shared`).
+
+    python -m benchmarks.bench_shared
+"""
+from raman.shared import map_rows
+
+import numpy as np
+from scipy.signal import savgol_filter  # type: ignore
+
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+
+
+def _smooth(Y: np.ndarray) -> np.ndarray:
+    return savgol_filter(Y, window_length=31, polyorder=2, axis=-1)
+
+
+def run(n_spectra: int = 20000, n_shifts: int = 2000, workers: int = 4) -> dict[str, float]:
+    rng = np.random.default_rng(0)
+    Y = rng.normal(loc=1000, scale=5, size=(n_spectra, n_shifts))
+    bounds = np.linspace(0, n_spectra, workers + 1).astype(int)
+    timing: dict[str, float] = {}
+
+    start = perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        np.vstack(list(executor.map(_smooth, [Y[a:b] for a, b in zip(bounds[:-1], bounds[1:])])))
+    timing["pickle"] = perf_counter() - start
+
+    start = perf_counter()
+    map_rows(_smooth, Y, workers=workers)
+    timing["shared memory"] = perf_counter() - start
+    return timing
+
+
+def main(n_spectra: int = 20000, workers: int = 4):
+    print(f"shared: {n_spectra} spectra, {workers} workers")
+    for name, seconds in run(n_spectra=n_spectra, workers=workers).items():
+        print(f"  {name:<14} {seconds:8.3f} s")
+
+
+if __name__ == "__main__":
+    main()
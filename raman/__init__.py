@@ -9,4 +9,4 @@ set_thaifont()
 
 
 # Export modules
-from .sample import Sample, read_txt, accumulate
\ No newline at end of file
+from .sample import Sample, read_txt, parse_filename, accumulate, accumulate_groups, grouped_mean, stack
\ No newline at end of file
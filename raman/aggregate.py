@@ -0,0 +1,421 @@
+"""
+Cohort summaries computed where the spectra are stored.
+
+Mean spectra per group and band statistics only need a few reduced arrays, not every document with both full
+arrays. The helpers here build MongoDB aggregation pipelines that do the grouping, the element-wise (weighted)
+averaging of the intensity and the band-window averages on the server, so only the results cross the wire
+(`raman.spectra.mean_spectra` and `raman.spectra.band_statistics` run them on a collection).
+
+`EmbeddedStore` answers the same questions, with the same results, for spectra held in process: loaded from a
+Parquet or HDF5 export (`raman.columnar`), from samples, or from documents.
+
+Semantics shared by both:
+
+- The documents are filtered by a MongoDB `match` query (equality, `$eq`, `$ne`, `$gt`, `$gte`, `$lt`, `$lte`,
+  `$in`, `$nin`, `$and`, `$or`).
+- A mean spectrum is computed per group, per `exposure` and per Raman Shift axis (the axis is told apart by its
+  first value, last value and size), weighted by `accumulation` like `Sample.__or__`, which never mixes exposures
+  either. Its Raman Shift is the mean of the axes.
+- A band value is the mean intensity of a document with a Raman Shift in [low, high]. Its statistics per group
+  are `n` (documents with a value), `mean`, `std` (population), `min` and `max`.
+"""
+from raman.sample import Sample
+from raman.kernels import band_means
+
+import numpy as np
+from numpy.typing import NDArray
+import pandas as pd
+
+import json
+import operator
+from pathlib import Path
+from typing import Any, Iterable, Self
+
+Band = tuple[float, float]
+
+############# MongoDB pipelines #############
+
+
+def _by(by: str | list[str] | None) -> list[str]:
+    if by is None:
+        return []
+    return [by] if isinstance(by, str) else list(by)
+
+
+def mean_spectra_pipeline(
+    by: str | list[str] | None = None,
+    match: dict[str, Any] | None = None,
+    weight: str | None = "accumulation",
+) -> list[dict[str, Any]]:
+    """
+    The aggregation pipeline of the element-wise weighted mean intensity per group and per axis.
+
+    Every output document has `_id` (`key`: the group, `axis`: first, last and size of the axis and the exposure),
+    `n`, `weight`, `x` (the mean Raman Shift) and `sum` (the weighted sum of the intensity) in increasing index order.
+    """
+    position = {"$arrayElemAt": ["$xy", 0]}
+    intensity = {"$arrayElemAt": ["$xy", 1]}
+    return [
+        {"$match": match or {}},
+        {
+            "$project": {
+                "_id": 0,
+                "key": {field: f"${field}" for field in _by(by)},
+                "axis": {
+                    "first": {"$arrayElemAt": ["$raman_shift", 0]},
+                    "last": {"$arrayElemAt": ["$raman_shift", -1]},
+                    "size": {"$size": "$raman_shift"},
+                    "exposure": "$exposure",
+                },
+                "w": 1 if weight is None else {"$ifNull": [f"${weight}", 1]},
+                "xy": {"$zip": {"inputs": ["$raman_shift", "$intensity"]}},
+            }
+        },
+        {"$unwind": {"path": "$xy", "includeArrayIndex": "i"}},
+        {
+            "$group": {
+                "_id": {"key": "$key", "axis": "$axis", "i": "$i"},
+                "x": {"$avg": position},
+                "sum": {"$sum": {"$multiply": ["$w", intensity]}},
+                "weight": {"$sum": "$w"},
+                "n": {"$sum": 1},
+            }
+        },
+        {"$sort": {"_id.i": 1}},
+        {
+            "$group": {
+                "_id": {"key": "$_id.key", "axis": "$_id.axis"},
+                "x": {"$push": "$x"},
+                "sum": {"$push": "$sum"},
+                "weight": {"$first": "$weight"},
+                "n": {"$first": "$n"},
+            }
+        },
+    ]
+
+
+def _band_field(index: int) -> str:
+    return f"band{index}"
+
+
+def band_statistics_pipeline(
+    bands: Iterable[Band],
+    by: str | list[str] | None = None,
+    match: dict[str, Any] | None = None,
+) -> list[dict[str, Any]]:
+    """
+    The aggregation pipeline of the band values per document and their statistics per group.
+
+    Every output document has `_id` (the group) and, for band i, `band<i>_n`, `band<i>_mean`, `band<i>_std`,
+    `band<i>_min` and `band<i>_max`.
+    """
+    values: dict[str, Any] = {}
+    statistics: dict[str, Any] = {}
+    for index, (low, high) in enumerate(bands):
+        shift = {"$arrayElemAt": ["$$pair", 0]}
+        inside = {
+            "$filter": {
+                "input": {"$zip": {"inputs": ["$raman_shift", "$intensity"]}},
+                "as": "pair",
+                "cond": {"$and": [{"$gte": [shift, low]}, {"$lte": [shift, high]}]},
+            }
+        }
+        field = _band_field(index)
+        # $avg of an empty window is null, which the accumulators below ignore
+        values[field] = {"$avg": {"$map": {"input": inside, "as": "pair", "in": {"$arrayElemAt": ["$$pair", 1]}}}}
+        statistics[f"{field}_n"] = {"$sum": {"$cond": [{"$eq": [{"$type": f"${field}"}, "null"]}, 0, 1]}}
+        statistics[f"{field}_mean"] = {"$avg": f"${field}"}
+        statistics[f"{field}_std"] = {"$stdDevPop": f"${field}"}
+        statistics[f"{field}_min"] = {"$min": f"${field}"}
+        statistics[f"{field}_max"] = {"$max": f"${field}"}
+    return [
+        {"$match": match or {}},
+        {"$project": {"_id": 0, "key": {field: f"${field}" for field in _by(by)}, **values}},
+        {"$group": {"_id": "$key", **statistics}},
+    ]
+
+
+############# Results #############
+
+
+def _sort_key(key: dict[str, Any], by: list[str]) -> tuple:
+    return tuple((key.get(field) is None, str(type(key.get(field))), key.get(field) or 0) for field in by)
+
+
+def _mean_samples(groups: Iterable[dict[str, Any]], by: list[str]) -> list[Sample]:
+    samples: list[Sample] = []
+    groups = sorted(
+        groups,
+        key=lambda group: (
+            _sort_key(group["_id"]["key"], by),
+            _sort_key(group["_id"]["axis"], ["exposure"]),
+            group["_id"]["axis"]["first"],
+        ),
+    )
+    for group in groups:
+        key = {field: group["_id"]["key"].get(field) for field in by}
+        y = np.asarray(group["sum"], dtype=np.float64) / group["weight"]
+        sample = Sample(x=np.asarray(group["x"], dtype=np.float64), y=y, interpolate=False, verbose=False)
+        sample.name = "-".join(str(value) for value in key.values()) if len(key) > 0 else "mean"
+        if group["_id"]["axis"].get("exposure") is not None:
+            sample.exposure = group["_id"]["axis"]["exposure"]
+        sample.accumulation = group["weight"]
+        sample.meta.update(key)
+        sample.meta["n"] = int(group["n"])
+        samples.append(sample)
+    return samples
+
+
+def _band_frame(groups: Iterable[dict[str, Any]], bands: list[Band], by: list[str]) -> pd.DataFrame:
+    rows: list[dict[str, Any]] = []
+    for group in sorted(groups, key=lambda group: _sort_key(group["_id"] or {}, by)):
+        key = {field: (group["_id"] or {}).get(field) for field in by}
+        for index, (low, high) in enumerate(bands):
+            field = _band_field(index)
+            row = {**key, "band": f"{low:g}-{high:g}", "low": low, "high": high, "n": int(group[f"{field}_n"])}
+            for statistic in ["mean", "std", "min", "max"]:
+                value = group[f"{field}_{statistic}"]
+                row[statistic] = np.nan if value is None else float(value)
+            rows.append(row)
+    columns = by + ["band", "low", "high", "n", "mean", "std", "min", "max"]
+    return pd.DataFrame(rows, columns=columns)
+
+
+############# Embedded store #############
+
+_OPERATORS = {
+    "$eq": operator.eq,
+    "$ne": operator.ne,
+    "$gt": operator.gt,
+    "$gte": operator.ge,
+    "$lt": operator.lt,
+    "$lte": operator.le,
+}
+
+
+def _match(fields: pd.DataFrame, query: dict[str, Any]) -> NDArray:
+    mask = np.ones(len(fields), dtype=bool)
+    for name, condition in query.items():
+        if name in ["$and", "$or"]:
+            masks = [_match(fields, part) for part in condition]
+            combined = np.logical_and.reduce(masks) if name == "$and" else np.logical_or.reduce(masks)
+            mask &= combined
+            continue
+        if name.startswith("$"):
+            raise ValueError(f"The embedded store does not support {name}")
+        column = fields[name] if name in fields else pd.Series([None] * len(fields), index=fields.index)
+        if isinstance(condition, dict) == False:
+            condition = {"$eq": condition}
+        for op, value in condition.items():
+            if op in ["$eq", "$ne"] and value is None:
+                # null matches missing fields too, as in MongoDB
+                missing = column.isna().to_numpy(dtype=bool)
+                mask &= missing if op == "$eq" else ~missing
+            elif op in _OPERATORS:
+                with np.errstate(invalid="ignore"):
+                    mask &= _OPERATORS[op](column, value).fillna(op == "$ne").to_numpy(dtype=bool)
+            elif op in ["$in", "$nin"]:
+                found = column.isin(list(value)).to_numpy(dtype=bool)
+                mask &= found if op == "$in" else ~found
+            else:
+                raise ValueError(f"The embedded store does not support {op}")
+    return mask
+
+
+def _group_indices(fields: pd.DataFrame, by: list[str]) -> list[tuple[dict[str, Any], NDArray]]:
+    if len(by) == 0:
+        return [({}, np.arange(len(fields)))]
+    keys = fields.reindex(columns=by).astype(object).where(fields.reindex(columns=by).notna(), None)
+    groups: dict[tuple, list[int]] = {}
+    for row, values in enumerate(keys.itertuples(index=False, name=None)):
+        groups.setdefault(values, []).append(row)
+    return [(dict(zip(by, values)), np.array(rows)) for values, rows in groups.items()]
+
+
+def _document_fields(sample: Sample) -> dict[str, Any]:
+    return {
+        "name": getattr(sample, "name", None),
+        "timestamp": getattr(sample, "date", None),
+        "exposure": getattr(sample, "exposure", None),
+        "accumulation": getattr(sample, "accumulation", None),
+        "grating": getattr(sample, "grating", None),
+        "laser": getattr(sample, "laser", None),
+        **{key: value for key, value in sample.meta.items() if key != "_id"},
+    }
+
+
+class EmbeddedStore:
+    """
+    Spectra held in process, one block (Raman Shift, intensity matrix, fields) per axis, with the same
+    aggregation helpers as `raman.spectra` on MongoDB.
+
+    Examples
+    --------
+    >>> store = EmbeddedStore.from_parquet("fingers.parquet")  # written by `raman export --kind finger`
+    >>> store.mean_spectra(by="glucose", match={"subject_id": "s1"})
+    >>> store.band_statistics([(1115, 1135), (1330, 1350)], by="subject_id")
+    """
+
+    def __init__(self):
+        self._blocks: dict[tuple, tuple[NDArray, list[NDArray], list[pd.DataFrame]]] = {}
+
+    def __len__(self) -> int:
+        return sum(sum(len(fields) for fields in block[2]) for block in self._blocks.values())
+
+    def _add_block(self, x: NDArray, Y: NDArray, fields: pd.DataFrame):
+        x = np.asarray(x, dtype=np.float64)
+        key = (x.shape[0], x.tobytes())
+        if key not in self._blocks:
+            self._blocks[key] = (x, [], [])
+        self._blocks[key][1].append(np.asarray(Y, dtype=np.float64).reshape(len(fields), x.shape[0]))
+        self._blocks[key][2].append(fields.reset_index(drop=True))
+
+    def _iter_blocks(self) -> Iterable[tuple[NDArray, NDArray, pd.DataFrame]]:
+        for x, Ys, fields in self._blocks.values():
+            if len(Ys) > 1:
+                Ys[:] = [np.concatenate(Ys)]
+                fields[:] = [pd.concat(fields, ignore_index=True)]
+            yield x, Ys[0], fields[0]
+
+    def insert_many(self, documents: Iterable[dict[str, Any]]) -> int:
+        """
+        Add documents shaped like the `raman.spectra` ones (`raman_shift`, `intensity` and other fields).
+        """
+        blocks: dict[bytes, tuple[NDArray, list[NDArray], list[dict[str, Any]]]] = {}
+        count = 0
+        for document in documents:
+            x = np.asarray(document["raman_shift"], dtype=np.float64)
+            block = blocks.setdefault(x.tobytes(), (x, [], []))
+            block[1].append(np.asarray(document["intensity"], dtype=np.float64))
+            block[2].append({key: value for key, value in document.items() if key not in ["raman_shift", "intensity", "_id"]})
+            count += 1
+        for x, ys, rows in blocks.values():
+            # Nullable dtypes keep integer fields (such as glucose) integers when some are missing
+            self._add_block(x, np.stack(ys), pd.DataFrame(rows).convert_dtypes())
+        return count
+
+    @classmethod
+    def from_documents(cls, documents: Iterable[dict[str, Any]]) -> Self:
+        store = cls()
+        store.insert_many(documents)
+        return store
+
+    @classmethod
+    def from_samples(cls, samples: Iterable[Sample]) -> Self:
+        """
+        A store of samples. The fields are the sample attributes (`date` as `timestamp`) and `sample.meta`.
+        """
+        return cls.from_documents(
+            {"raman_shift": sample.x, "intensity": sample.y, **_document_fields(sample)} for sample in samples
+        )
+
+    @classmethod
+    def _from_columnar(cls, blocks: list[tuple[NDArray, NDArray, pd.DataFrame]]) -> Self:
+        store = cls()
+        for x, Y, metadata in blocks:
+            meta = pd.DataFrame([json.loads(value) if value else {} for value in metadata.get("meta", [None] * len(metadata))])
+            fields = metadata.drop(columns=["meta", "paths"], errors="ignore").rename(columns={"date": "timestamp"})
+            fields = pd.concat([fields.reset_index(drop=True), meta.drop(columns=["_id"], errors="ignore")], axis=1)
+            store._add_block(x, Y, fields.convert_dtypes())
+        return store
+
+    @classmethod
+    def from_parquet(cls, path: str | Path) -> Self:
+        """
+        A store of a file written by `raman.columnar.write_parquet`.
+        """
+        from raman.columnar import read_parquet
+
+        return cls._from_columnar([read_parquet(path, as_samples=False)])  # type: ignore
+
+    @classmethod
+    def from_hdf5(cls, path: str | Path) -> Self:
+        """
+        A store of a file written by `raman.columnar.write_hdf5`.
+        """
+        from raman.columnar import read_hdf5
+
+        return cls._from_columnar(read_hdf5(path, as_samples=False))  # type: ignore
+
+    def count(self, match: dict[str, Any] | None = None) -> int:
+        """
+        Number of documents matching a query.
+        """
+        return sum(int(_match(fields, match or {}).sum()) for _, _, fields in self._iter_blocks())
+
+    def mean_spectra(
+        self,
+        by: str | list[str] | None = None,
+        match: dict[str, Any] | None = None,
+        weight: str | None = "accumulation",
+    ) -> list[Sample]:
+        """
+        See `raman.spectra.mean_spectra`.
+        """
+        by = _by(by)
+        groups: dict[tuple, dict[str, Any]] = {}
+        for x, Y, fields in self._iter_blocks():
+            mask = _match(fields, match or {})
+            if mask.any() == False:
+                continue
+            selected = fields[mask].reset_index(drop=True)
+            Y = Y[mask]
+            if weight is None or weight not in selected:
+                w = np.ones(len(selected))
+            else:
+                w = pd.to_numeric(selected[weight], errors="coerce").fillna(1).to_numpy(dtype=np.float64)
+            # Spectra of different exposures are never averaged together, like `Sample.__or__`
+            for key, rows in _group_indices(selected, by if "exposure" in by else [*by, "exposure"]):
+                axis = {"first": float(x[0]), "last": float(x[-1]), "size": int(x.shape[0]), "exposure": key.get("exposure")}
+                key = {field: key[field] for field in by}
+                name = (tuple(key.items()), tuple(axis.values()))
+                group = groups.setdefault(name, {"_id": {"key": key, "axis": axis}, "x": 0.0, "sum": 0.0, "weight": 0.0, "n": 0})
+                group["x"] = group["x"] + x * rows.shape[0]
+                group["sum"] = group["sum"] + w[rows] @ Y[rows]
+                group["weight"] += float(w[rows].sum())
+                group["n"] += int(rows.shape[0])
+        for group in groups.values():
+            group["x"] = group["x"] / group["n"]
+        return _mean_samples(groups.values(), by)
+
+    def band_statistics(
+        self,
+        bands: Iterable[Band],
+        by: str | list[str] | None = None,
+        match: dict[str, Any] | None = None,
+    ) -> pd.DataFrame:
+        """
+        See `raman.spectra.band_statistics`.
+        """
+        by, bands = _by(by), [(float(low), float(high)) for low, high in bands]
+        values: list[pd.DataFrame] = []
+        for x, Y, fields in self._iter_blocks():
+            mask = _match(fields, match or {})
+            if mask.any() == False:
+                continue
+            table = fields[mask].reindex(columns=by).reset_index(drop=True)
+            means = band_means(x, Y[mask], bands)
+            for index in range(len(bands)):
+                table[_band_field(index)] = means[:, index]
+            values.append(table)
+        if len(values) == 0:
+            return _band_frame([], bands, by)
+        table = pd.concat(values, ignore_index=True)
+        groups: list[dict[str, Any]] = []
+        for key, rows in _group_indices(table, by):
+            group: dict[str, Any] = {"_id": key}
+            for index in range(len(bands)):
+                field = _band_field(index)
+                column = table[field].to_numpy(dtype=np.float64)[rows]
+                column = column[np.isnan(column) == False]
+                group[f"{field}_n"] = column.shape[0]
+                empty = column.shape[0] == 0
+                group[f"{field}_mean"] = None if empty else column.mean()
+                group[f"{field}_std"] = None if empty else column.std()
+                group[f"{field}_min"] = None if empty else column.min()
+                group[f"{field}_max"] = None if empty else column.max()
+            groups.append(group)
+        return _band_frame(groups, bands, by)
+
+    def __repr__(self) -> str:
+        return f"EmbeddedStore(n_documents={len(self)}, n_axes={len(self._blocks)})"
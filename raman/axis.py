@@ -0,0 +1,113 @@
+import numpy as np
+from numpy.typing import NDArray
+
+import hashlib
+import threading
+from weakref import WeakValueDictionary
+
+# Registry of shared Raman Shift axes, keyed by content.
+# Axes are kept only as long as a `Sample` (or anyone else) references them.
+_axes: WeakValueDictionary[tuple, np.ndarray] = WeakValueDictionary()
+# id(axis) -> axis, to tell in O(1) whether an array is an interned axis.
+_interned: WeakValueDictionary[int, np.ndarray] = WeakValueDictionary()
+# (start, stop, step, dtype) -> content key, so `arange_axis` does not rebuild or rehash a known grid.
+_grids: dict[tuple, tuple] = {}
+# Guards the lookup and the registration, so two threads interning the same content share one axis.
+_lock = threading.Lock()
+
+
+def axis_key(x: NDArray) -> tuple:
+    """
+    The content key of an axis: (dtype, length, digest of the bytes).
+    """
+    x = np.ascontiguousarray(x)
+    digest = hashlib.blake2b(x.data, digest_size=16).hexdigest()  # type: ignore
+    return (x.dtype.str, x.shape[0], digest)
+
+
+def is_interned(x: NDArray) -> bool:
+    """
+    Return True if `x` is an axis shared through the registry.
+    """
+    return _interned.get(id(x)) is x
+
+
+def intern_axis(x: NDArray) -> NDArray:
+    """
+    Return the shared read-only axis with the same content as `x`.
+
+    The first time an axis is seen it is registered (as a read-only copy if `x` is writable).
+    Later calls with the same content return the registered array, so `a is b` is enough to compare axes.
+
+    Parameters
+    ----------
+    x : NDArray of shape (n_shifts, )
+        The Raman Shift.
+
+    Returns
+    -------
+    NDArray of shape (n_shifts, ) :
+        The shared read-only axis.
+    """
+    if is_interned(x):
+        return x
+    if x.ndim != 1:
+        raise ValueError(f"Expecting an axis of 1 dimension but got shape={x.shape}")
+    key = axis_key(x)
+    with _lock:
+        shared = _axes.get(key)
+        if shared is None:
+            shared = x if (x.flags.writeable == False and x.flags.c_contiguous and x.base is None) else x.copy()
+            shared.setflags(write=False)
+            _axes[key] = shared
+            _interned[id(shared)] = shared
+    return shared
+
+
+def arange_axis(start: float, stop: float, step: float, dtype: type | np.dtype = np.float64) -> NDArray:
+    """
+    The interned version of `np.arange(start, stop, step, dtype=dtype)`.
+    A grid that is already registered is returned without allocating or hashing.
+    """
+    grid = (float(start), float(stop), float(step), np.dtype(dtype).str)
+    key = _grids.get(grid)
+    if key is not None:
+        shared = _axes.get(key)
+        if shared is not None:
+            return shared
+    shared = intern_axis(np.arange(start, stop, step=step).astype(dtype, copy=False))
+    _grids[grid] = axis_key(shared)
+    return shared
+
+
+def same_axis(a: NDArray, b: NDArray) -> bool:
+    """
+    Compare two axes. Interned axes are compared by identity, others element by element.
+    """
+    if a is b:
+        return True
+    if a.shape != b.shape:
+        return False
+    if a.dtype == b.dtype and is_interned(a) and is_interned(b):
+        return False
+    return bool((a == b).all())
+
+
+def axis_groups(samples: list) -> dict[int, list]:
+    """
+    Group samples by their (shared) Raman Shift.
+
+    Parameters
+    ----------
+    samples : list of Sample
+        The samples to group.
+
+    Returns
+    -------
+    dict :
+        id of the shared axis -> list of the samples on that axis, in the input order.
+    """
+    groups: dict[int, list] = {}
+    for sample in samples:
+        groups.setdefault(id(intern_axis(sample.x)), []).append(sample)
+    return groups
@@ -0,0 +1,298 @@
+import numpy as np
+from numpy.typing import NDArray
+
+
+def roi_mask(x: NDArray[np.float64], roi: NDArray[np.float64] | None = None) -> NDArray[np.bool_]:
+    """
+    Convert regions of interest into a boolean mask over the Raman Shift `x`.
+
+    Parameters
+    ----------
+    x : NDArray of shape (n_shifts, )
+        The Raman Shift.
+    roi : NDArray of shape (n_regions, 2) or None
+        Each row is a [low, high] Raman Shift range used to fit the baseline (the same convention as `rampy.baseline`).
+        Default is None, which uses the whole `x`.
+
+    Returns
+    -------
+    NDArray of shape (n_shifts, ) :
+        True where `x` lies inside any of the regions.
+    """
+    if roi is None:
+        return np.ones(x.shape, dtype=bool)
+    roi = np.asarray(roi, dtype=np.float64).reshape(-1, 2)
+    mask = (x[None, :] >= roi[:, [0]]) & (x[None, :] <= roi[:, [1]])
+    return mask.any(axis=0)
+
+
+def poly_baseline(
+    x: NDArray[np.float64],
+    Y: NDArray[np.float64],
+    order: int = 1,
+    roi: NDArray[np.float64] | None = None,
+) -> NDArray[np.float64]:
+    """
+    Fit a polynomial baseline to every spectrum of a stack with a single least-squares solve.
+
+    All spectra share the same Raman Shift, so the Vandermonde matrix of the ROI is built once
+    and every spectrum becomes one right-hand side of the same `np.linalg.lstsq` call.
+
+    Parameters
+    ----------
+    x : NDArray of shape (n_shifts, )
+        The Raman Shift shared by all spectra.
+    Y : NDArray of shape (n_spectra, n_shifts) or (n_shifts, )
+        The intensity of the spectra.
+    order : int
+        The order of the polynomial.
+    roi : NDArray of shape (n_regions, 2) or None
+        The [low, high] Raman Shift regions the polynomial is fitted on. Default is the whole range.
+
+    Returns
+    -------
+    NDArray :
+        The baselines, same shape as `Y`.
+    """
+    if order < 1:
+        raise ValueError(f"order must be greater than 0. Got {order=}")
+    Y = np.asarray(Y)
+    squeeze = Y.ndim == 1
+    Y = np.atleast_2d(Y)
+    if Y.shape[1] != x.shape[0]:
+        raise ValueError(f"shape mismatch between x={x.shape} and Y={Y.shape}")
+
+    mask = roi_mask(x, roi)
+    if mask.sum() <= order:
+        raise ValueError(f"roi contains {mask.sum()} points which is not enough for {order=}")
+
+    # Scale x into [-1, 1] so that the Vandermonde matrix stays well conditioned.
+    center = (x.max() + x.min()) / 2
+    half = (x.max() - x.min()) / 2
+    t = (x - center) / (half if half > 0 else 1.0)
+    V = np.vander(t, N=order + 1, increasing=True)
+
+    coef, *_ = np.linalg.lstsq(V[mask], Y[:, mask].T, rcond=None)
+    base = (V @ coef).T
+    return base[0] if squeeze else base
+
+
+def _second_difference_bands(n: int, lam: float) -> tuple[NDArray, NDArray, NDArray]:
+    """
+    The three upper bands of `lam * D.T @ D` where `D` is the (n-2, n) second difference matrix.
+    """
+    # Every row of D is (1, -2, 1) starting at column j, for j in [0, n-2)
+    band0 = np.zeros(n)
+    band1 = np.zeros(n - 1)
+    band2 = np.zeros(n - 2)
+    band0[:-2] += 1.0
+    band0[1:-1] += 4.0
+    band0[2:] += 1.0
+    band1[:-1] += -2.0
+    band1[1:] += -2.0
+    band2[:] = 1.0
+    return lam * band0, lam * band1, lam * band2
+
+
+def _solve_pentadiagonal(
+    a: NDArray[np.float64],
+    b: NDArray[np.float64],
+    c: NDArray[np.float64],
+    r: NDArray[np.float64],
+) -> NDArray[np.float64]:
+    """
+    Solve a stack of symmetric positive definite pentadiagonal systems with a banded LDL' factorization.
+
+    Parameters
+    ----------
+    a : NDArray of shape (n_spectra, n)
+        The main diagonal of every system.
+    b : NDArray of shape (n - 1, )
+        The first super-diagonal, shared by every system.
+    c : NDArray of shape (n - 2, )
+        The second super-diagonal, shared by every system.
+    r : NDArray of shape (n_spectra, n)
+        The right-hand sides.
+
+    Returns
+    -------
+    NDArray of shape (n_spectra, n) :
+        The solutions.
+    """
+    m, n = a.shape
+    d = np.empty((m, n))
+    l1 = np.zeros((m, n))
+    l2 = np.zeros((m, n))
+    z = np.empty((m, n))
+
+    # Factorization and forward substitution walk along the spectrum once, vectorized across spectra.
+    for i in range(n):
+        di = a[:, i].copy()
+        zi = r[:, i].copy()
+        if i >= 1:
+            di -= l1[:, i - 1] ** 2 * d[:, i - 1]
+            zi -= l1[:, i - 1] * z[:, i - 1]
+        if i >= 2:
+            di -= l2[:, i - 2] ** 2 * d[:, i - 2]
+            zi -= l2[:, i - 2] * z[:, i - 2]
+        d[:, i] = di
+        z[:, i] = zi
+        if i < n - 1:
+            bi = b[i] - (l2[:, i - 1] * l1[:, i - 1] * d[:, i - 1] if i >= 1 else 0.0)
+            l1[:, i] = bi / di
+        if i < n - 2:
+            l2[:, i] = c[i] / di
+
+    z /= d
+    for i in range(n - 2, -1, -1):
+        z[:, i] -= l1[:, i] * z[:, i + 1]
+        if i < n - 2:
+            z[:, i] -= l2[:, i] * z[:, i + 2]
+    return z
+
+
+def als_baseline(
+    Y: NDArray[np.float64],
+    lam: float = 1e5,
+    p: float = 0.01,
+    niter: int = 10,
+    method: str = "asls",
+    ratio: float = 0.01,
+    weights: NDArray[np.float64] | None = None,
+    return_weights: bool = False,
+) -> NDArray[np.float64] | tuple[NDArray[np.float64], NDArray[np.float64]]:
+    """
+    Penalized least squares baseline (AsLS or arPLS) for a stack of spectra.
+
+    Every iteration solves `(W + lam * D.T @ D) z = W y` for all spectra at once with a banded solver,
+    then reweights all spectra in one vectorized step.
+    Spectra whose weights stop changing (relative change below `ratio`) are frozen and dropped from later iterations.
+
+    Parameters
+    ----------
+    Y : NDArray of shape (n_spectra, n_shifts) or (n_shifts, )
+        The intensity of the spectra, sampled on an evenly spaced Raman Shift.
+    lam : float
+        The smoothness of the baseline. Larger is smoother.
+    p : float
+        Only for 'asls'. The weight of points above the baseline. Recommended values are between 0.001 and 0.1.
+    niter : int
+        Maximum number of reweighting iterations.
+    method : str
+        'asls' for Asymmetric Least Squares (Eilers and Boelens, 2005).
+        'arpls' for Asymmetrically Reweighted Penalized Least Squares (Baek et al., 2015).
+    ratio : float
+        The convergence threshold on the relative change of the weights.
+    weights : NDArray or None
+        Warm start weights, for example the weights returned from a similar spectrum or a previous call.
+        Default is None, which starts with all weights equal to 1.
+    return_weights : bool
+        Default is False. When True, the final weights are returned together with the baselines.
+
+    Returns
+    -------
+    NDArray :
+        The baselines, same shape as `Y`.
+    NDArray :
+        Only when `return_weights` is True. The final weights, same shape as `Y`.
+    """
+    if method not in ["asls", "arpls"]:
+        raise ValueError(f"method={method} is not supported. Use 'asls' or 'arpls'.")
+    Y = np.asarray(Y, dtype=np.float64)
+    squeeze = Y.ndim == 1
+    Y = np.atleast_2d(Y)
+    m, n = Y.shape
+    if n < 3:
+        raise ValueError(f"spectrum must have at least 3 points. Got {n=}")
+
+    if weights is None:
+        w = np.ones((m, n))
+    else:
+        w = np.array(np.atleast_2d(weights), dtype=np.float64)
+        if w.shape != Y.shape:
+            w = np.broadcast_to(w, Y.shape).copy()
+
+    band0, band1, band2 = _second_difference_bands(n, lam)
+    Z = np.empty((m, n))
+    active = np.arange(m)
+    for _ in range(niter):
+        wa = w[active]
+        ya = Y[active]
+        za = _solve_pentadiagonal(wa + band0, band1, band2, wa * ya)
+        Z[active] = za
+
+        if method == "asls":
+            w_new = np.where(ya > za, p, 1 - p)
+        else:
+            residual = ya - za
+            negative = residual < 0
+            count = np.maximum(negative.sum(axis=1, keepdims=True), 1)
+            neg_mean = np.where(negative, residual, 0).sum(axis=1, keepdims=True) / count
+            neg_var = np.where(negative, (residual - neg_mean) ** 2, 0).sum(axis=1, keepdims=True) / count
+            neg_std = np.sqrt(neg_var)
+            neg_std[neg_std == 0] = np.finfo(np.float64).eps
+            exponent = np.clip(2 * (residual - (2 * neg_std - neg_mean)) / neg_std, -700, 700)
+            w_new = 1 / (1 + np.exp(exponent))
+
+        change = np.linalg.norm(w_new - wa, axis=1) / np.maximum(np.linalg.norm(wa, axis=1), 1e-12)
+        w[active] = w_new
+        active = active[change >= ratio]
+        if active.size == 0:
+            break
+
+    if squeeze:
+        Z, w = Z[0], w[0]
+    if return_weights:
+        return Z, w
+    return Z
+
+
+def _poly_rows(Y: NDArray[np.float64], x: NDArray[np.float64], **kwargs) -> NDArray[np.float64]:
+    return poly_baseline(x, Y, **kwargs)
+
+
+def _als_rows(Y: NDArray[np.float64], x: NDArray[np.float64], **kwargs) -> NDArray[np.float64]:
+    return als_baseline(Y, **kwargs)
+
+
+def baseline_samples(
+    samples: list,
+    order: int = 1,
+    roi: NDArray[np.float64] | None = None,
+    test: bool = False,
+    method: str = "poly",
+    workers: int = 1,
+    **kwargs,
+) -> NDArray[np.float64]:
+    """
+    The batched version of `Sample.baseline` for samples that share the same Raman Shift.
+
+    Parameters
+    ----------
+    samples : list of Sample
+        The samples to correct.
+    order, roi, test, method, kwargs :
+        The same as `Sample.baseline`.
+    workers : int
+        Default is 1. When greater than 1, the stack is split across worker processes through shared memory
+        (see `raman.shared.map_rows`).
+
+    Returns
+    -------
+    NDArray of shape (n_samples, n_shifts) :
+        The baseline of every sample.
+    """
+    from raman.sample import stack
+    from raman.shared import map_rows
+
+    x, Y = stack(samples)
+    if method == "poly":
+        base = map_rows(_poly_rows, Y, x=x, workers=workers, order=order, roi=roi)
+    elif method in ["asls", "arpls"]:
+        base = map_rows(_als_rows, Y, x=x, workers=workers, method=method, **kwargs)
+    else:
+        raise ValueError(f"method={method} is not supported. Use 'poly', 'asls' or 'arpls'. ")
+    if test == False:
+        for sample, y in zip(samples, base):
+            sample.y = sample.y - y
+    return base
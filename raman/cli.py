@@ -0,0 +1,528 @@
+"""
+The `raman` command line.
+
+    raman ingest data/pilot/s1 --kind finger --glycemic data/pilot --workers 4 --manifest ingest-manifest.json
+    raman preprocess data/SERs/txt --name-format name,grating,laser,exposure,accumulation,year,month,date,hour,minute,second,01 \\
+        --pipeline standard --workers 4 --output sers.parquet
+    raman preprocess --query '{"subject_id": "s1"}' --kind finger --pipeline emsc --reference glucose --output s1.h5
+    raman preprocess data/archive --pipeline als --workers 8 --checkpoint reprocess-archive --output archive.parquet
+    raman export data/SERs/txt --output sers.h5
+    raman benchmark baseline shared
+    raman synthesize --component glucose=glucose --component skin=skin.txt --range glucose=0:0.2 --dark data/noise/30s/txt \\
+        --count 1000000 --output synthetic.parquet
+    raman serve --model pls.npz --reference glucose --reference skin.txt --port 8765
+
+Progress and timing are written to stderr, so the command can run from a scheduler with its output logged.
+"""
+from raman.sample import Sample, NAME_FORMAT
+from raman.dataset import SampleSet
+
+import numpy as np
+
+import argparse
+import importlib
+import json
+import pkgutil
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from functools import partial
+from itertools import islice
+from pathlib import Path
+from time import perf_counter
+from typing import Any, Callable, Iterable, Iterator
+
+
+class Progress:
+    """
+    Count items and report the rate on stderr: in place on a terminal, every 10% (or every `every` items) in a log.
+    """
+
+    def __init__(self, label: str, total: int | None = None, quiet: bool = False, every: int = 100):
+        self.label: str = label
+        self.total: int | None = total
+        self.quiet: bool = quiet
+        self.every: int = max(total // 10, 1) if total else every
+        self.count: int = 0
+        self.start: float = perf_counter()
+        self._interactive: bool = sys.stderr.isatty()
+
+    @property
+    def elapsed(self) -> float:
+        return perf_counter() - self.start
+
+    def _line(self) -> str:
+        total = f"/{self.total}" if self.total is not None else ""
+        rate = self.count / self.elapsed if self.elapsed > 0 else 0.0
+        return f"[{self.label}] {self.count}{total}  {self.elapsed:7.1f} s  {rate:8.1f}/s"
+
+    def update(self, n: int = 1):
+        self.count += n
+        if self.quiet:
+            return
+        if self._interactive:
+            print(f"\r{self._line()}", end="", file=sys.stderr, flush=True)
+        elif self.count % self.every < n:
+            print(self._line(), file=sys.stderr, flush=True)
+
+    def done(self, message: str = ""):
+        if self.quiet:
+            return
+        end = "\n" if self._interactive else ""
+        print(f"{end}[{self.label}] done: {self.count} in {self.elapsed:.2f} s {message}".rstrip(), file=sys.stderr, flush=True)
+
+
+def _track(items: Iterable, progress: Progress) -> Iterator:
+    for item in items:
+        yield item
+        progress.update()
+
+
+############# Pipelines #############
+
+
+def _read_reference(value: str) -> Sample:
+    from raman.references import get_reference
+
+    # A .txt file or a reference in the database, loaded once per process (see raman.references)
+    return get_reference(value, normalize=None)
+
+
+def _emsc_correct(sample: Sample, reference: str, order: int):
+    from raman.model import EMSC
+    from raman.references import get_reference
+
+    # Resampled once per Raman Shift axis; the reference was loaded before the workers started
+    resampled = get_reference(reference, x=sample.x, normalize=None, validate=False)
+    emsc = EMSC(raman_shift=sample.x, order=order)
+    emsc.add_reference(resampled.y, name=resampled.name)
+    sample.y = emsc.correct(sample.y)
+
+
+def _raw(sampleset: SampleSet, args: argparse.Namespace):
+    pass
+
+
+def _standard(sampleset: SampleSet, args: argparse.Namespace):
+    sampleset.set_raman_range(min=args.low, max=args.high)
+    sampleset.smoothing()
+    sampleset.baseline(order=args.order)
+    sampleset.normalized(method="minmax")
+
+
+def _als(sampleset: SampleSet, args: argparse.Namespace):
+    sampleset.set_raman_range(min=args.low, max=args.high)
+    sampleset.despike()
+    sampleset.baseline(method="arpls")
+    sampleset.normalized(method="minmax")
+
+
+def _emsc(sampleset: SampleSet, args: argparse.Namespace):
+    if args.reference is None:
+        raise SystemExit(f"--pipeline emsc needs --reference (a .txt file or the name of a reference in the database)")
+    sampleset.set_raman_range(min=args.low, max=args.high)
+    sampleset.smoothing()
+    sampleset.normalized(method="minmax")
+    _read_reference(args.reference)
+    sampleset.map(partial(_emsc_correct, reference=args.reference, order=args.order))
+
+
+PIPELINES: dict[str, Callable[[SampleSet, argparse.Namespace], None]] = {
+    "raw": _raw,
+    "standard": _standard,
+    "als": _als,
+    "emsc": _emsc,
+}
+
+
+def _sampleset(args: argparse.Namespace, pipeline: str) -> SampleSet:
+    """
+    The files of a folder, screened when --qc is given, with the steps of a named pipeline recorded.
+    """
+    sampleset = SampleSet(
+        Path(args.folder),
+        name_format=args.name_format,
+        pattern=args.pattern,
+        workers=args.workers,
+        chunk_size=args.chunk_size,
+    )
+    if getattr(args, "qc", None) is not None:
+        from raman.qc import QualityGate
+
+        gate = QualityGate(window=(getattr(args, "low", 400), getattr(args, "high", 1800)), axis="common")
+        sampleset = sampleset.screen(gate, drop=args.qc == "drop")
+        failed = [reasons for reasons in sampleset.qc.values() if len(reasons) > 0]
+        if args.quiet == False:
+            counts = {reason: sum(reason in reasons for reasons in failed) for reason in sorted({r for reasons in failed for r in reasons})}
+            print(f"[qc] {len(failed)}/{len(sampleset.qc)} files failed {counts}", file=sys.stderr, flush=True)
+    PIPELINES[pipeline](sampleset, args)
+    return sampleset
+
+
+def _samples(args: argparse.Namespace, pipeline: str) -> tuple[Iterator[Sample], int | None]:
+    """
+    The processed samples of a folder or of a database query, streamed chunk by chunk, and their number if known.
+    """
+    if (args.folder is None) == (args.query is None):
+        raise SystemExit(f"Give either a folder or --query.")
+    if args.folder is not None:
+        sampleset = _sampleset(args, pipeline)
+        return iter(sampleset), len(sampleset)
+
+    from raman.spectra import iter_samples  # Connects to the database on import
+
+    recorder = SampleSet([], workers=args.workers, chunk_size=args.chunk_size)
+    PIPELINES[pipeline](recorder, args)
+    stream = iter_samples(kind=args.kind, query=json.loads(args.query), interpolate=True)
+
+    def chunks() -> Iterator[Sample]:
+        while chunk := list(islice(stream, args.chunk_size)):
+            yield from recorder.apply(chunk)
+
+    return chunks(), None
+
+
+def _write(samples: Iterable[Sample], output: Path) -> int:
+    from raman.columnar import write_parquet, write_hdf5
+
+    if output.suffix == ".parquet":
+        return write_parquet(samples, output)
+    if output.suffix in [".h5", ".hdf5"]:
+        return write_hdf5(samples, output)
+    raise SystemExit(f"Unknown output format {output.suffix}. Use .parquet, .h5 or .hdf5")
+
+
+############# Commands #############
+
+
+def _parse_file(model: Any, path: Path) -> tuple[Any, str | None]:
+    try:
+        return model.from_file(path=path), None
+    except (ValueError, IndexError) as error:
+        return None, f"{path.name}: {error}"
+
+
+def ingest(args: argparse.Namespace) -> int:
+    """
+    Parse every file of a folder and save it in the database (`raman.spectra`).
+    """
+    from raman.spectra import Finger, Blood, Reference  # Connects to the database on import
+    from pymongo.errors import DuplicateKeyError
+
+    model = {"finger": Finger, "blood": Blood, "reference": Reference}[args.kind]
+    folder = Path(args.folder)
+    paths = sorted(folder.glob(args.pattern))
+    manifest = None
+    if args.manifest is not None:
+        from raman.manifest import Manifest
+
+        manifest = Manifest(args.manifest)
+        plan = manifest.plan(paths)
+        paths = plan["new"] + plan["changed"]
+        if args.quiet == False:
+            counts = ", ".join(f"{len(value)} {key}" for key, value in plan.items())
+            print(f"[ingest] {args.manifest}: {counts}", file=sys.stderr, flush=True)
+    progress = Progress("ingest", total=len(paths), quiet=args.quiet)
+
+    glucose: dict[str, float] = {}
+    if args.kind == "finger" and args.glycemic is not None:
+        import pandas as pd
+        from raman.glycemic import read_glycemic, join_glucose
+
+        subject = args.subject or folder.name
+        spectra = pd.DataFrame({"subject": subject, "prefix": [path.name.split("_")[0] for path in paths]})
+        glucose = dict(zip(spectra["prefix"], join_glucose(spectra, read_glycemic(args.glycemic), method="prefix")))
+
+    saved, duplicates, errors = 0, 0, []
+    pool = ProcessPoolExecutor(max_workers=args.workers) if args.workers > 1 else nullcontext()
+    with pool as executor:
+        parse = partial(_parse_file, model)
+        parsed = executor.map(parse, paths, chunksize=16) if executor is not None else map(parse, paths)
+        for path, (item, error) in zip(paths, parsed):
+            progress.update()
+            if error is not None:
+                errors.append(error)
+                if manifest is not None:
+                    manifest.record(path, status="error", error=error)
+                continue
+            if args.kind == "finger":
+                item.subject_id = args.subject or folder.name
+                value = glucose.get(path.name.split("_")[0], np.nan)
+                item.glucose = None if np.isnan(value) else int(value)
+            if manifest is not None:
+                # A changed file updates its document instead of adding one
+                item._id = manifest.document_of(path)
+            try:
+                item.save()
+                saved += 1
+                if manifest is not None:
+                    manifest.record(path, documents=[item._id])
+            except DuplicateKeyError:
+                duplicates += 1
+                if manifest is not None:
+                    manifest.record(path, status="exists")
+            if manifest is not None and progress.count % 500 == 0:
+                # Keep the work of an interrupted run
+                manifest.save()
+    if manifest is not None:
+        manifest.save()
+    progress.done(f"({saved} saved, {duplicates} already in the database, {len(errors)} not parsed)")
+    for error in errors:
+        print(f"  skipped {error}", file=sys.stderr)
+    return 0
+
+
+def preprocess(args: argparse.Namespace) -> int:
+    """
+    Run a named pipeline over a folder or a query, and write the result when --output is given.
+    """
+    if args.cache is not None:
+        from raman import memo
+
+        memo.enable(directory=args.cache)
+    if args.checkpoint is not None:
+        return _checkpointed(args)
+    samples, total = _samples(args, args.pipeline)
+    progress = Progress(args.pipeline if args.command == "preprocess" else args.command, total=total, quiet=args.quiet)
+    if args.output is None:
+        for _ in _track(samples, progress):
+            pass
+        progress.done()
+    else:
+        _write(_track(samples, progress), Path(args.output))
+        progress.done(f"-> {args.output}")
+    if args.cache is not None and args.quiet == False:
+        print(f"[cache] {memo.get_cache().stats}", file=sys.stderr)  # type: ignore
+    return 0
+
+
+def _checkpointed(args: argparse.Namespace) -> int:
+    """
+    `preprocess` as a resumable job: the shards are written to --checkpoint and merged into --output at the end.
+    """
+    from raman.jobs import ShardJob, JobLockedError
+
+    if args.folder is None:
+        raise SystemExit(f"--checkpoint needs a folder: a query has no stable order to resume from.")
+    output = None if args.output is None else Path(args.output)
+    config = {
+        "folder": Path(args.folder).resolve().as_posix(),
+        "pattern": args.pattern,
+        "name_format": args.name_format,
+        "pipeline": args.pipeline,
+        "qc": args.qc,
+        **{key: getattr(args, key, None) for key in ["low", "high", "order", "reference"]},
+    }
+    sampleset = _sampleset(args, args.pipeline)
+    try:
+        job = ShardJob(
+            args.checkpoint,
+            sampleset,
+            shard_size=args.shard_size,
+            suffix=".parquet" if output is None or output.suffix == ".parquet" else ".h5",
+            config=config,
+            restart=args.restart,
+        )
+    except ValueError as error:
+        raise SystemExit(f"{error} (--restart)")
+    progress = Progress(args.pipeline if args.command == "preprocess" else args.command, total=len(sampleset), quiet=args.quiet)
+    progress.update(sum(shard["stop"] - shard["start"] for shard in job.shards if shard["status"] == "done"))
+
+    def report(shard: dict[str, Any]):
+        progress.update(shard["stop"] - shard["start"])
+        if shard["status"] == "failed" and args.quiet == False:
+            print(f"\n  shard {shard['index']} failed: {shard['error']}", file=sys.stderr, flush=True)
+
+    try:
+        summary = job.run(only_failed=args.only_failed, callback=report)
+    except JobLockedError as error:
+        raise SystemExit(str(error))
+    except KeyboardInterrupt:
+        progress.done(f"interrupted: {job.summary()} in {args.checkpoint}. Run again to resume.")
+        return 130
+    progress.done(f"{summary} in {args.checkpoint}")
+    if summary["failed"] > 0 or len(job.pending) > 0:
+        print(f"Run again to resume, or with --only-failed to retry the failed shards.", file=sys.stderr)
+        return 1
+    if output is not None:
+        n = job.merge(output)
+        if args.quiet == False:
+            print(f"[merge] {n} samples -> {output}", file=sys.stderr)
+    return 0
+
+
+def export(args: argparse.Namespace) -> int:
+    """
+    Write a folder or a query to a columnar file without preprocessing.
+    """
+    args.cache = None
+    args.pipeline = "raw"
+    return preprocess(args)
+
+
+def benchmark(args: argparse.Namespace) -> int:
+    """
+    Run the `benchmarks` suite (from the repository root), or the given benchmarks.
+    """
+    try:
+        import benchmarks
+    except ImportError:
+        raise SystemExit(f"The benchmarks package is not importable. Run `raman benchmark` from the repository root.")
+    available = sorted(module.name.removeprefix("bench_") for module in pkgutil.iter_modules(benchmarks.__path__) if module.name.startswith("bench_"))
+    names = args.names or available
+    for name in names:
+        if name not in available:
+            raise SystemExit(f"Unknown benchmark {name}. Available: {', '.join(available)}")
+    for name in names:
+        start = perf_counter()
+        importlib.import_module(f"benchmarks.bench_{name}").main()
+        print(f"[benchmark] {name} done in {perf_counter() - start:.1f} s", file=sys.stderr, flush=True)
+    return 0
+
+
+def serve(args: argparse.Namespace) -> int:
+    """
+    Load a model and its references once and answer glucose estimates over HTTP (see raman.serve).
+    """
+    from raman.model import IncrementalPLS
+    from raman.serve import GlucoseEstimator, serve as run_service
+
+    if Path(args.model).exists():
+        model = IncrementalPLS.load(args.model)
+    else:
+        model = IncrementalPLS.from_database(args.model)
+    estimator = GlucoseEstimator(model, args.reference, order=args.order)
+    if args.quiet == False:
+        print(f"[serve] http://{args.host}:{args.port} ({len(args.reference)} references, {estimator.x.shape[0]} shifts)", file=sys.stderr, flush=True)
+    try:
+        run_service(estimator, host=args.host, port=args.port, max_batch=args.max_batch, max_delay=args.max_delay_ms / 1000)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def synthesize(args: argparse.Namespace) -> int:
+    """
+    Write synthetic spectra mixed from references (see raman.synthetic).
+    """
+    from raman.synthetic import SpectrumGenerator
+
+    components = dict(value.split("=", 1) for value in args.component)
+    coefficients = {}
+    for value in args.range:
+        name, bounds = value.split("=", 1)
+        low, high = bounds.split(":")
+        coefficients[name] = (float(low), float(high))
+    generator = SpectrumGenerator(
+        components,
+        coefficients=coefficients,
+        x=np.arange(args.low, args.high + 1, 1.0),
+        dark_frames=args.dark,
+        spike_rate=args.spike_rate,
+        seed=args.seed,
+    )
+    progress = Progress("synthesize", total=args.count, quiet=args.quiet)
+    n = generator.write(args.output, args.count, batch_size=args.batch_size)
+    progress.update(n)
+    progress.done()
+    return 0
+
+
+def _add_source(parser: argparse.ArgumentParser):
+    parser.add_argument("folder", nargs="?", help="A folder of .txt files.")
+    parser.add_argument("--query", help="A MongoDB query (JSON) on the --kind collection, instead of a folder.")
+    parser.add_argument("--kind", choices=["finger", "blood", "reference"], default="finger")
+    parser.add_argument("--pattern", default="*.txt", help="The glob pattern of the files in the folder.")
+    parser.add_argument(
+        "--name-format",
+        type=lambda value: value.split(","),
+        default=NAME_FORMAT,
+        help="The comma separated naming scheme of the files. See raman.sample.read_txt.",
+    )
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--chunk-size", type=int, default=64)
+    parser.add_argument("--output", help="A .parquet, .h5 or .hdf5 file.")
+    parser.add_argument(
+        "--checkpoint",
+        help="Only for a folder. A job folder: the files are processed in shards checkpointed there, and a run resumes from the last completed shard (see raman.jobs).",
+    )
+    parser.add_argument("--shard-size", type=int, default=1024, help="Only with --checkpoint. Number of files per shard.")
+    parser.add_argument("--only-failed", action="store_true", help="Only with --checkpoint. Run only the shards that failed.")
+    parser.add_argument("--restart", action="store_true", help="Only with --checkpoint. Discard the previous job in the folder.")
+    parser.add_argument(
+        "--qc",
+        choices=["drop", "tag"],
+        help="Only for a folder. Check the raw files first (see raman.qc) and drop the bad ones, or tag them in meta['qc'].",
+    )
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="raman", description="Batch processing of Raman spectra.")
+    parser.add_argument("--quiet", action="store_true", help="Do not report progress.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    parser_ingest = commands.add_parser("ingest", help="Save the files of a folder in the database.")
+    parser_ingest.add_argument("folder")
+    parser_ingest.add_argument("--kind", choices=["finger", "blood", "reference"], default="finger")
+    parser_ingest.add_argument("--pattern", default="[0-9]*.txt")
+    parser_ingest.add_argument("--subject", help="Only for finger. Default is the name of the folder.")
+    parser_ingest.add_argument("--glycemic", help="Only for finger. The folder of the s<id>.csv glycemic tables.")
+    parser_ingest.add_argument("--workers", type=int, default=1)
+    parser_ingest.add_argument(
+        "--manifest",
+        help="A JSON manifest of the ingested files (see raman.manifest). Only new or changed files are parsed, duplicates are skipped.",
+    )
+    parser_ingest.set_defaults(run=ingest)
+
+    parser_preprocess = commands.add_parser("preprocess", help="Run a named pipeline over a folder or a query.")
+    _add_source(parser_preprocess)
+    parser_preprocess.add_argument("--pipeline", choices=list(PIPELINES), default="standard")
+    parser_preprocess.add_argument("--low", type=float, default=400, help="Start of the Raman Shift range.")
+    parser_preprocess.add_argument("--high", type=float, default=1800, help="End of the Raman Shift range.")
+    parser_preprocess.add_argument("--order", type=int, default=1, help="Polynomial order of the baseline or of the EMSC.")
+    parser_preprocess.add_argument("--reference", help="Only for --pipeline emsc. A .txt file or a reference name in the database.")
+    parser_preprocess.add_argument("--cache", help="A folder to memoize the steps in (see raman.memo).")
+    parser_preprocess.set_defaults(run=preprocess)
+
+    parser_export = commands.add_parser("export", help="Write a folder or a query to a columnar file.")
+    _add_source(parser_export)
+    parser_export.set_defaults(run=export)
+
+    parser_benchmark = commands.add_parser("benchmark", help="Run the benchmark suite.")
+    parser_benchmark.add_argument("names", nargs="*", help="Default is every benchmark.")
+    parser_benchmark.set_defaults(run=benchmark)
+
+    parser_synthesize = commands.add_parser("synthesize", help="Write synthetic spectra for load tests.")
+    parser_synthesize.add_argument("--component", action="append", required=True, help="NAME=SOURCE, a .txt file or a reference name in the database. Repeat for more components.")
+    parser_synthesize.add_argument("--range", action="append", default=[], help="NAME=LOW:HIGH, the range of the mixing coefficient of a component. Default is 0:1.")
+    parser_synthesize.add_argument("--dark", help="A folder of dark frames (.txt), for example data/noise/30s/txt.")
+    parser_synthesize.add_argument("--count", type=int, default=10000)
+    parser_synthesize.add_argument("--batch-size", type=int, default=10000)
+    parser_synthesize.add_argument("--low", type=float, default=400, help="Start of the Raman Shift range.")
+    parser_synthesize.add_argument("--high", type=float, default=1800, help="End of the Raman Shift range.")
+    parser_synthesize.add_argument("--spike-rate", type=float, default=0.1, help="Mean number of cosmic spikes per spectrum.")
+    parser_synthesize.add_argument("--seed", type=int, default=0)
+    parser_synthesize.add_argument("--output", required=True, help="A .parquet, .h5, .hdf5 or .npy file, or a folder of .txt files.")
+    parser_synthesize.set_defaults(run=synthesize)
+
+    parser_serve = commands.add_parser("serve", help="Serve glucose estimates of a model on localhost.")
+    parser_serve.add_argument("--model", required=True, help="An IncrementalPLS .npz file or a model name in the database.")
+    parser_serve.add_argument("--reference", action="append", required=True, help="A .txt file or a reference name in the database. Repeat for more references, the analyte first.")
+    parser_serve.add_argument("--order", type=int, default=5, help="Polynomial order of the EMSC.")
+    parser_serve.add_argument("--host", default="127.0.0.1")
+    parser_serve.add_argument("--port", type=int, default=8765)
+    parser_serve.add_argument("--max-batch", type=int, default=64)
+    parser_serve.add_argument("--max-delay-ms", type=float, default=5)
+    parser_serve.set_defaults(run=serve)
+    return parser
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = build_parser().parse_args(argv)
+    if getattr(args, "output", "") is None and args.command == "export":
+        raise SystemExit(f"export needs --output")
+    return args.run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
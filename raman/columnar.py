@@ -0,0 +1,312 @@
+"""
+Bulk export and import of sample collections in columnar formats.
+
+- Parquet (needs `pyarrow`): one row per sample, the intensity in a fixed-size-list column and the
+  metadata in regular columns. All samples must share one Raman Shift, which is written once in the schema metadata.
+- HDF5 (needs `h5py`): one group per shared Raman Shift with the axis, a chunked and compressed
+  (n_samples, n_shifts) intensity dataset and one dataset per metadata field.
+
+Both writers consume any iterable of `Sample` (for example a `raman.dataset.SampleSet`) in batches,
+so the collection never has to be held in memory at once.
+"""
+from raman.sample import Sample
+from raman.axis import axis_key, intern_axis, same_axis
+
+import numpy as np
+from numpy.typing import NDArray
+import pandas as pd
+
+import json
+from itertools import islice
+from pathlib import Path
+from typing import Any, Iterable, Iterator
+
+METADATA_COLUMNS: list[str] = [
+    "name",
+    "date",
+    "exposure",
+    "accumulation",
+    "grating",
+    "laser",
+    "power",
+    "lens",
+    "slit",
+    "paths",
+    "meta",
+]
+
+
+def _require(module: str):
+    try:
+        return __import__(module)
+    except ImportError:
+        raise ImportError(
+            f"`{module}` is required for this format. Install it with `uv add {module}` or `pip install {module}`."
+        )
+
+
+def _batches(samples: Iterable[Sample], batch_size: int) -> Iterator[list[Sample]]:
+    iterator = iter(samples)
+    while batch := list(islice(iterator, batch_size)):
+        yield batch
+
+
+def _metadata_of(sample: Sample) -> dict[str, Any]:
+    return {
+        "name": getattr(sample, "name", None),
+        "date": getattr(sample, "date", None),
+        "exposure": getattr(sample, "exposure", None),
+        "accumulation": getattr(sample, "accumulation", None),
+        "grating": None if getattr(sample, "grating", None) is None else str(sample.grating),
+        "laser": None if getattr(sample, "laser", None) is None else str(sample.laser),
+        "power": getattr(sample, "power", None),
+        "lens": getattr(sample, "lens", None),
+        "slit": getattr(sample, "slit", None),
+        "paths": sorted(path.as_posix() for path in sample.paths),
+        "meta": json.dumps(sample.meta, default=str),
+    }
+
+
+def _to_samples(x: NDArray, Y: NDArray, metadata: pd.DataFrame) -> list[Sample]:
+    samples: list[Sample] = []
+    for y, row in zip(Y, metadata.to_dict(orient="records")):
+        sample = Sample(x=x, y=y, interpolate=False, dtype=Y.dtype)
+        for key in ["name", "exposure", "accumulation", "grating", "laser", "power", "lens", "slit"]:
+            if row.get(key) is not None and not (isinstance(row[key], float) and np.isnan(row[key])):
+                setattr(sample, key, row[key])
+        if row.get("date") is not None and not pd.isna(row["date"]):
+            sample.date = pd.Timestamp(row["date"]).to_pydatetime()
+        # Parquet gives the paths back as an array, which has no truth value
+        paths = row.get("paths")
+        sample.paths = set(Path(path) for path in ([] if paths is None else paths))
+        sample.meta = json.loads(row["meta"]) if row.get("meta") else {}
+        samples.append(sample)
+    return samples
+
+
+############# Parquet #############
+
+
+def _parquet_schema(pa, x: NDArray, dtype: np.dtype):
+    # Declared up front: a type inferred from a first batch without (for example) dates would be `null`,
+    # which no later batch with values can be cast to
+    return pa.schema(
+        [
+            ("name", pa.string()),
+            ("date", pa.timestamp("us")),
+            ("exposure", pa.int64()),
+            ("accumulation", pa.int64()),
+            ("grating", pa.string()),
+            ("laser", pa.string()),
+            ("power", pa.float64()),
+            ("lens", pa.string()),
+            ("slit", pa.float64()),
+            ("paths", pa.list_(pa.string())),
+            ("meta", pa.string()),
+            ("intensity", pa.list_(pa.from_numpy_dtype(dtype), x.shape[0])),
+        ],
+        metadata={b"raman.x": np.ascontiguousarray(x).tobytes(), b"raman.x.dtype": x.dtype.str.encode()},
+    )
+
+
+def write_parquet(
+    samples: Iterable[Sample],
+    path: str | Path,
+    batch_size: int = 4096,
+    compression: str = "zstd",
+) -> int:
+    """
+    Write samples that share one Raman Shift to a Parquet file.
+
+    Parameters
+    ----------
+    samples : iterable of Sample
+        The samples to write, for example a list or a `SampleSet`.
+    path : str or pathlib.Path
+        The target file.
+    batch_size : int
+        Number of samples per row group. Only one batch is held in memory at a time.
+    compression : str
+        The Parquet compression codec.
+
+    Returns
+    -------
+    int :
+        Number of samples written.
+    """
+    pa = _require("pyarrow")
+    import pyarrow.parquet as pq  # type: ignore
+
+    writer = None
+    x: NDArray | None = None
+    n = 0
+    try:
+        for batch in _batches(samples, batch_size):
+            if x is None:
+                x = batch[0].x
+            for sample in batch:
+                if same_axis(x, sample.x) == False:
+                    raise ValueError(
+                        f"Expect all samples to have the same Raman Shift range. Use `write_hdf5` for several ranges."
+                    )
+            Y = np.vstack([sample.y for sample in batch])
+            if writer is None:
+                schema = _parquet_schema(pa, x, Y.dtype)
+                writer = pq.ParquetWriter(str(path), schema, compression=compression)
+            values = pa.array(Y.ravel().astype(schema.field("intensity").type.value_type.to_pandas_dtype(), copy=False))
+            intensity = pa.FixedSizeListArray.from_arrays(values, Y.shape[1])
+            metadata = pd.DataFrame([_metadata_of(sample) for sample in batch], columns=METADATA_COLUMNS)
+            table = pa.Table.from_pandas(metadata, schema=pa.schema(list(schema)[:-1]), preserve_index=False)
+            writer.write_table(pa.Table.from_arrays([*table.columns, intensity], schema=schema))
+            n += len(batch)
+    finally:
+        if writer is not None:
+            writer.close()
+    if n == 0:
+        raise ValueError(f"samples must not be empty.")
+    return n
+
+
+def read_parquet(
+    path: str | Path, as_samples: bool = True, columns: list[str] | None = None
+) -> list[Sample] | tuple[NDArray, NDArray, pd.DataFrame]:
+    """
+    Read a file written by `write_parquet`.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        The Parquet file.
+    as_samples : bool
+        Default is True, which returns a list of `Sample`.
+        When False, returns `(x, Y, metadata)` where `Y` is a contiguous (n_samples, n_shifts) array
+        viewed directly on the Arrow buffer without per-row conversion (it is read-only).
+    columns : list of str or None
+        Only when `as_samples` is False. The metadata columns to read. Default is all.
+
+    Returns
+    -------
+    list of Sample, or tuple of (NDArray, NDArray, pandas.DataFrame)
+    """
+    _require("pyarrow")
+    import pyarrow.parquet as pq  # type: ignore
+
+    if as_samples:
+        columns = None
+    table = pq.read_table(str(path), columns=None if columns is None else list(columns) + ["intensity"])
+    schema_metadata = pq.read_schema(str(path)).metadata
+    x = intern_axis(np.frombuffer(schema_metadata[b"raman.x"], dtype=np.dtype(schema_metadata[b"raman.x.dtype"].decode())))
+
+    intensity = table.column("intensity").combine_chunks()
+    Y = intensity.values.to_numpy(zero_copy_only=True).reshape(len(intensity), x.shape[0])
+    metadata = table.drop_columns(["intensity"]).to_pandas()
+    if as_samples:
+        return _to_samples(x, Y, metadata)
+    return x, Y, metadata
+
+
+############# HDF5 #############
+
+
+def write_hdf5(
+    samples: Iterable[Sample],
+    path: str | Path,
+    batch_size: int = 4096,
+    compression: str = "gzip",
+    chunk_rows: int = 256,
+) -> int:
+    """
+    Write samples to an HDF5 file with one group per shared Raman Shift.
+
+    Parameters
+    ----------
+    samples : iterable of Sample
+        The samples to write, for example a list or a `SampleSet`.
+    path : str or pathlib.Path
+        The target file.
+    batch_size : int
+        Number of samples appended at a time. Only one batch is held in memory at a time.
+    compression : str
+        The HDF5 compression filter of the intensity datasets.
+    chunk_rows : int
+        Number of spectra per HDF5 chunk.
+
+    Returns
+    -------
+    int :
+        Number of samples written.
+    """
+    h5py = _require("h5py")
+
+    n = 0
+    with h5py.File(str(path), "w") as file:
+        # Keyed by the content of the axis: the id of an axis released with its batch can be reused by another one
+        groups: dict[tuple, Any] = {}
+        for batch in _batches(samples, batch_size):
+            by_axis: dict[tuple, list[Sample]] = {}
+            for sample in batch:
+                by_axis.setdefault(axis_key(sample.x), []).append(sample)
+            for key, members in by_axis.items():
+                x = members[0].x
+                group = groups.get(key)
+                if group is None:
+                    group = file.create_group(f"axis{len(groups)}")
+                    group.create_dataset("x", data=x)
+                    group.create_dataset(
+                        "intensity",
+                        shape=(0, x.shape[0]),
+                        maxshape=(None, x.shape[0]),
+                        dtype=members[0].y.dtype,
+                        chunks=(chunk_rows, x.shape[0]),
+                        compression=compression,
+                        shuffle=True,
+                    )
+                    for column in METADATA_COLUMNS:
+                        group.create_dataset(column, shape=(0,), maxshape=(None,), dtype=h5py.string_dtype(), chunks=(chunk_rows,))
+                    groups[key] = group
+                Y = np.vstack([sample.y for sample in members])
+                start = group["intensity"].shape[0]
+                group["intensity"].resize(start + Y.shape[0], axis=0)
+                group["intensity"][start:] = Y
+                rows = [_metadata_of(sample) for sample in members]
+                for column in METADATA_COLUMNS:
+                    values = [json.dumps(row[column], default=str) for row in rows]
+                    group[column].resize(start + len(values), axis=0)
+                    group[column][start:] = values
+            n += len(batch)
+    return n
+
+
+def read_hdf5(path: str | Path, as_samples: bool = True) -> list[Sample] | list[tuple[NDArray, NDArray, pd.DataFrame]]:
+    """
+    Read a file written by `write_hdf5`.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        The HDF5 file.
+    as_samples : bool
+        Default is True, which returns a list of `Sample`.
+        When False, returns one `(x, Y, metadata)` per shared Raman Shift, with `Y` read as one contiguous array.
+
+    Returns
+    -------
+    list of Sample, or list of tuple of (NDArray, NDArray, pandas.DataFrame)
+    """
+    h5py = _require("h5py")
+
+    results: list = []
+    with h5py.File(str(path), "r") as file:
+        for name in sorted(file.keys(), key=lambda key: int(key.removeprefix("axis"))):
+            group = file[name]
+            x = intern_axis(group["x"][()])
+            Y = group["intensity"][()]
+            metadata = pd.DataFrame(
+                {column: [json.loads(value) for value in group[column].asstr()[()]] for column in METADATA_COLUMNS}
+            )
+            metadata["date"] = pd.to_datetime(metadata["date"])
+            if as_samples:
+                results += _to_samples(x, Y, metadata)
+            else:
+                results.append((x, Y, metadata))
+    return results
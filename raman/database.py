@@ -6,12 +6,14 @@ MONGO_DB = "raman"
 MONGO_COLLECTION_BLOOD = "blood"
 MONGO_COLLECTION_FINGER = "finger"
 MONGO_COLLECTION_REFERENCE = "reference"
+MONGO_COLLECTION_MODEL = "model"
 
 client:MongoClient[Dict[str, Any]] = MongoClient(f'{os.environ["ME_CONFIG_MONGODB_URL"]}')
 db = client.get_database(MONGO_DB)
 collection_finger = db.get_collection(MONGO_COLLECTION_FINGER)
 collection_blood = db.get_collection(MONGO_COLLECTION_BLOOD)
 collection_ref   = db.get_collection(MONGO_COLLECTION_REFERENCE)
+collection_model = db.get_collection(MONGO_COLLECTION_MODEL)
 
 
 def create_collection():
@@ -20,6 +22,7 @@ def create_collection():
     collection_finger.create_index(["subject_id", "timestamp"], unique=True)
     collection_blood.create_index(["name", "timestamp"], unique=True)
     collection_ref.create_index(["name", "timestamp"], unique=True)
+    collection_model.create_index(["name", "timestamp"], unique=True)
 
 
 def reset_collection():
@@ -30,3 +33,5 @@ def reset_collection():
     collection_blood.create_index(["name", "timestamp"], unique=True)
     collection_ref.drop()
     collection_ref.create_index(["name", "timestamp"], unique=True)
+    collection_model.drop()
+    collection_model.create_index(["name", "timestamp"], unique=True)
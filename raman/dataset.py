@@ -1,91 +1,491 @@
-from raman.sample import Sample
+from raman.sample import Sample, read_txt, parse_filename, NAME_FORMAT
+from raman.baseline import baseline_samples
+from raman.axis import axis_groups, same_axis
+from raman.shared import map_samples
+from raman.figure import plot_samples
+from raman.peaks import PeakTable
+from raman.plan import Plan
+from raman.qc import QualityGate
+import numpy as np
 import matplotlib.pyplot as plt
 
-import math
 import logging
+from collections import OrderedDict
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from contextlib import nullcontext
+from itertools import count
 from pathlib import Path
+from typing import Any, Callable, Iterator, Self
 
 _logger = logging.getLogger(__name__)
 
+# Every change of a pipeline gets a new version, so cached results are never shared between different pipelines.
+_versions = count()
+
+
 class FolderNotFoundError(Exception):
     pass
 
 
+def _sample_nbytes(sample: Sample) -> int:
+    nbytes = sample.y.nbytes
+    if sample._y is not None and sample._y is not sample.y:
+        nbytes += sample._y.nbytes
+    return nbytes
+
+
+class SampleCache:
+    """
+    A size-bounded LRU cache of loaded (and preprocessed) samples.
+
+    Parameters
+    ----------
+    max_bytes : int
+        The memory budget of the intensity arrays kept in the cache.
+        The shared Raman Shift axes (see `raman.axis`) are not counted.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 2**20):
+        self.max_bytes: int = max_bytes
+        self.nbytes: int = 0
+        self._items: OrderedDict[tuple, tuple[Sample, int]] = OrderedDict()
+
+    def get(self, key: tuple) -> Sample | None:
+        item = self._items.get(key)
+        if item is None:
+            return None
+        self._items.move_to_end(key)
+        return item[0]
+
+    def put(self, key: tuple, sample: Sample):
+        if key in self._items:
+            self.nbytes -= self._items.pop(key)[1]
+        nbytes = _sample_nbytes(sample)
+        self._items[key] = (sample, nbytes)
+        self.nbytes += nbytes
+        while self.nbytes > self.max_bytes and len(self._items) > 1:
+            _, (_, evicted) = self._items.popitem(last=False)
+            self.nbytes -= evicted
+
+    def clear(self):
+        self._items.clear()
+        self.nbytes = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+def _load(path: Path, name_format: list[str], interpolate: bool) -> Sample:
+    return read_txt(path=path, name_format=name_format, interpolate=interpolate)
+
+
 class SampleSet:
-    _samples:list[Sample] = None
-    _range:tuple[float,float] = (-math.inf, math.inf)
-
-    def __init__(self, path:Path, lazy_load:bool=True):
-        if(path.exists() == False):
-            raise FolderNotFoundError(f"The folder={path.as_posix()} is not found.")
-        
-        self.path:Path = path
-
-        if(lazy_load == False):
-            self._load_samples()
-
-    def  _load_samples(self):
-        path:Path = self.path
-        self._samples = []
-        range_min = math.inf
-        range_max = -math.inf
-        for sample_path in sorted(list(path.glob("*.txt"))):
-            sample = Sample(path=sample_path)
-            self._samples.append(sample)
-            if(sample.x.min() < range_min): range_min = sample.x.min()
-            if(sample.x.max() > range_max): range_max = sample.x.max()
-        self._range = (range_min, range_max)
-        # print(self._range, range_min, range_max)
-        _logger.info(f"Load {len(self._samples)} samples in {self}")
+    """
+    A lazy, indexable set of `Sample` over a folder of .txt files (or a catalog of paths).
+
+    Nothing is loaded when the set is created. Samples are loaded when they are accessed,
+    `chunk_size` at a time (in parallel when `workers` > 1), then every recorded step
+    (`interpolate`, `despike`, `set_raman_range`, `smoothing`, `normalized`, `baseline`, `map`)
+    is applied to the chunk and the result is kept in a size-bounded LRU cache.
+
+    Parameters
+    ----------
+    path : pathlib.Path or list of pathlib.Path
+        A folder to `glob` with `pattern` or a list of paths to .txt files.
+    lazy_load : bool
+        Default is True. When False, every sample is loaded (into the cache) immediately.
+    name_format : list of str
+        The naming scheme of the files. See `raman.sample.read_txt`.
+    pattern : str
+        The glob pattern used when `path` is a folder.
+    interpolate : bool
+        This will pass to the `read_txt(interpolate)`.
+    workers : int
+        Number of processes used to load the files and to run the `despike`, `smoothing`, `normalized`
+        and `baseline` steps (through shared memory, see `raman.shared`). Default is 1, which runs in this process.
+    chunk_size : int
+        Number of samples loaded and processed together.
+    cache_size : int
+        The memory budget (bytes) of the LRU cache.
+
+    Examples
+    --------
+    >>> sampleset = SampleSet(Path("data/SERs/txt"), name_format=[...], workers=4)
+    >>> coins = sampleset.filter(name=["coin1", "coin2"])
+    >>> coins.set_raman_range(min=700, max=1500)
+    >>> x, Y = coins.to_array()
+    """
+
+    def __init__(
+        self,
+        path: Path | list[Path],
+        lazy_load: bool = True,
+        name_format: list[str] = NAME_FORMAT,
+        pattern: str = "*.txt",
+        interpolate: bool = True,
+        workers: int = 1,
+        chunk_size: int = 32,
+        cache_size: int = 256 * 2**20,
+    ):
+        if isinstance(path, (list, tuple)):
+            self.path: Path | None = None
+            self._paths: list[Path] = [Path(p) for p in path]
+        else:
+            if path.exists() == False:
+                raise FolderNotFoundError(f"The folder={path.as_posix()} is not found.")
+            self.path = path
+            self._paths = sorted(path.glob(pattern))
+
+        self.name_format: list[str] = name_format
+        self.interpolate_on_load: bool = interpolate
+        self.workers: int = workers
+        self.chunk_size: int = chunk_size
+
+        self._metadata: list[dict] | None = None
+        self._steps: list[Callable[[list[Sample]], Any]] = []
+        self._version: int = next(_versions)
+        self._cache: SampleCache = SampleCache(max_bytes=cache_size)
+        # path -> failed checks, filled by `screen`
+        self.qc: dict[Path, list[str]] = {}
+
+        if lazy_load == False:
+            self.get_samples()
+
+    ############# Indexing #############
+
+    @property
+    def paths(self) -> list[Path]:
+        return list(self._paths)
+
+    @property
+    def metadata(self) -> list[dict]:
+        """
+        The metadata parsed from the filename of every sample (see `raman.sample.parse_filename`).
+        No file is opened.
+        """
+        if self._metadata is None:
+            self._metadata = [parse_filename(path, name_format=self.name_format) for path in self._paths]
+        return self._metadata
+
+    def __len__(self) -> int:
+        return len(self._paths)
+
+    def __getitem__(self, idx: int | slice | list[int] | np.ndarray) -> Sample | Self:
+        if isinstance(idx, (int, np.integer)):
+            path = self._paths[idx]
+            sample = self._cache.get(self._key(path))
+            if sample is None:
+                sample = self._process([_load(path, self.name_format, self.interpolate_on_load)])[0]
+            return sample
+        if isinstance(idx, slice):
+            return self._subset(list(range(len(self)))[idx])
+        idx = np.asarray(idx)
+        if idx.dtype == bool:
+            idx = np.flatnonzero(idx)
+        return self._subset([int(i) for i in idx])
+
+    def __iter__(self) -> Iterator[Sample]:
+        for chunk in self._iter_chunks():
+            yield from chunk
+
+    def filter(self, predicate: Callable[[dict], bool] | None = None, **conditions) -> Self:
+        """
+        Select samples by the metadata in their filenames without loading them.
+
+        Parameters
+        ----------
+        predicate : callable or None
+            A function that takes the metadata (dict) of a sample and returns True to keep it.
+        conditions :
+            `key=value` keeps the samples whose metadata `key` equals `value`.
+            `value` can also be a list/tuple/set (any of) or a callable (a predicate on the value).
+
+        Returns
+        -------
+        SampleSet :
+            A new set sharing the loader settings, steps and cache of this set.
+        """
+
+        def match(meta: dict) -> bool:
+            for key, value in conditions.items():
+                if key not in meta:
+                    return False
+                if callable(value):
+                    if not value(meta[key]):
+                        return False
+                elif isinstance(value, (list, tuple, set)):
+                    if meta[key] not in value:
+                        return False
+                elif meta[key] != value:
+                    return False
+            return predicate is None or bool(predicate(meta))
+
+        return self._subset([i for i, meta in enumerate(self.metadata) if match(meta)])
+
+    def screen(self, gate: QualityGate, drop: bool = True) -> Self:
+        """
+        Check the raw counts of every file with a `raman.qc.QualityGate` before any sample is built.
+        Files are read `chunk_size` at a time (in parallel when `workers` > 1).
+
+        Parameters
+        ----------
+        gate : QualityGate
+            The checks.
+        drop : bool
+            Default is True, which keeps only the files that passed. False keeps every file.
+
+        Returns
+        -------
+        SampleSet :
+            A new set. `qc` maps every screened path to its failed checks, and the loaded samples get them
+            in `sample.meta['qc']`.
+        """
+        from raman.helper import _read_spectra
+
+        paths = [path.as_posix() for path in self._paths]
+        exposures = [meta.get("exposure", np.nan) for meta in self.metadata]
+        chunks = [paths[i : i + self.chunk_size] for i in range(0, len(paths), self.chunk_size)]
+        pool = ProcessPoolExecutor(max_workers=self.workers) if self.workers > 1 else nullcontext()
+        reasons: list[list[str]] = []
+        with pool as executor:
+            spectra = executor.map(_read_spectra, chunks) if executor is not None else map(_read_spectra, chunks)
+            for i, chunk in enumerate(spectra):
+                result = gate.check(
+                    [spectrum[:, 0] for spectrum in chunk],
+                    [spectrum[:, 1] for spectrum in chunk],
+                    exposures=exposures[i * self.chunk_size : i * self.chunk_size + len(chunk)],
+                )
+                reasons.extend(result["reasons"])
+        report = {path: reason for path, reason in zip(self._paths, reasons)}
+        _logger.info(f"QC: {sum(len(reason) > 0 for reason in reasons)}/{len(reasons)} files failed in {self}")
+
+        subset = self._subset([i for i, reason in enumerate(reasons) if drop == False or len(reason) == 0])
+        subset.qc = {**self.qc, **report}
+
+        def tag(samples: list[Sample]):
+            for sample in samples:
+                sample.meta["qc"] = list(report.get(next(iter(sample.paths)), []))
+
+        subset._add_step(tag)
+        return subset
+
+    def _subset(self, indices: list[int]) -> Self:
+        subset = object.__new__(type(self))
+        subset.__dict__.update(self.__dict__)
+        subset.path = self.path
+        subset._paths = [self._paths[i] for i in indices]
+        subset._metadata = None if self._metadata is None else [self._metadata[i] for i in indices]
+        subset._steps = list(self._steps)
+        return subset
+
+    ############# Loading #############
+
+    def _key(self, path: Path) -> tuple:
+        return (path, self._version)
+
+    def apply(self, samples: list[Sample]) -> list[Sample]:
+        """
+        Run the recorded steps on samples that were not loaded by this set (for example from `raman.spectra`).
+        The samples are updated in place and are not cached.
+        """
+        for step in self._steps:
+            step(samples)
+        return samples
+
+    def _process(self, samples: list[Sample]) -> list[Sample]:
+        self.apply(samples)
+        for sample in samples:
+            self._cache.put(self._key(next(iter(sample.paths))), sample)
+        return samples
+
+    def _iter_chunks(self) -> Iterator[list[Sample]]:
+        chunks = [self._paths[i : i + self.chunk_size] for i in range(0, len(self), self.chunk_size)]
+        pool = ProcessPoolExecutor(max_workers=self.workers) if self.workers > 1 else nullcontext()
+        with pool as executor:
+            # Submit the next chunk before processing the current one, so loading overlaps processing
+            # while at most two chunks are held outside the cache.
+            pending = self._submit(executor, chunks[0]) if chunks else None
+            for i in range(len(chunks)):
+                current = pending
+                pending = self._submit(executor, chunks[i + 1]) if i + 1 < len(chunks) else None
+                yield self._collect(chunks[i], current)  # type: ignore
+
+    def _submit(self, executor: Executor | None, paths: list[Path]) -> dict[Path, Future | None]:
+        submitted: dict[Path, Future | None] = {}
+        for path in paths:
+            if self._cache.get(self._key(path)) is not None or executor is None:
+                submitted[path] = None
+            else:
+                submitted[path] = executor.submit(_load, path, self.name_format, self.interpolate_on_load)
+        return submitted
+
+    def _collect(self, paths: list[Path], submitted: dict[Path, Future | None]) -> list[Sample]:
+        samples: list[Sample | None] = []
+        loaded: list[Sample] = []
+        for path in paths:
+            sample = self._cache.get(self._key(path))
+            if sample is None:
+                future = submitted.get(path)
+                if future is None:
+                    sample = _load(path, self.name_format, self.interpolate_on_load)
+                else:
+                    sample = future.result()
+                loaded.append(sample)
+            samples.append(sample)
+        if loaded:
+            self._process(loaded)
+        _logger.info(f"Load {len(loaded)} samples in {self}")
+        return samples  # type: ignore
 
     def get_samples(self) -> list[Sample]:
-        if( isinstance( self._samples, type(None) ) ):
-            self._load_samples()
-        return self._samples
-
-    def interpolate(self, step:float):
-        for sample in self.get_samples():
-            sample.interpolate(step=step)
-
-    def despike(self, window_length:int=5, threshold:int=1):
-        for sample in self.get_samples():
-            sample.despike(window_length=window_length, threshold=threshold)
-
-    def set_raman_range(self, min:float, max:float):
-        for sample in self.get_samples():
-            sample.set_raman_range(min=min, max=max)
-        self._range = (min, max)
-
-    def plot(self, title:str=""):
-        plt.figure(figsize=(16,9))
-        for sample in self.get_samples():
-            plt.plot(sample.x, sample.y, label=sample.name)
-        plt.legend()
+        """
+        Load (or get from the cache) every sample. Prefer iterating the set for large folders.
+        """
+        return list(self)
+
+    def to_array(self, dtype: type | np.dtype | None = None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Materialize the set into one contiguous array for modelling.
+
+        Returns
+        -------
+        NDArray of shape (n_shifts, ) :
+            The shared Raman Shift.
+        NDArray of shape (n_samples, n_shifts) :
+            The intensity of every sample.
+        """
+        x: np.ndarray | None = None
+        Y: np.ndarray | None = None
+        for i, sample in enumerate(self):
+            if x is None:
+                x = sample.x
+                Y = np.empty((len(self), x.shape[0]), dtype=sample.dtype if dtype is None else dtype)
+            elif same_axis(x, sample.x) == False:
+                raise ValueError(
+                    f"Expect all samples to have the same Raman Shift range. Use `interpolate` and `set_raman_range` first."
+                )
+            Y[i] = sample.y  # type: ignore
+        if x is None:
+            raise ValueError(f"{self} is empty.")
+        return x, Y  # type: ignore
+
+    ############# Steps #############
+
+    def map(self, func: Callable[[Sample], Any]):
+        """
+        Record `func(sample)` as a step that is applied to every sample when it is loaded.
+        """
+        self._add_step(lambda samples: [func(sample) for sample in samples])
+
+    def _add_step(self, step: Callable[[list[Sample]], Any]):
+        self._steps.append(step)
+        self._version = next(_versions)
+
+    def interpolate(self, step: float):
+        self.map(lambda sample: sample.interpolate(step=step))
+
+    def _map_method(self, operation: str, **kwargs):
+        # Length preserving steps run in the worker processes through shared memory when workers > 1.
+        if self.workers > 1:
+            self._add_step(lambda samples: map_samples(samples, operation, workers=self.workers, **kwargs))
+        else:
+            self.map(lambda sample: getattr(sample, operation)(**kwargs))
+
+    def despike(self, window_length: int = 5, threshold: int = 1):
+        self._map_method("despike", window_length=window_length, threshold=threshold)
+
+    def set_raman_range(self, min: float, max: float):
+        self.map(lambda sample: sample.extract_range(low=min, high=max))
+
+    def smoothing(self, window_length: str | int = "auto", polyorder: int = 2):
+        self._map_method("smoothing", window_length=window_length, polyorder=polyorder)
+
+    def normalized(self, method: str = "minmax"):
+        self._map_method("normalized", method=method)
+
+    def baseline(self, order: int = 1, roi=None, method: str = "poly", **kwargs):
+        """
+        Record a baseline correction step. Samples of a chunk that share the same Raman Shift are corrected together
+        with the batched engine (`raman.baseline.baseline_samples`).
+        """
+
+        def step(samples: list[Sample]):
+            for group in axis_groups(samples).values():
+                baseline_samples(group, order=order, roi=roi, method=method, workers=self.workers, **kwargs)
+
+        self._add_step(step)
+
+    def run_plan(self, plan: Plan):
+        """
+        Record an optimized `raman.plan.Plan` as one step, run on the samples of a chunk stacked per Raman Shift.
+        Create the set with interpolate=False and start the plan with `remove_spike().interpolate(1)`, so the
+        ROI of the plan is pushed before them.
+        """
+        plan = plan.optimize()
+        self._add_step(plan.run)
+
+    def peak_table(self, table: PeakTable | None = None, **kwargs) -> PeakTable:
+        """
+        Detect the peaks of every sample after the recorded steps, keyed by path.
+
+        Parameters
+        ----------
+        table : PeakTable or None
+            An existing table to update. Only the samples that are not in it yet are loaded.
+            Default is None, which creates `PeakTable(**kwargs)`.
+
+        Returns
+        -------
+        PeakTable
+        """
+        if table is None:
+            table = PeakTable(**kwargs)
+        missing = self._subset([i for i, path in enumerate(self._paths) if path.as_posix() not in table])
+        for chunk in missing._iter_chunks():
+            table.add(chunk)
+        return table
+
+    def plot(self, title: str = "", by: str | None = None):
+        """
+        Draw every sample in one `LineCollection` per shared Raman Shift (see `raman.figure.plot_samples`).
+
+        Parameters
+        ----------
+        title : str
+            The title of the figure.
+        by : str or None
+            An attribute or a `meta` key (for example 'glucose') used to colour the lines, shown in a colorbar.
+        """
+        plt.figure(figsize=(16, 9))
+        plot_samples(list(self), by=by, colorbar=by if by is not None else False)
         plt.grid()
-        plt.xlim(self._range[0] - 10, self._range[1] + 10)
-        plt.ylim(0, 0xFFFF) #range of 16 bit is 0 - 65536 (0xFFFF is all 1 in 16 bits)
+        plt.ylim(0, 0xFFFF)  # range of 16 bit is 0 - 65536 (0xFFFF is all 1 in 16 bits)
 
-        plt.xlabel("Raman shift, cm$^{-1}$", fontsize = 12)
-        plt.ylabel("intensity, a. u.", fontsize = 12)
-        plt.title(title,fontsize = 12,fontweight="bold")
+        plt.xlabel("Raman shift, cm$^{-1}$", fontsize=12)
+        plt.ylabel("intensity, a. u.", fontsize=12)
+        plt.title(title, fontsize=12, fontweight="bold")
         plt.show()
 
     def __repr__(self) -> str:
         return self.__str__()
 
     def __str__(self) -> str:
-        return f"SampleSet({self.path.as_posix()})"
+        source = self.path.as_posix() if self.path is not None else "catalog"
+        return f"SampleSet({source}, n={len(self)})"
 
 
-if(__name__ == "__main__"):
+if __name__ == "__main__":
     import sys
+
     logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
-    path:Path = Path(f"data/silicon/focuspower")
-    sampleset = SampleSet(path=path)
+    path: Path = Path(f"data/silicon/focuspower")
+    sampleset = SampleSet(
+        path=path,
+        name_format=["name", "grating", "laser", "exposure", "accumulation", "year", "month", "date", "hour", "minute", "second", "01"],
+    )
     sampleset.plot()
-    # TODO: Implement despike here
     sampleset.despike(window_length=5, threshold=1)
     sampleset.interpolate(step=0.1)
     sampleset.plot()
     sampleset.set_raman_range(min=600, max=1600)
-    sampleset.plot()
\ No newline at end of file
+    sampleset.plot()
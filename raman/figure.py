@@ -0,0 +1,222 @@
+import numpy as np
+from numpy.typing import NDArray
+import matplotlib.pyplot as plt
+from matplotlib.axes import Axes
+from matplotlib.collections import LineCollection
+from matplotlib.colors import Normalize
+
+from typing import Any, Callable
+
+
+def decimate_minmax(x: NDArray, Y: NDArray, n_bins: int) -> tuple[NDArray, NDArray]:
+    """
+    Downsample every line of a stack to `n_bins` bins, keeping the minimum and the maximum of each bin.
+    Spikes and narrow peaks stay visible, which is not the case with plain striding.
+
+    Parameters
+    ----------
+    x : NDArray of shape (n_shifts, )
+        The Raman Shift shared by all lines.
+    Y : NDArray of shape (n_lines, n_shifts)
+        The intensity of the lines.
+    n_bins : int
+        Number of bins. Each bin gives two points.
+
+    Returns
+    -------
+    NDArray of shape (n_lines, 2 * n_bins) :
+        The Raman Shift of the kept points.
+    NDArray of shape (n_lines, 2 * n_bins) :
+        The intensity of the kept points.
+    """
+    n_lines, n = Y.shape
+    if 2 * n_bins >= n:
+        return np.broadcast_to(x, Y.shape), Y
+    size = int(np.ceil(n / n_bins))
+    n_bins = int(np.ceil(n / size))
+    # Pad with the last point so that every bin has the same size
+    pad = n_bins * size - n
+    idx = np.minimum(np.arange(n_bins * size), n - 1).reshape(n_bins, size)
+    blocks = Y[:, idx] if pad else Y.reshape(n_lines, n_bins, size)
+
+    offset = np.arange(n_bins) * size
+    imin = np.minimum(blocks.argmin(axis=2) + offset, n - 1)
+    imax = np.minimum(blocks.argmax(axis=2) + offset, n - 1)
+    # Keep the two points of a bin in the order of the Raman Shift
+    keep = np.stack([np.minimum(imin, imax), np.maximum(imin, imax)], axis=2).reshape(n_lines, 2 * n_bins)
+    return x[keep], np.take_along_axis(Y, keep, axis=1)
+
+
+def plot_stack(
+    x: NDArray,
+    Y: NDArray,
+    values: NDArray | None = None,
+    ax: Axes | None = None,
+    cmap: str = "viridis",
+    norm: Normalize | None = None,
+    color: Any = None,
+    max_points: int | str | None = "auto",
+    colorbar: bool | str = False,
+    linewidth: float = 0.8,
+    alpha: float = 0.8,
+    **kwargs,
+) -> LineCollection:
+    """
+    Draw a stack of spectra as a single `LineCollection`.
+
+    Parameters
+    ----------
+    x : NDArray of shape (n_shifts, )
+        The Raman Shift shared by all spectra.
+    Y : NDArray of shape (n_spectra, n_shifts)
+        The intensity of the spectra.
+    values : NDArray of shape (n_spectra, ) or None
+        A value per spectrum (for example glucose) mapped to a colour through `cmap` and `norm`.
+    ax : matplotlib.axes.Axes or None
+        Default is None, which uses `plt.gca()`.
+    cmap : str
+        The colormap used with `values`.
+    norm : matplotlib.colors.Normalize or None
+        Default is None, which spans `values` from min to max.
+    color : any
+        A single colour for every line when `values` is None.
+    max_points : int, 'auto' or None
+        Number of points drawn per line (see `decimate_minmax`).
+        'auto' uses two points per pixel of the axes width. None draws every point.
+    colorbar : bool or str
+        Add a colorbar for `values`. A string is used as its label.
+    kwargs :
+        Passed to `LineCollection`.
+
+    Returns
+    -------
+    LineCollection
+    """
+    if ax is None:
+        ax = plt.gca()
+    Y = np.atleast_2d(Y)
+    if max_points == "auto":
+        max_points = 2 * max(int(ax.bbox.width), 1)
+    if max_points is not None:
+        xs, Y = decimate_minmax(x, Y, n_bins=max(int(max_points) // 2, 1))
+    else:
+        xs = np.broadcast_to(x, Y.shape)
+    segments = np.stack([xs, Y], axis=2)
+
+    lines = LineCollection(segments, linewidths=linewidth, alpha=alpha, **kwargs)  # type: ignore
+    if values is not None:
+        values = np.asarray(values, dtype=np.float64)
+        lines.set_array(values)
+        lines.set_cmap(cmap)
+        lines.set_norm(norm if norm is not None else Normalize(vmin=np.nanmin(values), vmax=np.nanmax(values)))
+    elif color is not None:
+        lines.set_color(color)
+    ax.add_collection(lines)
+    ax.autoscale_view()
+    if colorbar and values is not None:
+        bar = ax.figure.colorbar(lines, ax=ax)  # type: ignore
+        if isinstance(colorbar, str):
+            bar.set_label(colorbar)
+    return lines
+
+
+def _value_of(sample, by: str | Callable | None) -> Any:
+    if by is None:
+        return None
+    if callable(by):
+        return by(sample)
+    if hasattr(sample, by):
+        return getattr(sample, by)
+    return sample.meta.get(by)
+
+
+def plot_samples(
+    samples: list,
+    by: str | Callable | None = None,
+    ax: Axes | None = None,
+    **kwargs,
+) -> list[LineCollection]:
+    """
+    Draw samples with `plot_stack`, one `LineCollection` per shared Raman Shift.
+
+    Parameters
+    ----------
+    samples : list of Sample
+        The samples to draw.
+    by : str, callable or None
+        The colour of each line: an attribute of the sample (for example 'exposure'), a key of `sample.meta`
+        (for example 'glucose') or a function of the sample.
+    ax : matplotlib.axes.Axes or None
+        Default is None, which uses `plt.gca()`.
+    kwargs :
+        Passed to `plot_stack`.
+    """
+    from raman.axis import axis_groups
+
+    if ax is None:
+        ax = plt.gca()
+    groups = list(axis_groups(samples).values())
+    values = None
+    if by is not None and "norm" not in kwargs:
+        every = np.array([_value_of(sample, by) for sample in samples], dtype=np.float64)
+        kwargs["norm"] = Normalize(vmin=np.nanmin(every), vmax=np.nanmax(every))
+    lines: list[LineCollection] = []
+    colorbar = kwargs.pop("colorbar", False)
+    for i, group in enumerate(groups):
+        if by is not None:
+            values = np.array([_value_of(sample, by) for sample in group], dtype=np.float64)
+        Y = np.vstack([sample.y for sample in group])
+        lines.append(
+            plot_stack(group[0].x, Y, values=values, ax=ax, colorbar=colorbar if i == 0 else False, **kwargs)
+        )
+    return lines
+
+
+def plot_groups(
+    x: NDArray,
+    Y: NDArray,
+    groups: NDArray | list,
+    values: NDArray | None = None,
+    ncols: int = 3,
+    figsize: tuple[float, float] | None = None,
+    sharey: bool = True,
+    **kwargs,
+):
+    """
+    Draw a stack of spectra in one subplot per group (for example per subject or per substrate).
+
+    Parameters
+    ----------
+    x : NDArray of shape (n_shifts, )
+        The Raman Shift shared by all spectra.
+    Y : NDArray of shape (n_spectra, n_shifts)
+        The intensity of the spectra.
+    groups : NDArray or list of shape (n_spectra, )
+        The group key of every spectrum. Subplots are titled with the keys in sorted order.
+    values : NDArray of shape (n_spectra, ) or None
+        A value per spectrum mapped to a colour with the same scale in every subplot.
+    ncols : int
+        Number of subplot columns.
+    kwargs :
+        Passed to `plot_stack`.
+
+    Returns
+    -------
+    tuple of (Figure, NDArray of Axes)
+    """
+    groups = np.asarray(groups)
+    keys = np.unique(groups)
+    nrows = int(np.ceil(len(keys) / ncols))
+    if figsize is None:
+        figsize = (5 * ncols, 3.5 * nrows)
+    fig, axes = plt.subplots(nrows=nrows, ncols=ncols, figsize=figsize, sharex=True, sharey=sharey, squeeze=False)
+    if values is not None and "norm" not in kwargs:
+        kwargs["norm"] = Normalize(vmin=np.nanmin(values), vmax=np.nanmax(values))
+    for ax, key in zip(axes.flat, keys):
+        mask = groups == key
+        plot_stack(x, Y[mask], values=None if values is None else np.asarray(values)[mask], ax=ax, **kwargs)
+        ax.set_title(str(key))
+        ax.grid()
+    for ax in axes.flat[len(keys) :]:
+        ax.set_visible(False)
+    return fig, axes
@@ -0,0 +1,195 @@
+"""
+Temporal join of spectra with glycemic readings.
+
+The OGTT readings of every subject (`data/pilot/s<id>.csv`, columns `time`, `glucose`, `prefix`) are read into one
+table, and spectra are matched to them for all subjects at once with `pandas.merge_asof`, either to the nearest
+reading or by linear interpolation between the readings around the measurement, within a tolerance window.
+"""
+from raman.sample import Sample
+
+import numpy as np
+from numpy.typing import NDArray
+import pandas as pd
+
+from pathlib import Path
+from typing import Callable, Iterable
+
+METHODS: list[str] = ["nearest", "backward", "forward", "interpolate", "prefix"]
+
+
+def read_glycemic(folder: str | Path, subjects: Iterable[str] | None = None) -> pd.DataFrame:
+    """
+    Read the glycemic readings of every subject in a folder.
+
+    Parameters
+    ----------
+    folder : str or pathlib.Path
+        The folder with one `<subject>.csv` per subject (for example `data/pilot`).
+    subjects : iterable of str or None
+        Default is None, which reads every `s*.csv`.
+
+    Returns
+    -------
+    pandas.DataFrame :
+        Columns `subject`, `time`, `glucose` (float, NaN when not measured) and `prefix`, sorted by subject and time.
+    """
+    folder = Path(folder)
+    if subjects is None:
+        paths = sorted(folder.glob("s*.csv"))
+    else:
+        paths = [folder.joinpath(f"{subject}.csv") for subject in subjects]
+    if len(paths) == 0:
+        raise FileNotFoundError(f"No glycemic table in {folder.as_posix()}")
+    tables = [pd.read_csv(path, dtype={"prefix": str}).assign(subject=path.stem) for path in paths]
+    readings = pd.concat(tables, ignore_index=True)
+    readings["time"] = pd.to_datetime(readings["time"]).astype("datetime64[ns]")
+    readings["glucose"] = readings["glucose"].astype(np.float64)
+    return readings[["subject", "time", "glucose", "prefix"]].sort_values(["subject", "time"], ignore_index=True)
+
+
+def join_glucose(
+    spectra: pd.DataFrame,
+    readings: pd.DataFrame,
+    method: str = "nearest",
+    tolerance: str | pd.Timedelta = "5min",
+    time: str = "datetime",
+    subject: str = "subject",
+    prefix: str = "prefix",
+) -> pd.Series:
+    """
+    Match every spectrum to the glucose of the same subject, in one pass over all subjects.
+
+    Parameters
+    ----------
+    spectra : pandas.DataFrame
+        One row per spectrum with a subject column and a measurement time column
+        (for example the table of `raman.helper.load_frame` with a `subject` column added).
+    readings : pandas.DataFrame
+        The table of `read_glycemic`. Readings without glucose are ignored, except with method='prefix'.
+    method : str
+        - 'nearest' : the closest reading in time.
+        - 'backward' / 'forward' : the last reading before / the first reading after the measurement.
+        - 'interpolate' : linear interpolation between the readings before and after the measurement.
+          Both must be within `tolerance`, so a spectrum is never extrapolated.
+        - 'prefix' : the reading with the same `prefix` (the file prefix given during the experiment), ignoring time.
+    tolerance : str or pandas.Timedelta
+        The largest time difference between a spectrum and a reading.
+    time, subject, prefix : str
+        The column names in `spectra`.
+
+    Returns
+    -------
+    pandas.Series :
+        The glucose of every spectrum (NaN when no reading matches), with the index of `spectra`.
+
+    Examples
+    --------
+    With readings 30 minutes apart, no spectrum has both within 5 minutes, except the one at a reading:
+
+    >>> readings = pd.DataFrame({"subject": "s1", "time": pd.to_datetime(["2024-03-19 08:00", "2024-03-19 08:30"]),
+    ...                          "glucose": [100.0, 200.0], "prefix": ["a", "b"]})
+    >>> spectra = pd.DataFrame({"subject": "s1", "datetime": pd.to_datetime(
+    ...     ["2024-03-19 08:00", "2024-03-19 08:02", "2024-03-19 08:15", "2024-03-19 08:33"])})
+    >>> join_glucose(spectra, readings, method="interpolate").tolist()
+    [100.0, nan, nan, nan]
+    >>> join_glucose(spectra, readings, method="interpolate", tolerance="30min").tolist()
+    [100.0, 106.66666666666667, 150.0, nan]
+    """
+    if method not in METHODS:
+        raise ValueError(f"Expect method to be one of {METHODS}. Got {method=}")
+
+    if method == "prefix":
+        left = pd.DataFrame({"subject": spectra[subject].astype(str), "prefix": spectra[prefix].astype(str)})
+        right = readings[["subject", "prefix", "glucose"]].astype({"subject": str, "prefix": str})
+        merged = left.merge(right.drop_duplicates(["subject", "prefix"]), on=["subject", "prefix"], how="left")
+        return pd.Series(merged["glucose"].to_numpy(dtype=np.float64), index=spectra.index, name="glucose")
+
+    tolerance = pd.Timedelta(tolerance)
+    left = pd.DataFrame(
+        {
+            "subject": spectra[subject].astype(str).to_numpy(),
+            "time": pd.to_datetime(spectra[time]).astype("datetime64[ns]").to_numpy(),
+            "row": np.arange(len(spectra)),
+        }
+    )
+    left = left[left["time"].notna()].sort_values("time", kind="stable")
+    right = readings[readings["glucose"].notna()][["subject", "time", "glucose"]].astype({"subject": str})
+    right = right.assign(time=right["time"].astype("datetime64[ns]"), reading=right["time"]).sort_values("time")
+
+    glucose = np.full(len(spectra), np.nan)
+    if method != "interpolate":
+        merged = pd.merge_asof(left, right, on="time", by="subject", direction=method, tolerance=tolerance)
+        glucose[merged["row"].to_numpy()] = merged["glucose"].to_numpy(dtype=np.float64)
+    else:
+        before = pd.merge_asof(left, right, on="time", by="subject", direction="backward", tolerance=tolerance)
+        after = pd.merge_asof(left, right, on="time", by="subject", direction="forward", tolerance=tolerance)
+        span = (after["reading"] - before["reading"]).dt.total_seconds().to_numpy()
+        elapsed = (before["time"] - before["reading"]).dt.total_seconds().to_numpy()
+        g0 = before["glucose"].to_numpy(dtype=np.float64)
+        g1 = after["glucose"].to_numpy(dtype=np.float64)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            # A reading at the measurement time is used as is, otherwise both readings must be matched
+            # (span is NaN when one is missing), so a spectrum is never extrapolated from one side
+            value = np.where(elapsed == 0, g0, np.where(span > 0, g0 + (g1 - g0) * elapsed / span, np.nan))
+        glucose[before["row"].to_numpy()] = value
+    return pd.Series(glucose, index=spectra.index, name="glucose")
+
+
+def _subject_of(sample: Sample) -> str | None:
+    if sample.meta.get("subject_id") is not None:
+        return str(sample.meta["subject_id"])
+    if len(sample.paths) > 0:
+        # The pilot files are stored as `s<id>/<prefix>_...txt`
+        return min(sample.paths).parent.name
+    return None
+
+
+def label_samples(
+    samples: list[Sample],
+    readings: pd.DataFrame,
+    subject: str | Callable[[Sample], str] | None = None,
+    method: str = "nearest",
+    tolerance: str | pd.Timedelta = "5min",
+    store: bool = True,
+) -> NDArray:
+    """
+    The glucose of every sample of a stack, aligned with `raman.sample.stack(samples)`.
+
+    Parameters
+    ----------
+    samples : list of Sample
+        The samples, with `date` set.
+    readings : pandas.DataFrame
+        The table of `read_glycemic`.
+    subject : str, callable or None
+        The subject of a sample: a subject ID shared by all samples, or a function of the sample.
+        Default is None, which uses `sample.meta['subject_id']` or the folder of the file.
+    method, tolerance :
+        See `join_glucose`. With method='prefix', the prefix is `sample.name`.
+    store : bool
+        Default is True, which also sets `sample.meta['glucose']` of the matched samples.
+
+    Returns
+    -------
+    NDArray of shape (n_samples, ) :
+        The glucose of every sample, NaN when no reading matches.
+    """
+    if subject is None:
+        subjects = [_subject_of(sample) for sample in samples]
+    elif callable(subject):
+        subjects = [subject(sample) for sample in samples]
+    else:
+        subjects = [subject] * len(samples)
+    spectra = pd.DataFrame(
+        {
+            "subject": subjects,
+            "datetime": [getattr(sample, "date", None) for sample in samples],
+            "prefix": [getattr(sample, "name", None) for sample in samples],
+        }
+    )
+    glucose = join_glucose(spectra, readings, method=method, tolerance=tolerance).to_numpy()
+    if store:
+        for sample, value in zip(samples, glucose):
+            if np.isnan(value) == False:
+                sample.meta["glucose"] = float(value)
+    return glucose
@@ -6,8 +6,7 @@ import numpy as np
 import os
 from pathlib import Path
 from glob import glob
-from datetime import datetime
-import rampy as rp
+from concurrent.futures import ProcessPoolExecutor
 import matplotlib
 
 def get_file_list(path:Path) -> list[str]:
@@ -18,28 +17,138 @@ def get_file_list(path:Path) -> list[str]:
         names.append(fname)
     return names
 
-def create_data_from_paths(paths:list[str], 
+DATETIME_KEYS: list[str] = ["year", "month", "date", "hour", "minute", "second"]
+
+
+def read_spectrum(path: str | Path) -> np.ndarray:
+    """
+    Read a two-column .txt spectrum (Raman Shift, intensity) exported from Horiba LS6 software,
+    sorted by Raman Shift (the same as `rp.flipsp(np.genfromtxt(path))` but parsed in C).
+    """
+    with open(path, "r") as f:
+        return parse_spectrum(f.read())
+
+
+def parse_spectrum(text: str) -> np.ndarray:
+    """
+    Parse the content of a two-column .txt spectrum into an array of shape (n, 2) sorted by Raman Shift.
+    """
+    values = np.fromstring(text, sep=" ").reshape(-1, 2)
+    return values[np.argsort(values[:, 0], kind="stable")]
+
+
+def _read_spectra(paths: list[str]) -> list[np.ndarray]:
+    return [read_spectrum(path) for path in paths]
+
+
+def load_frame(paths:list[str | Path],
+               keys:list[str]=["name","grating","laser","exposure","accumulation","year","month","date","hour","minute","second"],
+               workers:int|None=None,
+               strict:bool=True,
+               ) -> tuple[pd.DataFrame, np.ndarray, np.ndarray]:
+    """
+    Build a table of spectra from a list of .txt files.
+
+    The filenames are parsed with vectorized string operations and `pd.to_datetime`,
+    and the spectra are loaded (in parallel) into two aligned 2-D arrays instead of object cells.
+
+    Parameters
+    ----------
+    paths : list of str or pathlib.Path
+        The .txt files.
+    keys : list of str
+        The naming scheme of the files, one key per `_` separated field.
+        `year`, `month`, `date`, `hour`, `minute`, `second` are merged into `datetime`.
+        `exposure` and `laser` ("60 s", "785 nm"), `accumulation` and `grating` become integers,
+        `power` and `slit` ("0-43") become floats. A trailing "01" field is ignored.
+    workers : int or None
+        Number of processes used to read the files. Default is None, which is `os.cpu_count()`.
+    strict : bool
+        Default is True, which raises when a filename does not match `keys`.
+        When False, the metadata of such a file is left missing.
+
+    Returns
+    -------
+    pandas.DataFrame :
+        One row per file with `path`, the keys, `datetime` and `length` (number of points).
+        The index is the row of the arrays, so `Y[data.index]` stays aligned after sorting or filtering.
+    NDArray of shape (n_files, max_length) :
+        The Raman Shift of every file, sorted ascending and padded with NaN.
+    NDArray of shape (n_files, max_length) :
+        The intensity of every file, padded with NaN.
+    """
+    paths = [Path(path).as_posix() for path in paths]
+    data = pd.DataFrame({"path": pd.Series(paths, dtype="string")})
+
+    filenames = data["path"].str.rsplit("/", n=1).str[-1].str.removesuffix(".txt")
+    # Every field has a column, even when no filename (or no paths) has it
+    fields = filenames.str.split("_", expand=True).reindex(columns=range(len(keys) + 1))
+    n_fields = filenames.str.count("_") + 1
+    matched = n_fields.isin([len(keys), len(keys) + 1])
+    if strict and not matched.all():
+        raise ValueError(f"keys ({len(keys)}) is not match the filename {filenames[~matched].iloc[0]}.\nkeys={keys}")
+    fields = fields.where(matched, other=None)
+
+    for i, key in enumerate(keys):
+        column = fields[i].astype("string")
+        if key in DATETIME_KEYS or key == "01":
+            continue
+        if key in ["exposure", "laser"]:
+            data[key] = pd.to_numeric(column.str.split(" ").str[0], errors="coerce").astype("Int64")
+        elif key in ["accumulation", "grating"]:
+            data[key] = pd.to_numeric(column, errors="coerce").astype("Int64")
+        elif key in ["power", "slit"]:
+            data[key] = pd.to_numeric(column.str.replace("-", "."), errors="coerce").astype("Float64")
+        else:
+            data[key] = column
+    if all(key in keys for key in DATETIME_KEYS):
+        stamp = fields[keys.index(DATETIME_KEYS[0])].astype("string")
+        for key in DATETIME_KEYS[1:]:
+            stamp = stamp + fields[keys.index(key)].astype("string")
+        data["datetime"] = pd.to_datetime(stamp, format="%Y%m%d%H%M%S", errors="raise" if strict else "coerce")
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers > 1 and len(paths) >= 4 * workers:
+        chunks = [paths[i::workers] for i in range(workers)]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            parts = list(executor.map(_read_spectra, chunks))
+        spectra: list[np.ndarray] = [None] * len(paths)  # type: ignore
+        for i, part in enumerate(parts):
+            spectra[i::workers] = part
+    else:
+        spectra = _read_spectra(paths)
+
+    lengths = np.array([spectrum.shape[0] for spectrum in spectra], dtype=np.int64)
+    X = np.full((len(paths), lengths.max(initial=0)), np.nan)
+    Y = np.full((len(paths), lengths.max(initial=0)), np.nan)
+    for i, spectrum in enumerate(spectra):
+        X[i, : lengths[i]] = spectrum[:, 0]
+        Y[i, : lengths[i]] = spectrum[:, 1]
+    data["length"] = lengths
+    return data, X, Y
+
+
+def create_data_from_paths(paths:list[str],
                             keys:list[str]=["name","grating","laser","exposure","accumulation","year","month","date","hour","minute","second"]
                             ) -> pd.DataFrame:
-    rows = []
-    for path in paths:
-        row = {}
-        row['path'] = path
-        row['spectrum'] = rp.flipsp(np.genfromtxt(path))
-        for i, key in enumerate(keys):
-            _, fname = os.path.split(path)
-            row[key] = fname.split("_")[i]
-        rows.append(row)
-    data = pd.DataFrame(rows)
-
-    def merge_date(row):
-        date_str = "".join(list(row[["year","month","date","hour","minute","second"]]))
-        return datetime.strptime(date_str, '%Y%m%d%H%M%S')
-    data['datetime'] = data.apply(merge_date, axis=1)
-    data.drop(columns=["year","month","date","hour","minute","second"], inplace=True)
-
-
-    return data
+    """
+    The table of `load_frame` with the spectra as a `spectrum` column of (length, 2) arrays.
+    Kept for the notebooks, prefer `load_frame` which keeps the spectra in aligned arrays.
+
+    As before `load_frame`, the keys are the raw filename fields (str, for example "60 s" for `exposure`),
+    and only `datetime` is parsed.
+    """
+    data, X, Y = load_frame(paths=paths, keys=keys)
+    table = pd.DataFrame({"path": data["path"].astype(object)}, index=data.index)
+    table["spectrum"] = [np.column_stack([x[:n], y[:n]]) for x, y, n in zip(X, Y, data["length"])]
+    fields = [Path(path).stem.split("_") for path in table["path"]]
+    for i, key in enumerate(keys):
+        if key not in DATETIME_KEYS:
+            table[key] = pd.Series([field[i] for field in fields], index=data.index, dtype=object)
+    if "datetime" in data.columns:
+        table["datetime"] = data["datetime"]
+    return table
 
 def extract_range(spectrum:np.ndarray, range_from:float, range_to:float) -> np.ndarray:
     x = spectrum[:,0]
@@ -0,0 +1,361 @@
+"""
+Checkpointed, resumable batch jobs.
+
+A `ShardJob` splits a `SampleSet` (with its recorded steps) into shards of `shard_size` files. Every shard is
+processed and written to its own file in the job folder, then recorded in a ledger (`job.json`). Both are written
+atomically, so a job that crashes or is pre-empted (SIGTERM) loses at most the shard in progress:
+
+- running the job again skips the completed shards and resumes from the first one that is not done,
+- a shard whose files were modified after it completed is run again,
+- a shard that raised is recorded as 'failed' with its error, and the other shards go on;
+  `run(only_failed=True)` runs only those once the cause is fixed.
+
+    >>> sampleset = SampleSet(Path("data/pilot/s1"))
+    >>> sampleset.set_raman_range(min=400, max=1800)
+    >>> sampleset.baseline(order=1)
+    >>> job = ShardJob("reprocess-s1", sampleset, shard_size=1024, config={"pipeline": "standard"})
+    >>> job.run()
+    >>> job.merge("s1.parquet")
+
+The ledger keeps the paths of every shard (as a digest) and `config`: a job folder can only be resumed with the
+same inputs and settings. Only one process runs a job folder at a time (see `job.lock`).
+"""
+from raman.sample import Sample
+from raman.dataset import SampleSet
+
+import hashlib
+import json
+import logging
+import os
+import signal
+import socket
+import threading
+import traceback
+from datetime import datetime
+from pathlib import Path
+from time import perf_counter
+from typing import Any, Callable, Iterable, Iterator
+
+_logger = logging.getLogger(__name__)
+
+LEDGER_VERSION = 1
+
+SHARD_STATUS: list[str] = ["pending", "done", "failed"]
+
+
+class JobLockedError(Exception):
+    pass
+
+
+def _write_samples(samples: Iterable[Sample], path: Path) -> int:
+    from raman.columnar import write_parquet, write_hdf5
+
+    if path.suffix == ".parquet":
+        return write_parquet(samples, path)
+    if path.suffix in [".h5", ".hdf5"]:
+        return write_hdf5(samples, path)
+    raise ValueError(f"Expect the suffix of a shard to be .parquet, .h5 or .hdf5. Got {path.suffix}")
+
+
+def _read_samples(path: Path) -> list[Sample]:
+    from raman.columnar import read_parquet, read_hdf5
+
+    if path.suffix == ".parquet":
+        return read_parquet(path)  # type: ignore
+    return read_hdf5(path)  # type: ignore
+
+
+def _digest(paths: Iterable[Path]) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    for path in paths:
+        digest.update(path.as_posix().encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _mtime_ns(paths: Iterable[Path]) -> int:
+    return max((path.stat().st_mtime_ns for path in paths), default=0)
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class ShardJob:
+    """
+    A batch job over a `SampleSet`, checkpointed shard by shard in `directory`.
+
+    Parameters
+    ----------
+    directory : str or pathlib.Path
+        The job folder, with the ledger (`job.json`) and one output file per shard. It is created when missing.
+    sampleset : SampleSet
+        The inputs and the recorded steps. Every shard is a slice of it, run with its `workers` and `chunk_size`.
+    shard_size : int
+        Number of files per shard.
+    suffix : str
+        The format of the shard outputs: '.parquet', '.h5' or '.hdf5' with the default `task`, or any suffix
+        written by `task`.
+    task : callable or None
+        `task(shard, path) -> int` processes a shard (a `SampleSet`) and writes its output to `path`, returning the
+        number of rows written, for example a feature table. Default writes the processed samples.
+    config : dict or None
+        The settings of the job (JSON serializable), for example the name and the parameters of the pipeline.
+        A job folder is only resumed with the same `config`.
+    restart : bool
+        Default is False. True discards the ledger and the outputs of a previous job in `directory`.
+    """
+
+    def __init__(
+        self,
+        directory: str | Path,
+        sampleset: SampleSet,
+        shard_size: int = 1024,
+        suffix: str = ".parquet",
+        task: Callable[[SampleSet, Path], int] | None = None,
+        config: dict[str, Any] | None = None,
+        restart: bool = False,
+    ):
+        if shard_size < 1:
+            raise ValueError(f"Expect shard_size to be at least 1. Got {shard_size=}")
+        self.directory: Path = Path(directory)
+        self.sampleset: SampleSet = sampleset
+        self.shard_size: int = shard_size
+        self.suffix: str = suffix if suffix.startswith(".") else f".{suffix}"
+        self.task: Callable[[SampleSet, Path], int] = _write_samples if task is None else task
+        self.config: dict[str, Any] = {} if config is None else json.loads(json.dumps(config, default=str))
+        self.ledger_path: Path = self.directory / "job.json"
+        self.lock_path: Path = self.directory / "job.lock"
+
+        paths = sampleset.paths
+        shards = []
+        for index, start in enumerate(range(0, len(paths), shard_size)):
+            stop = min(start + shard_size, len(paths))
+            shards.append(
+                {
+                    "index": index,
+                    "start": start,
+                    "stop": stop,
+                    "digest": _digest(paths[start:stop]),
+                    "output": f"shard-{index:05d}{self.suffix}",
+                    "status": "pending",
+                    "count": None,
+                    "mtime_ns": None,
+                    "attempts": 0,
+                    "elapsed": None,
+                    "error": None,
+                    "time": None,
+                }
+            )
+        self.shards: list[dict[str, Any]] = shards
+
+        if restart:
+            self._clear()
+        elif self.ledger_path.exists():
+            self._resume()
+
+    ############# Ledger #############
+
+    def _resume(self):
+        with open(self.ledger_path) as file:
+            content = json.load(file)
+        if content.get("version") != LEDGER_VERSION:
+            raise ValueError(f"Expect a ledger of version {LEDGER_VERSION}. Got {content.get('version')} in {self.ledger_path.as_posix()}")
+        recorded = content["shards"]
+        same = (
+            content["shard_size"] == self.shard_size
+            and content["suffix"] == self.suffix
+            and content["config"] == self.config
+            and [shard["digest"] for shard in recorded] == [shard["digest"] for shard in self.shards]
+        )
+        if same == False:
+            raise ValueError(
+                f"The job in {self.directory.as_posix()} was started with other inputs or settings. "
+                f"Use another directory or restart=True."
+            )
+        self.shards = recorded
+
+    def _clear(self):
+        for pattern in ["shard-*", ".shard-*"]:
+            for path in self.directory.glob(pattern):
+                path.unlink()
+        self.ledger_path.unlink(missing_ok=True)
+
+    def save(self):
+        """
+        Write the ledger atomically.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        temporary = self.ledger_path.with_name(f"{self.ledger_path.name}.{os.getpid()}.tmp")
+        content = {
+            "version": LEDGER_VERSION,
+            "shard_size": self.shard_size,
+            "suffix": self.suffix,
+            "config": self.config,
+            "shards": self.shards,
+        }
+        with open(temporary, "w") as file:
+            json.dump(content, file, indent=1)
+        os.replace(temporary, self.ledger_path)
+
+    def _stale(self, shard: dict[str, Any]) -> bool:
+        # A completed shard is run again when its output is gone or one of its files was modified since
+        if (self.directory / shard["output"]).exists() == False:
+            return True
+        return _mtime_ns(self.sampleset.paths[shard["start"] : shard["stop"]]) != shard["mtime_ns"]
+
+    @property
+    def pending(self) -> list[int]:
+        return [shard["index"] for shard in self.shards if shard["status"] == "pending" or (shard["status"] == "done" and self._stale(shard))]
+
+    @property
+    def failed(self) -> list[int]:
+        return [shard["index"] for shard in self.shards if shard["status"] == "failed"]
+
+    @property
+    def complete(self) -> bool:
+        return len(self.shards) > 0 and all(shard["status"] == "done" for shard in self.shards) and len(self.pending) == 0
+
+    def summary(self) -> dict[str, int]:
+        """
+        Number of shards by status.
+        """
+        counts = {status: 0 for status in SHARD_STATUS}
+        for shard in self.shards:
+            counts[shard["status"]] += 1
+        return counts
+
+    ############# Lock #############
+
+    def _lock(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        owner = f"{socket.gethostname()} {os.getpid()}"
+        for _ in range(2):
+            try:
+                descriptor = os.open(self.lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                host, _, pid = self.lock_path.read_text().strip().partition(" ")
+                # The lock of a process that died on this machine (killed before releasing it) is taken over
+                if host == socket.gethostname() and pid.isdigit() and _alive(int(pid)) == False:
+                    self.lock_path.unlink(missing_ok=True)
+                    continue
+                raise JobLockedError(f"The job in {self.directory.as_posix()} is run by {host} (pid {pid}). Remove {self.lock_path.as_posix()} if it is not.")
+            with os.fdopen(descriptor, "w") as file:
+                file.write(owner)
+            return
+        raise JobLockedError(f"Cannot lock {self.lock_path.as_posix()}")
+
+    def _unlock(self):
+        self.lock_path.unlink(missing_ok=True)
+
+    ############# Run #############
+
+    def _run_shard(self, shard: dict[str, Any]):
+        paths = self.sampleset.paths[shard["start"] : shard["stop"]]
+        output = self.directory / shard["output"]
+        temporary = output.with_name(f".{output.stem}.{os.getpid()}{self.suffix}")
+        shard["attempts"] += 1
+        start = perf_counter()
+        try:
+            mtime_ns = _mtime_ns(paths)
+            count = self.task(self.sampleset[shard["start"] : shard["stop"]], temporary)  # type: ignore
+            os.replace(temporary, output)
+        except Exception as error:
+            temporary.unlink(missing_ok=True)
+            _logger.warning(f"Shard {shard['index']} failed: {error!r}")
+            shard.update(status="failed", error="".join(traceback.format_exception_only(error)).strip(), time=_now())
+        except BaseException:
+            # Interrupted: the shard stays as it was and is run again on resume
+            temporary.unlink(missing_ok=True)
+            shard["attempts"] -= 1
+            raise
+        else:
+            shard.update(status="done", count=int(count), mtime_ns=mtime_ns, error=None, time=_now())
+        shard["elapsed"] = perf_counter() - start
+        self.save()
+
+    def run(
+        self,
+        only_failed: bool = False,
+        stop_on_error: bool = False,
+        callback: Callable[[dict[str, Any]], Any] | None = None,
+    ) -> dict[str, int]:
+        """
+        Run the shards that are not done, in order, and record every one in the ledger as soon as it ends.
+
+        Parameters
+        ----------
+        only_failed : bool
+            Default is False, which runs the pending and the failed shards. True runs only the failed shards.
+        stop_on_error : bool
+            Default is False, which records a failed shard and goes on. True raises the error of the first failure.
+        callback : callable or None
+            Called with the ledger entry of every shard once it ends, for example to report progress.
+
+        Returns
+        -------
+        dict of str to int :
+            Number of shards by status (see `summary`).
+        """
+        todo = set(self.failed) if only_failed else set(self.pending) | set(self.failed)
+        self._lock()
+        # A pre-emption (SIGTERM) stops the job like Ctrl-C, after cleaning the shard in progress
+        handler = None
+        if threading.current_thread() is threading.main_thread():
+            handler = signal.signal(signal.SIGTERM, _interrupt)
+        try:
+            self.save()
+            for shard in self.shards:
+                if shard["index"] not in todo:
+                    continue
+                self._run_shard(shard)
+                if callback is not None:
+                    callback(shard)
+                if shard["status"] == "failed" and stop_on_error:
+                    raise RuntimeError(f"Shard {shard['index']} failed: {shard['error']}")
+        finally:
+            if handler is not None:
+                signal.signal(signal.SIGTERM, handler)
+            self._unlock()
+        _logger.info(f"{self}")
+        return self.summary()
+
+    ############# Outputs #############
+
+    def outputs(self) -> list[Path]:
+        """
+        The output files of the completed shards, in order.
+        """
+        return [self.directory / shard["output"] for shard in self.shards if shard["status"] == "done"]
+
+    def iter_samples(self) -> Iterator[Sample]:
+        """
+        The samples of the completed shards, read one shard at a time. Only with the default `task`.
+        """
+        for path in self.outputs():
+            yield from _read_samples(path)
+
+    def merge(self, output: str | Path) -> int:
+        """
+        Write the samples of the whole job to one .parquet, .h5 or .hdf5 file. Every shard must be done.
+        """
+        if self.complete == False:
+            raise ValueError(f"Cannot merge an incomplete job: {self.summary()}, {len(self.pending)} to run.")
+        return _write_samples(self.iter_samples(), Path(output))
+
+    def __repr__(self) -> str:
+        return f"ShardJob({self.directory.as_posix()}, {len(self.shards)} shards, {self.summary()})"
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt(f"Signal {signum}")
+
+
+def _now() -> str:
+    return datetime.now().isoformat(timespec="seconds")
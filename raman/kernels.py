@@ -0,0 +1,373 @@
+"""
+Kernels of the per-element loops, over whole stacks of spectra.
+
+Every kernel has two implementations with the same results (up to the rounding of the sums):
+
+- 'numpy': the computation with NumPy, vectorized over the stack.
+- 'numba' (experimental): a loop compiled with Numba (optional, `uv sync --extra kernels` or `pip install numba`),
+  compiled on the first call and cached on disk. `python -m benchmarks.bench_kernels` checks it against 'numpy'
+  when it is installed.
+
+The backend is 'numpy' by default, and can be switched ('numba', or 'auto' for Numba when it is installed) for the
+process with `set_backend`, for a block with `use_backend`, or with the RAMAN_KERNELS environment variable.
+
+    >>> with kernels.use_backend("numpy"):
+    ...     Y = kernels.despike(Y, neigh=3, threshold=3)
+
+Kernels:
+
+- `repair_spikes`: linear interpolation over spike regions, like `Sample.remove_spike`.
+- `neighbour_mean` and `despike`: the mean of the non-spike neighbours of every spike, like
+  `rampy.spectranization.despiking`.
+- `weighted_sum`: the weighted sum of the rows of every group, like `Sample.__or__` and `grouped_mean`.
+- `band_means` and `band_integrals`: the mean and the (trapezoidal) area of Raman Shift bands.
+"""
+import numpy as np
+from numpy.typing import NDArray
+from scipy.signal import savgol_filter  # type: ignore
+
+import os
+from contextlib import contextmanager
+from typing import Iterable, Iterator
+
+try:
+    import numba  # type: ignore
+except ImportError:
+    numba = None
+
+NUMBA_AVAILABLE: bool = numba is not None
+
+BACKENDS: list[str] = ["auto", "numba", "numpy"]
+
+_backend: str = os.environ.get("RAMAN_KERNELS", "numpy")
+
+
+def set_backend(backend: str):
+    """
+    Use the 'numpy' kernels, the experimental 'numba' ones, or 'auto' (Numba when it is installed).
+    """
+    global _backend
+    if backend not in BACKENDS:
+        raise ValueError(f"Expect backend to be one of {BACKENDS}. Got {backend=}")
+    if backend == "numba" and NUMBA_AVAILABLE == False:
+        raise ImportError(f"`numba` is required for backend='numba'. Install it with `uv sync --extra kernels` or `pip install numba`.")
+    _backend = backend
+
+
+def get_backend() -> str:
+    """
+    The backend the kernels run with: 'numba' or 'numpy'.
+    """
+    if _backend not in BACKENDS:
+        raise ValueError(f"Expect RAMAN_KERNELS to be one of {BACKENDS}. Got {_backend!r}")
+    if _backend == "auto":
+        return "numba" if NUMBA_AVAILABLE else "numpy"
+    if _backend == "numba" and NUMBA_AVAILABLE == False:
+        raise ImportError(f"`numba` is required for RAMAN_KERNELS=numba. Install it with `uv sync --extra kernels` or `pip install numba`.")
+    return _backend
+
+
+@contextmanager
+def use_backend(backend: str) -> Iterator[str]:
+    """
+    Switch the backend inside a `with` block.
+    """
+    previous = _backend
+    set_backend(backend)
+    try:
+        yield get_backend()
+    finally:
+        set_backend(previous)
+
+
+def _jit(func):
+    # Compiled lazily on the first call, for the dtypes it is called with
+    if numba is None:
+        return None
+    return numba.njit(cache=True, nogil=True)(func)
+
+
+############# Spike repair #############
+
+
+def _repair_spikes_loop(Y, rows, starts, stops):
+    for k in range(rows.shape[0]):
+        r, lo, hi = rows[k], starts[k] - 1, stops[k]
+        y_lo, y_hi = Y[r, lo], Y[r, hi]
+        slope = (y_hi - y_lo) / (hi - lo)
+        for i in range(starts[k], stops[k]):
+            Y[r, i] = slope * (i - lo) + y_lo
+
+
+_repair_spikes_jit = _jit(_repair_spikes_loop)
+
+
+def repair_spikes(Y: NDArray, rows: NDArray, starts: NDArray, stops: NDArray) -> NDArray:
+    """
+    Replace spike regions by the line between their neighbours, in place and in order.
+
+    It is the `scipy.interpolate.interp1d(kind='linear')` of `Sample.remove_spike` over a window as long as the
+    region on both sides: only the points next to the region are used.
+
+    Parameters
+    ----------
+    Y : NDArray of shape (n_spectra, n_shifts)
+        The intensity, updated in place.
+    rows, starts, stops : NDArray of int of shape (n_regions, )
+        The row of every region and its indexes `[start, stop)`. As with NumPy indexing, a negative start
+        counts from the end.
+
+    Returns
+    -------
+    NDArray :
+        `Y`.
+    """
+    rows, starts, stops = (np.asarray(value, dtype=np.int64).reshape(-1) for value in (rows, starts, stops))
+    if rows.shape[0] == 0:
+        return Y
+    n = Y.shape[1]
+    lengths = stops - starts
+    if (lengths < 1).any():
+        raise ValueError(f"Expect every spike region to have stop > start.")
+    if ((starts - lengths < -n) | (stops - 1 + lengths >= n)).any():
+        raise IndexError(f"A spike region is too close to the end of the spectrum (n_shifts={n}) to be interpolated.")
+    if get_backend() == "numba":
+        _repair_spikes_jit(Y, rows, starts, stops)  # type: ignore
+        return Y
+    for r, start, stop in zip(rows, starts, stops):
+        lo, hi = start - 1, stop
+        y_lo, y_hi = Y[r, lo], Y[r, hi]
+        index = np.arange(start, stop)
+        Y[r, index] = (y_hi - y_lo) / (hi - lo) * (index - lo) + y_lo
+    return Y
+
+
+############# Windowed statistics #############
+
+
+def _neighbour_mean_loop(Y, mask, neigh, out):
+    n = Y.shape[1]
+    for r in range(Y.shape[0]):
+        for i in range(n):
+            if mask[r, i] == False:
+                continue
+            total, count = 0.0, 0
+            for j in range(max(i - neigh, 0), min(i + neigh + 1, n)):
+                if mask[r, j] == False:
+                    total += Y[r, j]
+                    count += 1
+            out[r, i] = total / count if count > 0 else np.nan
+
+
+_neighbour_mean_jit = _jit(_neighbour_mean_loop)
+
+
+def neighbour_mean(Y: NDArray, mask: NDArray, neigh: int) -> NDArray:
+    """
+    Replace every masked point by the mean of the points within `neigh` of it that are not masked
+    (NaN when there is none).
+
+    Parameters
+    ----------
+    Y : NDArray of shape (n_spectra, n_shifts)
+        The intensity.
+    mask : NDArray of bool of shape (n_spectra, n_shifts)
+        The points to replace, for example the spikes.
+    neigh : int
+        The half width of the window.
+
+    Returns
+    -------
+    NDArray :
+        A new array.
+    """
+    Y = np.atleast_2d(Y)
+    mask = np.atleast_2d(np.asarray(mask, dtype=bool))
+    if mask.shape != Y.shape:
+        raise ValueError(f"Expect mask to have the shape of Y {Y.shape}. Got {mask.shape}")
+    out = Y.copy()
+    if get_backend() == "numba":
+        _neighbour_mean_jit(Y, mask, int(neigh), out)  # type: ignore
+        return out
+    rows, columns = np.nonzero(mask)
+    if rows.shape[0] == 0:
+        return out
+    index = columns[:, None] + np.arange(-neigh, neigh + 1)
+    inside = (index >= 0) & (index < Y.shape[1])
+    index = np.clip(index, 0, Y.shape[1] - 1)
+    keep = inside & (mask[rows[:, None], index] == False)
+    values = np.where(keep, Y[rows[:, None], index], 0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        out[rows, columns] = values.sum(axis=1) / keep.sum(axis=1)
+    return out
+
+
+def despike(Y: NDArray, neigh: int = 4, threshold: float = 3) -> NDArray:
+    """
+    `rampy.spectranization.despiking` over a stack: a point further than `threshold` times the RMSE from the
+    Savitzky-Golay smoothing (window `neigh`, order 2) of its spectrum is replaced by `neighbour_mean`.
+
+    Returns
+    -------
+    NDArray :
+        A new array of the shape of `Y`.
+    """
+    Y = np.atleast_2d(Y)
+    residual = Y - savgol_filter(Y, neigh, 2, axis=1)
+    local = np.sqrt(residual**2)
+    rmse = np.sqrt(np.mean(residual**2, axis=1, keepdims=True))
+    return neighbour_mean(Y, local > threshold * rmse, neigh)
+
+
+############# Weighted accumulation #############
+
+
+def _weighted_sum_loop(Y, codes, weights, sums, totals):
+    for r in range(Y.shape[0]):
+        g, w = codes[r], weights[r]
+        totals[g] += w
+        for j in range(Y.shape[1]):
+            sums[g, j] += w * Y[r, j]
+
+
+_weighted_sum_jit = _jit(_weighted_sum_loop)
+
+
+def weighted_sum(
+    Y: NDArray, codes: NDArray, weights: NDArray | None = None, n_groups: int | None = None
+) -> tuple[NDArray[np.float64], NDArray[np.float64]]:
+    """
+    The weighted sum of the rows of every group, in the input order.
+
+    Parameters
+    ----------
+    Y : NDArray of shape (n_spectra, n_shifts)
+        The intensity.
+    codes : NDArray of int of shape (n_spectra, )
+        The group of every row, from 0 to `n_groups` - 1.
+    weights : NDArray of shape (n_spectra, ) or None
+        The weight of every row. Default is None, which weights every row 1.
+    n_groups : int or None
+        Default is None, which is `codes.max() + 1`.
+
+    Returns
+    -------
+    NDArray of shape (n_groups, n_shifts) :
+        sum(w * y) of every group.
+    NDArray of shape (n_groups, ) :
+        sum(w) of every group.
+    """
+    Y = np.atleast_2d(Y)
+    codes = np.asarray(codes, dtype=np.int64).reshape(-1)
+    if codes.shape[0] != Y.shape[0]:
+        raise ValueError(f"Expect one code per spectrum. Got {codes.shape[0]} codes for {Y.shape[0]} spectra.")
+    weights = np.ones(Y.shape[0]) if weights is None else np.asarray(weights, dtype=np.float64).reshape(-1)
+    n_groups = (int(codes.max()) + 1 if codes.shape[0] > 0 else 0) if n_groups is None else n_groups
+    sums, totals = np.zeros((n_groups, Y.shape[1])), np.zeros(n_groups)
+    if codes.shape[0] == 0:
+        return sums, totals
+    if get_backend() == "numba":
+        _weighted_sum_jit(Y, codes, weights, sums, totals)  # type: ignore
+        return sums, totals
+    if n_groups <= 256:
+        # A few groups: one matrix product with the (n_groups, n_spectra) weight matrix
+        membership = np.zeros((n_groups, Y.shape[0]))
+        membership[codes, np.arange(Y.shape[0])] = weights
+        return membership @ Y, membership.sum(axis=1)
+    order = np.argsort(codes, kind="stable")
+    starts = np.flatnonzero(np.r_[True, np.diff(codes[order]) != 0])
+    present = codes[order][starts]
+    sums[present] = np.add.reduceat(Y[order] * weights[order, None], starts, axis=0)
+    totals[present] = np.add.reduceat(weights[order], starts)
+    return sums, totals
+
+
+############# Band integration #############
+
+
+def _band_means_loop(Y, lows, highs, out):
+    for r in range(Y.shape[0]):
+        for b in range(lows.shape[0]):
+            if highs[b] <= lows[b]:
+                out[r, b] = np.nan
+                continue
+            total = 0.0
+            for j in range(lows[b], highs[b]):
+                total += Y[r, j]
+            out[r, b] = total / (highs[b] - lows[b])
+
+
+def _band_integrals_loop(x, Y, lows, highs, out):
+    for r in range(Y.shape[0]):
+        for b in range(lows.shape[0]):
+            total = 0.0
+            for j in range(lows[b], highs[b] - 1):
+                total += 0.5 * (x[j + 1] - x[j]) * (Y[r, j] + Y[r, j + 1])
+            out[r, b] = total
+
+
+_band_means_jit = _jit(_band_means_loop)
+_band_integrals_jit = _jit(_band_integrals_loop)
+
+
+def _increasing(x: NDArray) -> bool:
+    return x.shape[0] < 2 or bool((np.diff(x) > 0).all())
+
+
+def _band_bounds(x: NDArray, bands: NDArray) -> tuple[NDArray[np.int64], NDArray[np.int64]]:
+    lows = np.searchsorted(x, bands[:, 0], side="left")
+    highs = np.searchsorted(x, bands[:, 1], side="right")
+    return lows.astype(np.int64), np.maximum(highs, lows).astype(np.int64)
+
+
+def band_means(x: NDArray, Y: NDArray, bands: Iterable[tuple[float, float]]) -> NDArray[np.float64]:
+    """
+    The mean intensity of every spectrum with a Raman Shift in [low, high] of every band (NaN when none).
+
+    Parameters
+    ----------
+    x : NDArray of shape (n_shifts, )
+        The Raman Shift. The kernels run when it is increasing.
+    Y : NDArray of shape (n_spectra, n_shifts)
+        The intensity.
+    bands : iterable of (float, float)
+        The (low, high) of every band.
+
+    Returns
+    -------
+    NDArray of shape (n_spectra, n_bands)
+    """
+    Y, x = np.atleast_2d(Y), np.asarray(x)
+    bands = np.asarray(list(bands), dtype=np.float64).reshape(-1, 2)
+    out = np.empty((Y.shape[0], bands.shape[0]))
+    if _increasing(x) == False:
+        for b, (low, high) in enumerate(bands):
+            window = (x >= low) & (x <= high)
+            out[:, b] = Y[:, window].mean(axis=1) if window.any() else np.nan
+        return out
+    lows, highs = _band_bounds(x, bands)
+    if get_backend() == "numba":
+        _band_means_jit(Y, lows, highs, out)  # type: ignore
+        return out
+    for b, (low, high) in enumerate(zip(lows, highs)):
+        out[:, b] = Y[:, low:high].mean(axis=1) if high > low else np.nan
+    return out
+
+
+def band_integrals(x: NDArray, Y: NDArray, bands: Iterable[tuple[float, float]]) -> NDArray[np.float64]:
+    """
+    The trapezoidal area of every spectrum over the points with a Raman Shift in [low, high] of every band
+    (0 with less than two points). See `band_means` for the parameters.
+    """
+    Y, x = np.atleast_2d(Y), np.asarray(x)
+    if _increasing(x) == False:
+        raise ValueError(f"Expect the Raman Shift to be increasing.")
+    lows, highs = _band_bounds(x, np.asarray(list(bands), dtype=np.float64).reshape(-1, 2))
+    out = np.zeros((Y.shape[0], lows.shape[0]))
+    if get_backend() == "numba":
+        _band_integrals_jit(x, Y, lows, highs, out)  # type: ignore
+        return out
+    for b, (low, high) in enumerate(zip(lows, highs)):
+        if high - low > 1:
+            out[:, b] = np.trapezoid(Y[:, low:high], x[low:high], axis=1)
+    return out
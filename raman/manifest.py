@@ -0,0 +1,258 @@
+"""
+A persistent manifest of ingested files.
+
+Every file handed to the database is recorded with its size, modification time, content digest, acquisition key
+and the IDs of the documents made from it. A new ingestion run then only parses what is new or changed:
+
+- a file whose size and modification time are unchanged is skipped without being read,
+- a file with the same content as an ingested one (a copy) is a duplicate,
+- a file of the same acquisition as an ingested one (the same name and instrument timestamp, for example the
+  `sample` and `txt` exports of `data/bloodSERs/5x`) is a duplicate,
+
+so a nightly sync of a growing archive costs one `stat` per file plus the parsing of the new files.
+
+    >>> manifest = Manifest("ingest-manifest.json")
+    >>> plan = manifest.plan(sorted(Path("data/pilot/s1").glob("*.txt")))
+    >>> for path in plan["new"] + plan["changed"]:
+    ...     item = Finger.from_file(path)
+    ...     item._id = manifest.document_of(path)  # Update the document of a changed file in place
+    ...     item.save()
+    ...     manifest.record(path, documents=[item._id])
+    >>> manifest.save()
+"""
+import hashlib
+import json
+import os
+import re
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Iterable
+
+MANIFEST_VERSION = 1
+
+# <name>_..._<year>_<month>_<date>_<hour>_<minute>_<second>_<index>.txt
+_ACQUISITION = re.compile(r"^(?P<name>[^_]+)_.*_(?P<timestamp>\d{4}(?:_\d{1,2}){5})_\d+$")
+
+
+def file_digest(path: str | Path, chunk_size: int = 2**20) -> str:
+    """
+    The blake2b digest of the content of a file.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as file:
+        while chunk := file.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def acquisition_key(path: str | Path) -> str | None:
+    """
+    The acquisition of a file from its name: '<name>@<year>_<month>_<date>_<hour>_<minute>_<second>'.
+    Exports of the same measurement share it even when other fields (accumulation, folder) differ.
+    None when the name does not follow the instrument naming.
+    """
+    match = _ACQUISITION.match(Path(path).stem)
+    if match is None:
+        return None
+    return f"{match['name']}@{match['timestamp']}"
+
+
+class Manifest:
+    """
+    The ingested files, stored as JSON at `path`.
+
+    Every entry is keyed by the POSIX path of the file and holds `size`, `mtime_ns`, `digest`, `acquisition`,
+    `status` ('saved', 'duplicate', 'exists' or 'error'), `documents` (the database IDs, as strings),
+    `duplicate_of` (the path of the original for duplicates), `error` and `time` (when it was recorded).
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        The JSON file. It is read when it exists.
+    """
+
+    def __init__(self, path: str | Path):
+        self.path: Path = Path(path)
+        self.entries: dict[str, dict[str, Any]] = {}
+        if self.path.exists():
+            with open(self.path) as file:
+                content = json.load(file)
+            if content.get("version") != MANIFEST_VERSION:
+                raise ValueError(f"Expect a manifest of version {MANIFEST_VERSION}. Got {content.get('version')} in {self.path.as_posix()}")
+            self.entries = content["entries"]
+        self._pending: dict[str, dict[str, Any]] = {}
+        self._digests: dict[str, str] = {}
+        self._acquisitions: dict[str, str] = {}
+        for key, entry in self.entries.items():
+            self._index(key, entry)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, path: str | Path) -> bool:
+        return Path(path).as_posix() in self.entries
+
+    def _index(self, key: str, entry: dict[str, Any]):
+        if entry["status"] in ["error", "duplicate"]:
+            return
+        self._digests.setdefault(entry["digest"], key)
+        if entry["acquisition"] is not None:
+            self._acquisitions.setdefault(entry["acquisition"], key)
+
+    def _unindex(self, key: str, entry: dict[str, Any]):
+        if self._digests.get(entry["digest"]) == key:
+            del self._digests[entry["digest"]]
+        if entry["acquisition"] is not None and self._acquisitions.get(entry["acquisition"]) == key:
+            del self._acquisitions[entry["acquisition"]]
+
+    def plan(self, paths: Iterable[str | Path]) -> dict[str, list[Path]]:
+        """
+        Sort files by what ingestion has to do with them. Only new or modified files are read (to hash them).
+
+        Duplicates are recorded right away. New and changed files are remembered until `record` is called,
+        so an interrupted run simply plans them again.
+
+        Parameters
+        ----------
+        paths : iterable of str or pathlib.Path
+            The files, in priority order: of two duplicates found in the same call, the first one is ingested.
+
+        Returns
+        -------
+        dict of list of pathlib.Path :
+            'new' and 'changed' (to parse and save), 'duplicate' and 'unchanged' (nothing to do).
+        """
+        plan: dict[str, list[Path]] = {"new": [], "changed": [], "duplicate": [], "unchanged": []}
+        for path in map(Path, paths):
+            key = path.as_posix()
+            stat = path.stat()
+            entry = self.entries.get(key)
+            if entry is not None and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+                plan["unchanged"].append(path)
+                continue
+            digest = file_digest(path)
+            if entry is not None and entry["digest"] == digest:
+                # Touched but not modified
+                entry["mtime_ns"] = stat.st_mtime_ns
+                plan["unchanged"].append(path)
+                continue
+            if entry is not None:
+                self._unindex(key, entry)
+            acquisition = acquisition_key(path)
+            candidate = {
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "digest": digest,
+                "acquisition": acquisition,
+                "status": None,
+                "documents": [] if entry is None else entry["documents"],
+                "duplicate_of": None,
+                "error": None,
+                "time": None,
+            }
+            original = self._digests.get(digest)
+            if original is None and acquisition is not None:
+                original = self._acquisitions.get(acquisition)
+            if original is not None and original != key:
+                self.entries[key] = {**candidate, "status": "duplicate", "documents": [], "duplicate_of": original, "time": _now()}
+                plan["duplicate"].append(path)
+                continue
+            self._pending[key] = candidate
+            # Claim the digest and the acquisition so later copies in this call are duplicates of this file
+            self._digests.setdefault(digest, key)
+            if acquisition is not None:
+                self._acquisitions.setdefault(acquisition, key)
+            plan["new" if entry is None else "changed"].append(path)
+        return plan
+
+    def record(self, path: str | Path, documents: Iterable[Any] = (), status: str = "saved", error: str | None = None):
+        """
+        Record the outcome of a planned file.
+
+        Parameters
+        ----------
+        path : str or pathlib.Path
+            A file returned as 'new' or 'changed' by `plan`.
+        documents : iterable
+            The IDs of the documents made from the file.
+        status : str
+            'saved', 'exists' (the document was already in the database) or 'error' (the file could not be parsed;
+            it is planned again only once it changes).
+        error : str or None
+            The error message, for status='error'.
+        """
+        key = Path(path).as_posix()
+        if key not in self._pending:
+            raise ValueError(f"{key} is not planned. Call `plan` first.")
+        if status not in ["saved", "exists", "error"]:
+            raise ValueError(f"Expect status to be one of ['saved', 'exists', 'error']. Got {status=}")
+        entry = self._pending.pop(key)
+        entry.update(status=status, error=error, time=_now())
+        if status != "error":
+            entry["documents"] = [str(document) for document in documents]
+        else:
+            self._unindex(key, entry)
+        self.entries[key] = entry
+
+    def document_of(self, path: str | Path) -> Any:
+        """
+        The first database ID of the documents made from a file (following duplicates), or None.
+        """
+        documents = self.documents_of(path)
+        if len(documents) == 0:
+            return None
+        from bson import ObjectId
+
+        return ObjectId(documents[0]) if ObjectId.is_valid(documents[0]) else documents[0]
+
+    def documents_of(self, path: str | Path) -> list[str]:
+        """
+        The database IDs of the documents made from a file, following duplicates to their original.
+        """
+        entry = self.entries.get(Path(path).as_posix())
+        seen: set[int] = set()
+        while entry is not None and entry["duplicate_of"] is not None and id(entry) not in seen:
+            seen.add(id(entry))
+            entry = self.entries.get(entry["duplicate_of"])
+        return [] if entry is None else list(entry["documents"])
+
+    def missing(self) -> list[str]:
+        """
+        The recorded files that do not exist anymore. Their documents are kept; drop them with `forget`.
+        """
+        return [key for key in self.entries if Path(key).exists() == False]
+
+    def forget(self, paths: Iterable[str | Path]):
+        """
+        Remove files from the manifest, so they are planned as new if they come back.
+        """
+        for key in map(lambda path: Path(path).as_posix(), paths):
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self._unindex(key, entry)
+
+    def summary(self) -> dict[str, int]:
+        """
+        Number of entries by status.
+        """
+        counts: dict[str, int] = {}
+        for entry in self.entries.values():
+            counts[entry["status"]] = counts.get(entry["status"], 0) + 1
+        return counts
+
+    def save(self):
+        """
+        Write the manifest atomically, so an interrupted run never leaves a partial file.
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        with open(temporary, "w") as file:
+            json.dump({"version": MANIFEST_VERSION, "entries": self.entries}, file, indent=1)
+        os.replace(temporary, self.path)
+
+    def __repr__(self) -> str:
+        return f"Manifest({self.path.as_posix()}, {self.summary()})"
+
+
+def _now() -> str:
+    return datetime.now().isoformat(timespec="seconds")
@@ -0,0 +1,280 @@
+"""
+Content-addressed memoization of pipeline stages.
+
+A stage result is stored under a key made of the stage name, a fast hash of the input arrays and the parameters,
+so re-running an analysis only recomputes the stages whose input or parameters changed: a stage after a changed
+one sees a different input and misses, the stages before it hit.
+
+Memoization is off until `enable` is called. It then covers the preprocessing methods of `Sample` (`interpolate`,
+`despike`, `smoothing`, `normalized`, `baseline`, `extract_range`) and `raman.model.EMSC.correct`.
+
+    >>> from raman import memo
+    >>> memo.enable(memory_bytes=512 * 2**20, directory=".raman-cache")
+    >>> ...                     # run the notebook
+    >>> memo.get_cache().stats  # {'memory_hits': ..., 'disk_hits': ..., 'misses': ..., ...}
+"""
+import numpy as np
+from numpy.typing import NDArray
+
+import hashlib
+import os
+from collections import OrderedDict
+from functools import wraps
+from pathlib import Path
+from typing import Any, Callable
+
+# A stage result: named arrays (scalars are stored as 0-d arrays).
+Result = dict[str, NDArray]
+
+
+def _update_hash(digest, value: Any):
+    if isinstance(value, np.ndarray):
+        value = np.ascontiguousarray(value)
+        digest.update(f"ndarray{value.dtype.str}{value.shape}".encode())
+        digest.update(value.data)  # type: ignore
+    elif isinstance(value, dict):
+        digest.update(b"dict")
+        for key in sorted(value):
+            digest.update(str(key).encode())
+            _update_hash(digest, value[key])
+    elif isinstance(value, (list, tuple)):
+        digest.update(f"{type(value).__name__}{len(value)}".encode())
+        for item in value:
+            _update_hash(digest, item)
+    else:
+        digest.update(f"{type(value).__name__}:{value!r}".encode())
+
+
+def content_key(stage: str, *values: Any) -> str:
+    """
+    The key of a stage call: a blake2b digest of the stage name, the bytes of the arrays and the other values.
+    """
+    digest = hashlib.blake2b(stage.encode(), digest_size=20)
+    for value in values:
+        _update_hash(digest, value)
+    return digest.hexdigest()
+
+
+def _nbytes(result: Result) -> int:
+    return sum(value.nbytes for value in result.values())
+
+
+class MemoCache:
+    """
+    A two-tier LRU cache of stage results: in memory, then on disk.
+
+    Parameters
+    ----------
+    memory_bytes : int
+        The budget of the in-memory tier. The least recently used results are evicted first.
+    directory : str, pathlib.Path or None
+        The folder of the on-disk tier, one .npz file per result. Default is None, which keeps only the memory tier.
+        Several processes can share a folder: files are written atomically.
+    disk_bytes : int
+        The budget of the on-disk tier.
+    """
+
+    def __init__(
+        self,
+        memory_bytes: int = 256 * 2**20,
+        directory: str | Path | None = None,
+        disk_bytes: int = 4 * 2**30,
+    ):
+        self.memory_bytes: int = memory_bytes
+        self.disk_bytes: int = disk_bytes
+        self.directory: Path | None = None if directory is None else Path(directory)
+        self._memory: OrderedDict[str, tuple[Result, int]] = OrderedDict()
+        self._memory_nbytes: int = 0
+        self._disk: OrderedDict[str, int] = OrderedDict()
+        self._disk_nbytes: int = 0
+        self.reset_stats()
+        if self.directory is not None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            # Rebuild the LRU order of a previous session from the access times
+            files = sorted(self.directory.glob("*.npz"), key=lambda path: path.stat().st_mtime)
+            for path in files:
+                size = path.stat().st_size
+                self._disk[path.stem] = size
+                self._disk_nbytes += size
+
+    def reset_stats(self):
+        self._stats: dict[str, int] = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "memory_evictions": 0,
+            "disk_evictions": 0,
+        }
+
+    @property
+    def stats(self) -> dict[str, Any]:
+        """
+        Hit, miss and eviction counters, the hit rate and the size of both tiers.
+        """
+        stats: dict[str, Any] = dict(self._stats)
+        total = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / total if total > 0 else 0.0
+        stats["memory_items"], stats["memory_bytes"] = len(self._memory), self._memory_nbytes
+        stats["disk_items"], stats["disk_bytes"] = len(self._disk), self._disk_nbytes
+        return stats
+
+    def _path(self, key: str) -> Path:
+        return self.directory.joinpath(f"{key}.npz")  # type: ignore
+
+    def _put_memory(self, key: str, result: Result):
+        if key in self._memory:
+            self._memory_nbytes -= self._memory.pop(key)[1]
+        nbytes = _nbytes(result)
+        if nbytes > self.memory_bytes:
+            return
+        self._memory[key] = (result, nbytes)
+        self._memory_nbytes += nbytes
+        while self._memory_nbytes > self.memory_bytes:
+            _, (_, evicted) = self._memory.popitem(last=False)
+            self._memory_nbytes -= evicted
+            self._stats["memory_evictions"] += 1
+
+    def _put_disk(self, key: str, result: Result):
+        path = self._path(key)
+        temporary = path.with_name(f"{key}.{os.getpid()}.tmp")
+        with open(temporary, "wb") as file:
+            np.savez(file, **result)
+        os.replace(temporary, path)
+        size = path.stat().st_size
+        if key in self._disk:
+            self._disk_nbytes -= self._disk.pop(key)
+        self._disk[key] = size
+        self._disk_nbytes += size
+        while self._disk_nbytes > self.disk_bytes and len(self._disk) > 0:
+            evicted, evicted_size = self._disk.popitem(last=False)
+            self._disk_nbytes -= evicted_size
+            self._path(evicted).unlink(missing_ok=True)
+            self._stats["disk_evictions"] += 1
+
+    def get(self, key: str) -> Result | None:
+        """
+        Return the stored result of `key`, or None. A disk hit is promoted to the memory tier.
+        """
+        item = self._memory.get(key)
+        if item is not None:
+            self._memory.move_to_end(key)
+            self._stats["memory_hits"] += 1
+            return item[0]
+        if self.directory is not None and (key in self._disk or self._path(key).exists()):
+            path = self._path(key)
+            try:
+                with np.load(path) as file:
+                    result = {name: file[name] for name in file.files}
+            except (FileNotFoundError, OSError, ValueError):
+                # Evicted by another process, or a partial file
+                self._disk_nbytes -= self._disk.pop(key, 0)
+            else:
+                if key not in self._disk:
+                    # Written by another process sharing the folder
+                    self._disk[key] = path.stat().st_size
+                    self._disk_nbytes += self._disk[key]
+                self._disk.move_to_end(key)
+                os.utime(path)
+                for value in result.values():
+                    value.setflags(write=False)
+                self._stats["disk_hits"] += 1
+                self._put_memory(key, result)
+                return result
+        self._stats["misses"] += 1
+        return None
+
+    def put(self, key: str, result: Result):
+        """
+        Store a result in both tiers. The arrays are made read-only, since hits share them.
+        """
+        for value in result.values():
+            value.setflags(write=False)
+        self._put_memory(key, result)
+        if self.directory is not None:
+            self._put_disk(key, result)
+
+    def clear(self, disk: bool = False):
+        """
+        Empty the memory tier, and the disk tier too when `disk` is True.
+        """
+        self._memory.clear()
+        self._memory_nbytes = 0
+        if disk and self.directory is not None:
+            for key in self._disk:
+                self._path(key).unlink(missing_ok=True)
+            self._disk.clear()
+            self._disk_nbytes = 0
+
+    def __repr__(self) -> str:
+        directory = None if self.directory is None else self.directory.as_posix()
+        return f"MemoCache(memory={self._memory_nbytes}/{self.memory_bytes} bytes, directory={directory}, disk={self._disk_nbytes}/{self.disk_bytes} bytes)"
+
+
+_cache: MemoCache | None = None
+
+
+def enable(memory_bytes: int = 256 * 2**20, directory: str | Path | None = None, disk_bytes: int = 4 * 2**30) -> MemoCache:
+    """
+    Turn memoization on with a new `MemoCache` and return it.
+    """
+    global _cache
+    _cache = MemoCache(memory_bytes=memory_bytes, directory=directory, disk_bytes=disk_bytes)
+    return _cache
+
+
+def disable():
+    """
+    Turn memoization off.
+    """
+    global _cache
+    _cache = None
+
+
+def get_cache() -> MemoCache | None:
+    """
+    The active cache, or None when memoization is off.
+    """
+    return _cache
+
+
+def memoize(stage: str, func: Callable[[], Result], *inputs: Any) -> Result:
+    """
+    Return `func()`, or its stored result when `stage` already ran on the same `inputs` (arrays and parameters).
+    """
+    if _cache is None:
+        return func()
+    key = content_key(stage, *inputs)
+    result = _cache.get(key)
+    if result is None:
+        result = func()
+        _cache.put(key, result)
+    return result
+
+
+def memoized_method(method: Callable) -> Callable:
+    """
+    Memoize a `Sample` method that updates `x`, `y` and `_dx` in place and returns an array or None.
+    The key is the method name, the current `x`, `y`, `_dx` and the arguments.
+    """
+    stage = f"Sample.{method.__name__}"
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if _cache is None:
+            return method(self, *args, **kwargs)
+
+        key = content_key(stage, self.x, self.y, float(self._dx), args, kwargs)
+        result = _cache.get(key)
+        if result is None:
+            returned = method(self, *args, **kwargs)
+            result = {"x": np.array(self.x), "y": np.array(self.y), "dx": np.asarray(float(self._dx))}
+            if returned is not None:
+                result["returned"] = np.array(returned)
+            _cache.put(key, result)
+            return returned
+        self.x = result["x"]
+        self.y = result["y"]
+        self._dx = float(result["dx"])
+        return None if "returned" not in result else result["returned"].copy()
+
+    return wrapper
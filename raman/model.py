@@ -1,6 +1,16 @@
+from raman.sample import Sample
+from raman.axis import same_axis
+from raman.memo import memoize
+
 import numpy as np
+from numpy.typing import NDArray
 from sklearn.linear_model import LinearRegression  # type: ignore
 
+from datetime import datetime
+from itertools import islice
+from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator, Self
+
 # from sklearn.linear_model._base import LinearModel
 # from sklearn.base import MultiOutputMixin, RegressorMixin
 
@@ -85,3 +95,430 @@ class EMSC:
             )
 
         return self._corrected
+
+    def correct_batch(self, composite_signals: np.ndarray, normalize: bool = True) -> np.ndarray:
+        """
+        `fit` then `transform` every row of `composite_signals` (n_signals, raman_shift) with one least-squares solve.
+        The design matrix (references and baseline) is shared, so every signal is one right-hand side.
+        The model is not updated. `np.linalg.lstsq` is used, which stays accurate when the polynomial baseline
+        of a raw Raman Shift is badly conditioned, where the `LinearRegression` of `fit` may not.
+        """
+        if composite_signals.ndim != 2 or composite_signals.shape[1] != self.x_range[0]:
+            raise ValueError(f"Expect signals of shape (n_signals, {self.x_range[0]}). Got {composite_signals.shape}")
+        coefficients, *_ = np.linalg.lstsq(self.X, composite_signals.T, rcond=None)
+        # Background is everything but the first reference
+        background = (self.X[:, 1:] @ coefficients[1:]).T
+        corrected = (composite_signals - background) / coefficients[0][:, None]
+        if normalize:
+            low = corrected.min(axis=1, keepdims=True)
+            corrected = (corrected - low) / (corrected.max(axis=1, keepdims=True) - low)
+        return corrected
+
+    def correct(self, composite_signal: np.ndarray, normalize: bool = True) -> np.ndarray:
+        """
+        `fit` then `transform` a signal. The result is memoized with `raman.memo` when it is enabled,
+        keyed by the Raman Shift, the references, the order and the signal.
+        The fitted state (`coefficients`, `loss`, `_predicted`) is memoized with it and restored on a hit,
+        so the model is the same as after a `fit`.
+        """
+
+        def run() -> dict[str, np.ndarray]:
+            self.fit(composite_signal=composite_signal)
+            corrected = self.transform(composite_signal=composite_signal, normalize=normalize)
+            return {
+                "corrected": corrected,
+                "coef": np.array(self.model.coef_),
+                "intercept": np.asarray(self.model.intercept_),
+                "predicted": np.array(self._predicted),
+                "loss": np.asarray(self._loss),
+            }
+
+        result = memoize("EMSC.correct", run, self.raman_shift, self.X, composite_signal, normalize)
+        self.model.coef_ = result["coef"].copy()
+        self.model.intercept_ = float(result["intercept"])
+        self.model.n_features_in_ = self.X.shape[1]
+        self._predicted = result["predicted"].copy()
+        self._loss = float(result["loss"])
+        self._corrected = result["corrected"].copy()
+        return result["corrected"].copy()
+
+
+############# Incremental PCA / PLS #############
+
+
+def sample_batches(
+    samples: Iterable[Sample], batch_size: int = 256, target: str | Callable | None = None
+) -> Iterator[NDArray | tuple[NDArray, NDArray]]:
+    """
+    Stack samples into mini-batches for `partial_fit`, holding one batch in memory at a time.
+
+    Parameters
+    ----------
+    samples : iterable of Sample
+        For example a `raman.dataset.SampleSet` or `raman.spectra.iter_samples(...)`.
+        All samples must share one Raman Shift (interpolate them first).
+    batch_size : int
+        Number of spectra per batch.
+    target : str, callable or None
+        The regression target: an attribute of the sample, a key of `sample.meta` (for example 'glucose')
+        or a function of the sample. Default is None, which yields only the spectra.
+
+    Yields
+    ------
+    NDArray of shape (batch_size, n_shifts), or tuple of (NDArray, NDArray of shape (batch_size, ))
+    """
+    x: NDArray | None = None
+    iterator = iter(samples)
+    while batch := list(islice(iterator, batch_size)):
+        if x is None:
+            x = batch[0].x
+        for sample in batch:
+            if same_axis(x, sample.x) == False:
+                raise ValueError(f"Expect all samples to have the same Raman Shift range. Got {sample}")
+        X = np.vstack([sample.y for sample in batch])
+        if target is None:
+            yield X
+            continue
+        if callable(target):
+            t = [target(sample) for sample in batch]
+        else:
+            t = [getattr(sample, target) if hasattr(sample, target) else sample.meta.get(target) for sample in batch]
+        yield X, np.array(t, dtype=np.float64)
+
+
+class _IncrementalModel:
+    """
+    Running mean and centered (cross-)scatter matrices, updated batch by batch and mergeable across processes.
+    Memory is O(n_shifts²) whatever the number of spectra.
+    """
+
+    kind: str = ""
+
+    def __init__(self, n_components: int, raman_shift: NDArray | None = None):
+        self.n_components: int = n_components
+        self.raman_shift: NDArray | None = None if raman_shift is None else np.asarray(raman_shift)
+        self.n_samples_seen_: int = 0
+        self._mean_x: NDArray | None = None
+        self._sxx: NDArray | None = None
+        self._mean_y: NDArray | None = None
+        self._sxy: NDArray | None = None
+        # Fitted arrays, recomputed from the scatter matrices after an update
+        self._fitted: dict[str, NDArray] = {}
+
+    def _update(self, n: int, mean_x: NDArray, sxx: NDArray, mean_y: NDArray | None, sxy: NDArray | None):
+        if self._fitted and self._sxx is None:
+            raise ValueError(f"This {type(self).__name__} only holds fitted loadings and cannot be updated.")
+        self._fitted = {}
+        if self.n_samples_seen_ == 0:
+            self.n_samples_seen_, self._mean_x, self._sxx, self._mean_y, self._sxy = n, mean_x, sxx, mean_y, sxy
+            return
+        if mean_x.shape != self._mean_x.shape:  # type: ignore
+            raise ValueError(f"Expect spectra with {self._mean_x.shape[0]} shifts. Got {mean_x.shape[0]}")  # type: ignore
+        # Chan et al. pairwise update of the mean and the centered scatter
+        total = self.n_samples_seen_ + n
+        factor = self.n_samples_seen_ * n / total
+        dx = mean_x - self._mean_x
+        self._sxx = self._sxx + sxx + factor * np.outer(dx, dx)
+        self._mean_x = self._mean_x + dx * (n / total)
+        if mean_y is not None:
+            dy = mean_y - self._mean_y
+            self._sxy = self._sxy + sxy + factor * np.outer(dx, dy)
+            self._mean_y = self._mean_y + dy * (n / total)
+        self.n_samples_seen_ = total
+
+    def _partial_fit(self, X: NDArray, y: NDArray | None = None) -> Self:
+        X = np.atleast_2d(np.asarray(X, dtype=np.float64))
+        mean_x = X.mean(axis=0)
+        Xc = X - mean_x
+        mean_y = sxy = None
+        if y is not None:
+            Y = np.asarray(y, dtype=np.float64).reshape(X.shape[0], -1)
+            mean_y = Y.mean(axis=0)
+            sxy = Xc.T @ (Y - mean_y)
+        self._update(X.shape[0], mean_x, Xc.T @ Xc, mean_y, sxy)
+        return self
+
+    def merge(self, other: Self) -> Self:
+        """
+        Add the spectra seen by `other` (for example trained in another process) to this model.
+        """
+        if type(other) != type(self):
+            raise TypeError(f"Cannot merge {type(other).__name__} into {type(self).__name__}")
+        if other.n_samples_seen_ > 0:
+            self._update(other.n_samples_seen_, other._mean_x, other._sxx, other._mean_y, other._sxy)  # type: ignore
+        return self
+
+    def fit(self, batches: Iterable) -> Self:
+        """
+        Call `partial_fit` on every batch, for example from `sample_batches`.
+        """
+        for batch in batches:
+            if isinstance(batch, tuple):
+                self.partial_fit(*batch)  # type: ignore
+            else:
+                self.partial_fit(batch)  # type: ignore
+        return self
+
+    def _require_fitted(self) -> dict[str, NDArray]:
+        if not self._fitted:
+            if self.n_samples_seen_ == 0:
+                raise RuntimeError(f"The model has not been fitted yet.")
+            self._fitted = self._solve()
+        return self._fitted
+
+    def _solve(self) -> dict[str, NDArray]:
+        raise NotImplementedError
+
+    ############# Persistence #############
+
+    def save(self, path: str | Path):
+        """
+        Save the full state (scatter matrices included) to a .npz file, so training can continue after `load`.
+        """
+        state = {"n_components": self.n_components, "n_samples_seen": self.n_samples_seen_}
+        for key in ["raman_shift", "_mean_x", "_sxx", "_mean_y", "_sxy"]:
+            if getattr(self, key) is not None:
+                state[key] = getattr(self, key)
+        np.savez(path, **state)
+
+    @classmethod
+    def load(cls, path: str | Path) -> Self:
+        """
+        Load a model written by `save`.
+        """
+        with np.load(path) as file:
+            model = cls(n_components=int(file["n_components"]))
+            model.n_samples_seen_ = int(file["n_samples_seen"])
+            for key in ["raman_shift", "_mean_x", "_sxx", "_mean_y", "_sxy"]:
+                if key in file:
+                    setattr(model, key, file[key])
+        return model
+
+    def save_to_database(self, name: str) -> Any:
+        """
+        Store the fitted loadings in the `model` collection, next to the EMSC references.
+        The scatter matrices are not stored: use `save` to continue training later.
+
+        Returns
+        -------
+        The `_id` of the document.
+        """
+        from raman.database import collection_model
+
+        item: dict[str, Any] = {
+            "name": name,
+            "kind": self.kind,
+            "timestamp": datetime.now(),
+            "n_components": self.n_components,
+            "n_samples_seen": self.n_samples_seen_,
+            "raman_shift": None if self.raman_shift is None else self.raman_shift.tolist(),
+        }
+        for key, value in self._require_fitted().items():
+            item[key] = value.tolist()
+        return collection_model.insert_one(item).inserted_id
+
+    @classmethod
+    def from_database(cls, name: str) -> Self:
+        """
+        Load the latest loadings stored with `save_to_database` under `name`.
+        The model can `transform` / `predict` but not be updated.
+        """
+        from raman.database import collection_model
+
+        item = collection_model.find_one({"name": name, "kind": cls.kind}, sort=[("timestamp", -1)])
+        if item is None:
+            raise ValueError(f"{cls.__name__} with name {name} not found")
+        model = cls(n_components=item["n_components"], raman_shift=item["raman_shift"])
+        model.n_samples_seen_ = item["n_samples_seen"]
+        model._fitted = {key: np.array(item[key]) for key in cls._fitted_keys}  # type: ignore
+        return model
+
+
+class IncrementalPCA(_IncrementalModel):
+    """
+    PCA fitted from mini-batches of spectra in constant memory.
+
+    The exact covariance is accumulated, so the result does not depend on the batch size,
+    and models trained on different parts of an archive can be combined with `merge`.
+
+    Parameters
+    ----------
+    n_components : int
+        Number of principal components.
+    raman_shift : NDArray or None
+        The shared Raman Shift of the spectra, kept with the loadings.
+
+    Examples
+    --------
+    >>> pca = IncrementalPCA(n_components=5).fit(sample_batches(SampleSet(folder), batch_size=512))
+    >>> scores = pca.transform(Y)
+    """
+
+    kind = "pca"
+    _fitted_keys = ["mean", "components", "explained_variance", "explained_variance_ratio"]
+
+    def partial_fit(self, X: NDArray) -> Self:
+        """
+        Update the model with a batch of spectra of shape (n_spectra, n_shifts).
+        """
+        return self._partial_fit(X)
+
+    def _solve(self) -> dict[str, NDArray]:
+        covariance = self._sxx / max(self.n_samples_seen_ - 1, 1)  # type: ignore
+        values, vectors = np.linalg.eigh(covariance)
+        order = np.argsort(values)[::-1][: self.n_components]
+        components = vectors[:, order].T
+        # Deterministic sign: the largest loading of every component is positive
+        signs = np.sign(components[np.arange(components.shape[0]), np.abs(components).argmax(axis=1)])
+        return {
+            "mean": self._mean_x,  # type: ignore
+            "components": components * signs[:, None],
+            "explained_variance": values[order],
+            "explained_variance_ratio": values[order] / max(values.sum(), np.finfo(np.float64).tiny),
+        }
+
+    @property
+    def components_(self) -> NDArray:
+        """
+        The loadings, of shape (n_components, n_shifts).
+        """
+        return self._require_fitted()["components"]
+
+    @property
+    def explained_variance_(self) -> NDArray:
+        return self._require_fitted()["explained_variance"]
+
+    @property
+    def explained_variance_ratio_(self) -> NDArray:
+        return self._require_fitted()["explained_variance_ratio"]
+
+    @property
+    def mean_(self) -> NDArray:
+        return self._require_fitted()["mean"]
+
+    def transform(self, X: NDArray) -> NDArray:
+        """
+        Project spectra of shape (n_spectra, n_shifts) on the components.
+        """
+        fitted = self._require_fitted()
+        return (np.atleast_2d(X) - fitted["mean"]) @ fitted["components"].T
+
+    def inverse_transform(self, T: NDArray) -> NDArray:
+        """
+        Rebuild spectra from their scores.
+        """
+        fitted = self._require_fitted()
+        return np.atleast_2d(T) @ fitted["components"] + fitted["mean"]
+
+
+class IncrementalPLS(_IncrementalModel):
+    """
+    PLS regression (of glucose, for example) fitted from mini-batches of spectra in constant memory.
+
+    Only the cross-product matrices X'X and X'Y are accumulated. The components are then extracted
+    with the kernel algorithm (Dayal & MacGregor, 1997), which gives the same model as NIPALS
+    (centered, not scaled) on the stacked data. Models trained on different parts
+    of an archive can be combined with `merge`.
+
+    Parameters
+    ----------
+    n_components : int
+        Number of latent variables.
+    raman_shift : NDArray or None
+        The shared Raman Shift of the spectra, kept with the loadings.
+
+    Examples
+    --------
+    >>> pls = IncrementalPLS(n_components=5)
+    >>> for X, glucose in sample_batches(iter_samples("blood"), target="glucose"):
+    ...     pls.partial_fit(X, glucose)
+    >>> pls.predict(Y)
+    """
+
+    kind = "pls"
+    _fitted_keys = ["x_mean", "y_mean", "x_weights", "x_loadings", "y_loadings", "x_rotations", "coef", "intercept"]
+
+    def partial_fit(self, X: NDArray, y: NDArray) -> Self:
+        """
+        Update the model with spectra of shape (n_spectra, n_shifts) and targets of shape (n_spectra, ) or (n_spectra, n_targets).
+        """
+        if np.asarray(y).shape[0] != np.atleast_2d(X).shape[0]:
+            raise ValueError(f"Expect one target per spectrum. Got {np.atleast_2d(X).shape[0]} spectra and {np.asarray(y).shape[0]} targets")
+        if self.n_samples_seen_ > 0 and self._sxy is None:
+            raise ValueError(f"This model was updated without targets.")
+        return self._partial_fit(X, y)
+
+    def _solve(self) -> dict[str, NDArray]:
+        if self._sxy is None:
+            raise RuntimeError(f"The model has been fitted without targets.")
+        S = self._sxx
+        C = self._sxy.copy()
+        n_shifts, n_targets = C.shape
+        W = np.zeros((n_shifts, self.n_components))
+        P = np.zeros((n_shifts, self.n_components))
+        R = np.zeros((n_shifts, self.n_components))
+        Q = np.zeros((n_targets, self.n_components))
+        for a in range(self.n_components):
+            if n_targets == 1:
+                w = C[:, 0].copy()
+            else:
+                _, vectors = np.linalg.eigh(C.T @ C)
+                w = C @ vectors[:, -1]
+            norm = np.linalg.norm(w)
+            if norm == 0:
+                break
+            w /= norm
+            r = w - R[:, :a] @ (P[:, :a].T @ w)
+            Sr = S @ r  # type: ignore
+            tt = r @ Sr
+            if tt <= 0:
+                break
+            p = Sr / tt
+            q = (r @ C) / tt
+            C -= tt * np.outer(p, q)
+            W[:, a], P[:, a], R[:, a], Q[:, a] = w, p, r, q
+        coef = R @ Q.T
+        return {
+            "x_mean": self._mean_x,  # type: ignore
+            "y_mean": self._mean_y,  # type: ignore
+            "x_weights": W,
+            "x_loadings": P,
+            "y_loadings": Q,
+            "x_rotations": R,
+            "coef": coef,
+            "intercept": self._mean_y - self._mean_x @ coef,  # type: ignore
+        }
+
+    @property
+    def coef_(self) -> NDArray:
+        """
+        The regression coefficients, of shape (n_shifts, n_targets).
+        """
+        return self._require_fitted()["coef"]
+
+    @property
+    def intercept_(self) -> NDArray:
+        return self._require_fitted()["intercept"]
+
+    @property
+    def x_loadings_(self) -> NDArray:
+        return self._require_fitted()["x_loadings"]
+
+    @property
+    def x_weights_(self) -> NDArray:
+        return self._require_fitted()["x_weights"]
+
+    def transform(self, X: NDArray) -> NDArray:
+        """
+        The scores of spectra of shape (n_spectra, n_shifts).
+        """
+        fitted = self._require_fitted()
+        return (np.atleast_2d(X) - fitted["x_mean"]) @ fitted["x_rotations"]
+
+    def predict(self, X: NDArray) -> NDArray:
+        """
+        Predict the targets of spectra of shape (n_spectra, n_shifts). A single target is returned as shape (n_spectra, ).
+        """
+        fitted = self._require_fitted()
+        prediction = np.atleast_2d(X) @ fitted["coef"] + fitted["intercept"]
+        return prediction[:, 0] if prediction.shape[1] == 1 else prediction
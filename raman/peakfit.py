@@ -0,0 +1,373 @@
+"""
+Batched peak fitting.
+
+`PeakFitter` fits a fixed set of peaks (Lorentzian, Gaussian or Voigt) plus a polynomial background to every
+spectrum of a stack at once, on a shared region of interest. Every Levenberg–Marquardt iteration evaluates the
+models and their analytic Jacobians for all spectra together, solves all the damped normal equations with one
+batched `np.linalg.solve`, and drops the spectra that converged from later iterations (like `raman.baseline`).
+
+    >>> fitter = PeakFitter(GLUCOSE_PEAKS, roi=[[850, 1200]])
+    >>> result = fitter.fit(x, Y)
+    >>> result["height"][:, 0]  # The height of the 911 cm⁻¹ band of every spectrum
+    >>> results = fitter.fit_samples(samples)  # Chunks, each one warm started from the previous one
+
+The parameters of every peak are its `height`, `center` and width: `gamma` (half width at half maximum) for a
+Lorentzian, `sigma` (standard deviation) for a Gaussian, both `sigma` and `gamma` for a Voigt.
+"""
+from raman.sample import Sample
+from raman.baseline import roi_mask
+from raman.axis import axis_groups
+
+import numpy as np
+from numpy.typing import NDArray
+from scipy.special import wofz  # type: ignore
+
+from typing import Iterable
+
+PEAK_MODELS: dict[str, list[str]] = {
+    "lorentzian": ["height", "center", "gamma"],
+    "gaussian": ["height", "center", "sigma"],
+    "voigt": ["height", "center", "sigma", "gamma"],
+}
+
+# The glucose bands used for quantification
+GLUCOSE_PEAKS: list[tuple[str, float]] = [("lorentzian", 911), ("lorentzian", 1060), ("lorentzian", 1125)]
+
+_SQRT2 = np.sqrt(2)
+_SQRT2PI = np.sqrt(2 * np.pi)
+
+
+############# Models #############
+# A model takes the Raman Shift (n_shifts, ) and the parameters (n_spectra, n_parameters) of one peak,
+# and returns the profiles (n_spectra, n_shifts) and their Jacobian (n_spectra, n_shifts, n_parameters).
+
+
+def _lorentzian(x: NDArray, P: NDArray) -> tuple[NDArray, NDArray]:
+    height, center, gamma = P[:, [0]], P[:, [1]], P[:, [2]]
+    d = x[None, :] - center
+    denominator = d**2 + gamma**2
+    shape = gamma**2 / denominator
+    f = height * shape
+    J = np.stack([shape, 2 * f * d / denominator, 2 * f * d**2 / (gamma * denominator)], axis=-1)
+    return f, J
+
+
+def _gaussian(x: NDArray, P: NDArray) -> tuple[NDArray, NDArray]:
+    height, center, sigma = P[:, [0]], P[:, [1]], P[:, [2]]
+    d = x[None, :] - center
+    shape = np.exp(-(d**2) / (2 * sigma**2))
+    f = height * shape
+    J = np.stack([shape, f * d / sigma**2, f * d**2 / sigma**3], axis=-1)
+    return f, J
+
+
+def _voigt(x: NDArray, P: NDArray) -> tuple[NDArray, NDArray]:
+    # f = height * Re w(z) / Re w(z0), z = (x - center + i gamma) / (sigma √2), z0 = z at the center.
+    # The derivatives use w'(z) = -2 z w(z) + 2i / √π (w is the Faddeeva function).
+    height, center, sigma, gamma = P[:, [0]], P[:, [1]], P[:, [2]], P[:, [3]]
+    z = (x[None, :] - center + 1j * gamma) / (sigma * _SQRT2)
+    z0 = 1j * gamma / (sigma * _SQRT2)
+    w, w0 = wofz(z), wofz(z0)
+    dw = -2 * z * w + 2j / np.sqrt(np.pi)
+    dw0 = -2 * z0 * w0 + 2j / np.sqrt(np.pi)
+    N, D = w.real, w0.real
+    shape = N / D
+    f = height * shape
+    d_center = height * (dw * (-1 / (sigma * _SQRT2))).real / D
+    d_sigma = height * ((dw * (-z / sigma)).real * D - N * (dw0 * (-z0 / sigma)).real) / D**2
+    d_gamma = height * ((dw * (1j / (sigma * _SQRT2))).real * D - N * (dw0 * (1j / (sigma * _SQRT2))).real) / D**2
+    return f, np.stack([shape, d_center, d_sigma, d_gamma], axis=-1)
+
+
+_MODELS = {"lorentzian": _lorentzian, "gaussian": _gaussian, "voigt": _voigt}
+
+
+def _fwhm(model: str, P: NDArray) -> NDArray:
+    if model == "lorentzian":
+        return 2 * P[:, 2]
+    if model == "gaussian":
+        return 2 * np.sqrt(2 * np.log(2)) * P[:, 2]
+    # Olivero and Longbothum (1977), accurate to 0.02 %
+    f_gaussian, f_lorentzian = 2 * np.sqrt(2 * np.log(2)) * P[:, 2], 2 * P[:, 3]
+    return 0.5346 * f_lorentzian + np.sqrt(0.2166 * f_lorentzian**2 + f_gaussian**2)
+
+
+def _area(model: str, P: NDArray) -> NDArray:
+    if model == "lorentzian":
+        return np.pi * P[:, 0] * P[:, 2]
+    if model == "gaussian":
+        return _SQRT2PI * P[:, 0] * P[:, 2]
+    return _SQRT2PI * P[:, 0] * P[:, 2] / wofz(1j * P[:, 3] / (P[:, 2] * _SQRT2)).real
+
+
+############# Fitter #############
+
+
+class PeakFitter:
+    """
+    Fit the same peaks to many spectra with a batched Levenberg–Marquardt.
+
+    Parameters
+    ----------
+    peaks : list of tuple of (str, float)
+        The model ('lorentzian', 'gaussian' or 'voigt') and the expected center of every peak.
+    roi : NDArray of shape (n_regions, 2) or None
+        The [low, high] Raman Shift regions fitted, shared by all spectra (see `raman.baseline.roi_mask`).
+        Default is None, which fits the whole range.
+    background : int or None
+        The order of the polynomial background fitted with the peaks. None fits no background.
+    width : float
+        The initial half width (cm⁻¹) of every peak: `gamma` and/or `sigma`.
+    center_tolerance : float
+        How far (cm⁻¹) a center may move from its expected value. Centers are clipped to that range.
+    max_iter : int
+        Maximum number of iterations.
+    tol : float
+        The convergence threshold on the relative decrease of the residual sum of squares.
+    warm_start : bool
+        Default is True. Every `fit` without `init` starts the widths from the median solution of the previous `fit`.
+        The heights, centers and background always start from the data (`initial`).
+    chunk_size : int
+        Number of spectra solved together, which bounds the memory of the Jacobian.
+    """
+
+    def __init__(
+        self,
+        peaks: list[tuple[str, float]],
+        roi: NDArray | list | None = None,
+        background: int | None = 1,
+        width: float = 5.0,
+        center_tolerance: float = 10.0,
+        max_iter: int = 100,
+        tol: float = 1e-8,
+        warm_start: bool = True,
+        chunk_size: int = 1024,
+    ):
+        for model, _ in peaks:
+            if model not in PEAK_MODELS:
+                raise ValueError(f"model={model} is not supported. Use one of {list(PEAK_MODELS)}.")
+        self.peaks: list[tuple[str, float]] = list(peaks)
+        self.roi: NDArray | None = None if roi is None else np.asarray(roi, dtype=np.float64).reshape(-1, 2)
+        self.background: int | None = background
+        self.width: float = width
+        self.center_tolerance: float = center_tolerance
+        self.max_iter: int = max_iter
+        self.tol: float = tol
+        self.warm_start: bool = warm_start
+        self.chunk_size: int = chunk_size
+        self.last_params: NDArray | None = None
+        self._origin, self._scale = 0.0, 1.0
+
+        # The columns of every peak in the parameter vector, the background coefficients come last
+        self._slices: list[slice] = []
+        start = 0
+        for model, _ in self.peaks:
+            self._slices.append(slice(start, start + len(PEAK_MODELS[model])))
+            start += len(PEAK_MODELS[model])
+        self.n_background: int = 0 if background is None else background + 1
+        self.n_params: int = start + self.n_background
+
+    @property
+    def names(self) -> list[str]:
+        """
+        The name of every parameter, for example 'p0_height' or 'background1'.
+        """
+        names = [f"p{i}_{name}" for i, (model, _) in enumerate(self.peaks) for name in PEAK_MODELS[model]]
+        return names + [f"background{i}" for i in range(self.n_background)]
+
+    def _lower_upper(self, dx: float) -> tuple[NDArray, NDArray]:
+        lower = np.full(self.n_params, -np.inf)
+        upper = np.full(self.n_params, np.inf)
+        for (model, center), columns in zip(self.peaks, self._slices):
+            # Raman bands are never negative
+            lower[columns.start] = 0
+            lower[columns.start + 1] = center - self.center_tolerance
+            upper[columns.start + 1] = center + self.center_tolerance
+            # Widths stay positive and above a tenth of the spacing
+            lower[columns.start + 2 : columns.stop] = dx / 10
+        return lower, upper
+
+    def _width_columns(self) -> NDArray:
+        # The width columns of every peak
+        return np.concatenate([np.arange(columns.start + 2, columns.stop) for columns in self._slices])
+
+    def initial(self, x: NDArray, Y: NDArray) -> NDArray:
+        """
+        A starting point from the data: every height is the intensity at the expected center above the
+        background line between the ends of the ROI.
+        """
+        line = Y[:, [0]] + (Y[:, [-1]] - Y[:, [0]]) * ((x - x[0]) / (x[-1] - x[0]))[None, :]
+        P = np.zeros((Y.shape[0], self.n_params))
+        for (model, center), columns in zip(self.peaks, self._slices):
+            # The highest point above the line within the tolerance of the expected center
+            window = np.flatnonzero(np.abs(x - center) <= self.center_tolerance)
+            if window.size == 0:
+                window = np.array([np.abs(x - center).argmin()])
+            index = window[(Y[:, window] - line[:, window]).argmax(axis=1)]
+            rows = np.arange(Y.shape[0])
+            P[:, columns.start] = np.maximum(Y[rows, index] - line[rows, index], 0)
+            P[:, columns.start + 1] = x[index]
+            P[:, columns.start + 2 : columns.stop] = self.width
+        if self.n_background > 0:
+            slope = (Y[:, -1] - Y[:, 0]) / (x[-1] - x[0])
+            P[:, -self.n_background] = Y[:, 0] + slope * (self._origin - x[0])
+            if self.n_background > 1:
+                P[:, -self.n_background + 1] = slope * self._scale
+        return P
+
+    def evaluate(self, x: NDArray, P: NDArray, jacobian: bool = True) -> tuple[NDArray, NDArray | None]:
+        """
+        The fitted curves (n_spectra, n_shifts) and their Jacobian (n_spectra, n_shifts, n_params).
+        """
+        F = np.zeros((P.shape[0], x.shape[0]))
+        J = np.empty((P.shape[0], x.shape[0], self.n_params)) if jacobian else None
+        for (model, _), columns in zip(self.peaks, self._slices):
+            f, j = _MODELS[model](x, P[:, columns])
+            F += f
+            if J is not None:
+                J[:, :, columns] = j
+        if self.n_background > 0:
+            # The background is a polynomial of the scaled Raman Shift, so its normal equations stay well conditioned
+            powers = ((x - self._origin) / self._scale)[:, None] ** np.arange(self.n_background)[None, :]
+            F += P[:, -self.n_background :] @ powers.T
+            if J is not None:
+                J[:, :, -self.n_background :] = powers[None, :, :]
+        return F, J
+
+    def _solve(self, x: NDArray, Y: NDArray, P: NDArray, lower: NDArray, upper: NDArray) -> dict[str, NDArray]:
+        m = Y.shape[0]
+        F, J = self.evaluate(x, P)
+        R = Y - F
+        cost = (R**2).sum(axis=1)
+        damping = np.full(m, 1e-3)
+        iterations = np.zeros(m, dtype=np.int64)
+        converged = np.zeros(m, dtype=bool)
+        Js = np.empty((m, x.shape[0], self.n_params))
+        Js[:] = J  # type: ignore
+        Rs = R
+        active = np.arange(m)
+        for _ in range(self.max_iter):
+            Ja, Ra = Js[active], Rs[active]
+            A = Ja.transpose(0, 2, 1) @ Ja
+            g = (Ja.transpose(0, 2, 1) @ Ra[:, :, None])[:, :, 0]
+            diagonal = np.einsum("npp->np", A)
+            damped = A + (damping[active, None] * np.maximum(diagonal, 1e-12))[:, :, None] * np.eye(self.n_params)[None]
+            try:
+                step = np.linalg.solve(damped, g[:, :, None])[:, :, 0]
+            except np.linalg.LinAlgError:
+                # A singular system (a flat spectrum, a vanished peak): solve every spectrum on its own
+                step = np.stack([np.linalg.lstsq(a, b, rcond=None)[0] for a, b in zip(damped, g)])
+            candidate = np.clip(P[active] + step, lower, upper)
+            with np.errstate(invalid="ignore", over="ignore", divide="ignore"):
+                # Diverging candidates give a non finite cost and are rejected
+                F_new, J_new = self.evaluate(x, candidate)
+            R_new = Y[active] - F_new
+            cost_new = (R_new**2).sum(axis=1)
+            better = np.isfinite(cost_new) & (cost_new < cost[active])
+            iterations[active] += 1
+
+            accepted = active[better]
+            decrease = (cost[accepted] - cost_new[better]) / np.maximum(cost[accepted], 1e-300)
+            moved = np.abs(candidate[better] - P[accepted]).max(axis=1) / (np.abs(P[accepted]).max(axis=1) + 1e-12)
+            P[accepted] = candidate[better]
+            cost[accepted] = cost_new[better]
+            Rs[accepted] = R_new[better]
+            Js[accepted] = J_new[better]  # type: ignore
+            damping[accepted] = np.maximum(damping[accepted] / 10, 1e-12)
+            damping[active[~better]] *= 10
+
+            done = np.zeros(len(active), dtype=bool)
+            done[better] = (decrease < self.tol) | (moved < np.sqrt(self.tol))
+            # A damping this large means no step decreases the cost anymore: the fit sits at a minimum
+            done |= damping[active] > 1e10
+            converged[active[done]] = True
+            active = active[~done]
+            if active.size == 0:
+                break
+
+        total = ((Y - Y.mean(axis=1, keepdims=True)) ** 2).sum(axis=1)
+        return {
+            "params": P,
+            "rss": cost,
+            "rmse": np.sqrt(cost / x.shape[0]),
+            "r2": 1 - cost / np.maximum(total, 1e-300),
+            "iterations": iterations,
+            "converged": converged,
+        }
+
+    def fit(self, x: NDArray, Y: NDArray, init: NDArray | None = None) -> dict[str, NDArray]:
+        """
+        Fit every spectrum of a stack sharing the Raman Shift `x`.
+
+        Parameters
+        ----------
+        x : NDArray of shape (n_shifts, )
+            The Raman Shift.
+        Y : NDArray of shape (n_spectra, n_shifts) or (n_shifts, )
+            The intensity.
+        init : NDArray of shape (n_params, ) or (n_spectra, n_params) or None
+            The starting parameters (see `names`). Default is None, which starts from `initial`, with the
+            widths of the previous `fit` (with `warm_start`).
+
+        Returns
+        -------
+        dict of NDArray :
+            'params' (n_spectra, n_params) in the order of `names`;
+            'height', 'center', 'fwhm' and 'area' of shape (n_spectra, n_peaks);
+            'background' (n_spectra, background + 1), the coefficients of the scaled Raman Shift;
+            the quality of every fit: 'rss', 'rmse', 'r2', 'iterations' and 'converged' of shape (n_spectra, ).
+        """
+        Y = np.atleast_2d(np.asarray(Y, dtype=np.float64))
+        x = np.asarray(x, dtype=np.float64)
+        mask = roi_mask(x, self.roi)
+        if mask.sum() <= self.n_params:
+            raise ValueError(f"The ROI has {mask.sum()} points, which is not more than the {self.n_params} parameters.")
+        x, Y = x[mask], Y[:, mask]
+        self._origin, self._scale = (x[0] + x[-1]) / 2, max((x[-1] - x[0]) / 2, 1e-12)
+        lower, upper = self._lower_upper(float(np.diff(x).min()) if x.shape[0] > 1 else 1.0)
+
+        if init is not None:
+            P = np.array(np.broadcast_to(init, (Y.shape[0], self.n_params)), dtype=np.float64)
+        else:
+            P = self.initial(x, Y)
+            if self.warm_start and self.last_params is not None:
+                # Only the widths carry over: the heights, centers and background of every spectrum are closer
+                widths = self._width_columns()
+                P[:, widths] = self.last_params[widths]
+        P = np.clip(P, lower, upper)
+
+        parts = [self._solve(x, Y[i : i + self.chunk_size], P[i : i + self.chunk_size], lower, upper) for i in range(0, Y.shape[0], self.chunk_size)]
+        result = {key: np.concatenate([part[key] for part in parts]) for key in parts[0]}
+        P = result["params"]
+        if self.warm_start and result["converged"].any():
+            self.last_params = np.median(P[result["converged"]], axis=0)
+
+        result["height"] = np.stack([P[:, columns.start] for columns in self._slices], axis=1)
+        result["center"] = np.stack([P[:, columns.start + 1] for columns in self._slices], axis=1)
+        result["fwhm"] = np.stack([_fwhm(model, P[:, columns]) for (model, _), columns in zip(self.peaks, self._slices)], axis=1)
+        result["area"] = np.stack([_area(model, P[:, columns]) for (model, _), columns in zip(self.peaks, self._slices)], axis=1)
+        result["background"] = P[:, self.n_params - self.n_background :]
+        return result
+
+    def fit_samples(self, samples: Iterable[Sample], chunk_size: int | None = None) -> dict[str, NDArray]:
+        """
+        Fit samples, chunk by chunk and grouped by Raman Shift, each chunk warm started from the previous one.
+        The rows of the result follow the order of `samples`.
+        """
+        samples = list(samples)
+        chunk_size = self.chunk_size if chunk_size is None else chunk_size
+        rows: list[NDArray] = []
+        parts: list[dict[str, NDArray]] = []
+        position = {id(sample): i for i, sample in enumerate(samples)}
+        for start in range(0, len(samples), chunk_size):
+            for group in axis_groups(samples[start : start + chunk_size]).values():
+                parts.append(self.fit(group[0].x, np.vstack([sample.y for sample in group])))
+                rows.append(np.array([position[id(sample)] for sample in group]))
+        if len(parts) == 0:
+            raise ValueError(f"samples must not be empty.")
+        order = np.argsort(np.concatenate(rows))
+        return {key: np.concatenate([part[key] for part in parts])[order] for key in parts[0]}
+
+    def __repr__(self) -> str:
+        peaks = ", ".join(f"{model}@{center:g}" for model, center in self.peaks)
+        return f"PeakFitter([{peaks}], roi={None if self.roi is None else self.roi.tolist()}, background={self.background})"
@@ -0,0 +1,278 @@
+"""
+Peak detection and a peak table over a corpus of spectra.
+
+`detect_peaks` runs `scipy.signal.find_peaks` once per spectrum and returns the position, height, width and
+prominence of every peak. `PeakTable` keeps those peaks for many spectra in flat columns sorted by position,
+so questions such as "which spectra have a peak within 1125 ± 5 cm⁻¹ with a prominence above p" are answered
+with two binary searches and a mask, without reading the spectra again.
+"""
+from raman.sample import Sample
+
+import numpy as np
+from numpy.typing import NDArray
+import pandas as pd
+from scipy.signal import find_peaks  # type: ignore
+
+from itertools import repeat
+from pathlib import Path
+from typing import Any, Iterable, Self
+
+PEAK_COLUMNS: list[str] = ["position", "height", "width", "prominence", "left", "right"]
+
+
+def detect_peaks(x: NDArray, y: NDArray, prominence: float | None = 0, rel_height: float = 0.5, **kwargs) -> dict[str, NDArray]:
+    """
+    Find the peaks of a spectrum with their properties, in Raman Shift units.
+
+    `find_peaks` computes the prominences and the widths itself (with `width=0`), so nothing is computed twice
+    as with a separate `peak_widths` call.
+
+    Parameters
+    ----------
+    x : NDArray of shape (n_shifts, )
+        The Raman Shift, in increasing order.
+    y : NDArray of shape (n_shifts, )
+        The intensity.
+    prominence : float or None
+        The minimal prominence of a peak.
+    rel_height : float
+        The relative height at which the width is measured (0.5 is the full width at half maximum).
+    kwargs :
+        Passed to `scipy.signal.find_peaks` (for example `height` or `distance`).
+
+    Returns
+    -------
+    dict of NDArray :
+        'index' (int), 'position', 'height', 'width', 'prominence', 'left' and 'right' (the Raman Shift where the
+        width is measured), 'width_samples', 'left_ips' and 'right_ips' (the same in samples).
+    """
+    index, properties = find_peaks(y, prominence=prominence, width=0, rel_height=rel_height, **kwargs)
+    samples = np.arange(x.shape[0])
+    left = np.interp(properties["left_ips"], samples, x)
+    right = np.interp(properties["right_ips"], samples, x)
+    return {
+        "index": index,
+        "position": x[index],
+        "height": y[index],
+        "width": right - left,
+        "prominence": properties["prominences"],
+        "left": left,
+        "right": right,
+        "width_samples": properties["widths"],
+        "left_ips": properties["left_ips"],
+        "right_ips": properties["right_ips"],
+    }
+
+
+def _spectrum_id(sample: Sample) -> str:
+    if len(sample.paths) > 0:
+        return min(sample.paths).as_posix()
+    if getattr(sample, "name", None) is None:
+        raise ValueError(f"Cannot tell the ID of a sample without path or name. Pass `ids`.")
+    return sample.name
+
+
+class PeakTable:
+    """
+    A columnar index of the peaks of many spectra, keyed by spectrum ID.
+
+    Every peak is one row of the columns `position`, `height`, `width`, `prominence`, `left`, `right` and `spectrum`
+    (the row of the spectrum in `ids`). Rows are kept sorted by position. Adding spectra only detects the peaks of
+    the new spectra and merges them into the sorted columns; spectra already in the table are skipped.
+
+    Parameters
+    ----------
+    prominence : float
+        The minimal prominence of a stored peak. Queries can only ask for larger prominences.
+    dtype : type or np.dtype
+        The dtype of the stored columns. Default is `np.float32`.
+    kwargs :
+        Passed to `detect_peaks`.
+
+    Examples
+    --------
+    >>> table = PeakTable(prominence=50)
+    >>> table.add(SampleSet(folder))
+    >>> table.spectra_with_peak(1125, tolerance=5, prominence=200)
+    """
+
+    def __init__(self, prominence: float = 0, dtype: type | np.dtype = np.float32, **kwargs):
+        self.prominence: float = prominence
+        self.dtype: np.dtype = np.dtype(dtype)
+        self.kwargs: dict[str, Any] = kwargs
+        self.ids: list[Any] = []
+        self._rows: dict[Any, int] = {}
+        self._columns: dict[str, NDArray] = {column: np.empty(0, dtype=self.dtype) for column in PEAK_COLUMNS}
+        self._columns["spectrum"] = np.empty(0, dtype=np.int64)
+
+    def __len__(self) -> int:
+        """
+        Number of peaks.
+        """
+        return self._columns["position"].shape[0]
+
+    def __contains__(self, spectrum_id: Any) -> bool:
+        return spectrum_id in self._rows
+
+    @property
+    def n_spectra(self) -> int:
+        return len(self._rows)
+
+    def _merge(self, columns: dict[str, NDArray]):
+        order = np.argsort(columns["position"], kind="stable")
+        columns = {key: value[order] for key, value in columns.items()}
+        # Both runs are sorted: find where every new peak goes and insert in one pass.
+        at = np.searchsorted(self._columns["position"], columns["position"], side="right")
+        self._columns = {key: np.insert(self._columns[key], at, columns[key]) for key in self._columns}
+
+    def add(self, samples: Iterable[Sample], ids: Iterable[Any] | None = None) -> int:
+        """
+        Detect and store the peaks of new spectra. Spectra whose ID is already in the table are skipped.
+
+        Parameters
+        ----------
+        samples : iterable of Sample
+            For example a list or a `raman.dataset.SampleSet`.
+        ids : iterable or None
+            One ID per sample. Default is None, which uses the path of the sample (or its name).
+
+        Returns
+        -------
+        int :
+            Number of spectra added.
+        """
+        found: dict[str, list[NDArray]] = {key: [] for key in self._columns}
+        added = 0
+        for sample, spectrum_id in zip(samples, repeat(None) if ids is None else ids):
+            if spectrum_id is None:
+                spectrum_id = _spectrum_id(sample)
+            if spectrum_id in self._rows:
+                continue
+            row = len(self.ids)
+            self.ids.append(spectrum_id)
+            self._rows[spectrum_id] = row
+            peaks = detect_peaks(sample.x, sample.y, prominence=self.prominence, **self.kwargs)
+            for column in PEAK_COLUMNS:
+                found[column].append(peaks[column].astype(self.dtype, copy=False))
+            found["spectrum"].append(np.full(peaks["index"].shape[0], row, dtype=np.int64))
+            added += 1
+        if added > 0:
+            self._merge({key: np.concatenate(values) for key, values in found.items()})
+        return added
+
+    def remove(self, spectrum_ids: Iterable[Any]):
+        """
+        Drop the peaks of spectra. Their IDs stay reserved in `ids` (as None) so row numbers do not change.
+        """
+        rows = [self._rows.pop(spectrum_id) for spectrum_id in spectrum_ids if spectrum_id in self._rows]
+        if len(rows) == 0:
+            return
+        for row in rows:
+            self.ids[row] = None
+        keep = np.isin(self._columns["spectrum"], rows, invert=True)
+        self._columns = {key: value[keep] for key, value in self._columns.items()}
+
+    def _select(
+        self,
+        low: float,
+        high: float,
+        prominence: float | None = None,
+        height: float | None = None,
+        width: tuple[float, float] | None = None,
+    ) -> NDArray:
+        position = self._columns["position"]
+        start = np.searchsorted(position, low, side="left")
+        stop = np.searchsorted(position, high, side="right")
+        rows = np.arange(start, stop)
+        mask = np.ones(rows.shape[0], dtype=bool)
+        if prominence is not None:
+            mask &= self._columns["prominence"][start:stop] >= prominence
+        if height is not None:
+            mask &= self._columns["height"][start:stop] >= height
+        if width is not None:
+            widths = self._columns["width"][start:stop]
+            mask &= (widths >= width[0]) & (widths <= width[1])
+        return rows[mask]
+
+    def query(
+        self,
+        low: float,
+        high: float,
+        prominence: float | None = None,
+        height: float | None = None,
+        width: tuple[float, float] | None = None,
+    ) -> pd.DataFrame:
+        """
+        The peaks with a position in [low, high] and the given minimal prominence and height.
+
+        Parameters
+        ----------
+        low, high : float
+            The Raman Shift range of the peak position.
+        prominence : float or None
+            The minimal prominence.
+        height : float or None
+            The minimal height.
+        width : tuple of (float, float) or None
+            The range of the width, in Raman Shift.
+
+        Returns
+        -------
+        pandas.DataFrame :
+            One row per peak with the column 'id' (the spectrum ID) and the peak columns, sorted by position.
+        """
+        rows = self._select(low, high, prominence=prominence, height=height, width=width)
+        frame = pd.DataFrame({column: self._columns[column][rows] for column in PEAK_COLUMNS})
+        frame.insert(0, "id", [self.ids[row] for row in self._columns["spectrum"][rows]])
+        return frame
+
+    def spectra_with_peak(
+        self, center: float, tolerance: float = 5, prominence: float | None = None, height: float | None = None
+    ) -> list[Any]:
+        """
+        The IDs of the spectra with at least one peak within `center` ± `tolerance`, in the order they were added.
+        """
+        rows = self._select(center - tolerance, center + tolerance, prominence=prominence, height=height)
+        return [self.ids[row] for row in np.unique(self._columns["spectrum"][rows])]
+
+    def peaks_of(self, spectrum_id: Any) -> pd.DataFrame:
+        """
+        The peaks of one spectrum, sorted by position.
+        """
+        mask = self._columns["spectrum"] == self._rows[spectrum_id]
+        return pd.DataFrame({column: self._columns[column][mask] for column in PEAK_COLUMNS})
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        The whole table, one row per peak.
+        """
+        frame = pd.DataFrame({column: self._columns[column] for column in PEAK_COLUMNS})
+        frame.insert(0, "id", [self.ids[row] for row in self._columns["spectrum"]])
+        return frame
+
+    def save(self, path: str | Path):
+        """
+        Save the table to a .npz file. IDs are stored as strings.
+        """
+        np.savez_compressed(
+            path,
+            ids=np.array(["" if spectrum_id is None else str(spectrum_id) for spectrum_id in self.ids]),
+            removed=np.array([spectrum_id is None for spectrum_id in self.ids], dtype=bool),
+            min_prominence=self.prominence,
+            **self._columns,
+        )
+
+    @classmethod
+    def load(cls, path: str | Path, **kwargs) -> Self:
+        """
+        Load a table written by `save`. `kwargs` are passed to `detect_peaks` for later `add`.
+        """
+        with np.load(path) as file:
+            table = cls(prominence=float(file["min_prominence"]), dtype=file["position"].dtype, **kwargs)
+            table.ids = [None if removed else spectrum_id for spectrum_id, removed in zip(file["ids"].tolist(), file["removed"])]
+            table._rows = {spectrum_id: row for row, spectrum_id in enumerate(table.ids) if spectrum_id is not None}
+            table._columns = {key: file[key] for key in PEAK_COLUMNS + ["spectrum"]}
+        return table
+
+    def __repr__(self) -> str:
+        return f"PeakTable(n_spectra={len(self._rows)}, n_peaks={len(self)}, prominence={self.prominence})"
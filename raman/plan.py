@@ -0,0 +1,474 @@
+"""
+Lazy preprocessing: record the operations of a `Sample` as a plan, optimize it, run it once.
+
+A `Sample` runs every method eagerly, and its constructor always removes spikes and interpolates the whole range,
+even when `extract_range(700, 1500)` follows and drops more than half of it. A `Plan` records the operations
+instead. `Plan.optimize` rewrites it before anything runs:
+
+- ROI pushdown: an `extract_range` that follows local stages (`despike`, `interpolate`, `smoothing`) is preceded
+  by a wider crop before them, widened by the reach of those stages (their window), so they only process the range
+  of interest. The `extract_range` itself stays in place, so the result is the same. `remove_spike` always sees
+  the whole spectrum, as its spike detection depends on all of it.
+- Fusion: consecutive linear stages (`extract_range`, `interpolate`, `smoothing`, `baseline(method='poly')`) do not
+  depend on the intensity, only on the Raman Shift. They are composed into one matrix per axis, cached in the plan,
+  and applied to a whole stack of spectra with one matrix product.
+
+`Plan.run` executes the optimized plan on samples stacked per Raman Shift; the nonlinear stages run batched where
+the engine allows it (`normalized`, `baseline` ALS, `emsc`). `LazySample` is the lazy mode of a single spectrum.
+
+    >>> plan = Plan().remove_spike().interpolate(1).extract_range(700, 1500).smoothing().baseline().normalized()
+    >>> print(plan.explain())
+    >>> samples = plan.run([read_txt(path, interpolate=False) for path in paths])
+
+    >>> lazy = LazySample.read_txt(path).extract_range(700, 1500).smoothing().normalized()
+    >>> sample = lazy.collect()
+"""
+from raman.sample import Sample, read_txt, NAME_FORMAT
+from raman.baseline import poly_baseline, als_baseline
+from raman.axis import arange_axis, axis_groups, axis_key
+from raman import kernels
+
+import numpy as np
+from numpy.typing import NDArray
+from scipy.interpolate import CubicSpline  # type: ignore
+from scipy.signal import savgol_filter  # type: ignore
+
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Hashable, Iterable, Self
+
+# Stages whose output at a Raman Shift only depends on a neighbourhood of it.
+# `remove_spike` is not one: the prominence of a spike (`find_spike`) depends on the whole spectrum.
+LOCAL_STAGES: list[str] = ["despike", "interpolate", "smoothing"]
+
+
+class Step:
+    """
+    One recorded operation: the name of the `Sample` method (or 'crop', 'emsc', 'fused') and its arguments.
+    """
+
+    def __init__(self, name: str, **kwargs: Any):
+        self.name: str = name
+        self.kwargs: dict[str, Any] = kwargs
+
+    @property
+    def linear(self) -> bool:
+        """
+        True when the stage is a linear map of the intensity that only depends on the Raman Shift.
+        """
+        if self.name == "baseline":
+            return self.kwargs.get("method", "poly") == "poly"
+        return self.name in ["crop", "extract_range", "interpolate", "smoothing"]
+
+    @property
+    def local(self) -> bool:
+        if self.name == "interpolate":
+            # A crop moved before the interpolation must not move the grid: only steps that divide 1 keep it aligned
+            return abs(1 / self.kwargs["step"] - round(1 / self.kwargs["step"])) < 1e-9
+        return self.name in LOCAL_STAGES
+
+    def reach(self, dx: float) -> float:
+        """
+        How far (in Raman Shift) the stage looks on each side of a point, for an axis with spacing `dx`.
+        """
+        if self.name == "smoothing":
+            window = self.kwargs["window_length"]
+            return (int(30 / dx) if window == "auto" else window) * dx / 2 + dx
+        if self.name == "despike":
+            window = self.kwargs["window_length"]
+            return (int(5 / dx) if window == "auto" else window) * dx + dx
+        if self.name == "interpolate":
+            # The influence of a point on a natural cubic spline decays by 2 - √3 per knot: 30 knots is below 1e-15
+            return 30 * dx + self.kwargs["step"]
+        return 0.0
+
+    def __repr__(self) -> str:
+        if self.name == "fused":
+            return f"fused[{', '.join(map(repr, self.kwargs['steps']))}]"
+        arguments = ", ".join(f"{key}={_describe(value)}" for key, value in self.kwargs.items() if key != "covers")
+        return f"{self.name}({arguments})"
+
+
+def _describe(value: Any) -> str:
+    if isinstance(value, Sample):
+        return f"<Sample {value.name}>"
+    if isinstance(value, tuple):
+        return f"({', '.join(map(_describe, value))})"
+    return repr(value)
+
+
+def _identity(value: Any) -> Hashable:
+    if isinstance(value, (Sample, np.ndarray)):
+        return id(value)
+    if isinstance(value, (tuple, list)):
+        return tuple(map(_identity, value))
+    return value
+
+
+############# Stages #############
+# A stage takes the shared Raman Shift, the stack of intensities and the spacing, and returns the three updated.
+
+
+def _crop(x: NDArray, Y: NDArray, dx: float, low: float, high: float, covers: tuple = ()):
+    margin, spacing = 0.0, dx
+    for step in covers:
+        margin += step.reach(spacing)
+        if step.name == "interpolate":
+            spacing = step.kwargs["step"]
+    mask = (x >= low - margin) & (x <= high + margin)
+    return x[mask], Y[:, mask], dx
+
+
+def _extract_range(x: NDArray, Y: NDArray, dx: float, low: float, high: float):
+    mask = (x >= low) & (x <= high)
+    return x[mask], Y[:, mask], dx
+
+
+def _interpolate(x: NDArray, Y: NDArray, dx: float, step: float):
+    new_x = arange_axis(np.floor(x.min()), np.ceil(x.max()) + step, step=step, dtype=x.dtype)
+    return new_x, CubicSpline(x, Y, axis=1, bc_type="natural")(new_x), step
+
+
+def _smoothing(x: NDArray, Y: NDArray, dx: float, window_length: str | int = "auto", polyorder: int = 2):
+    if window_length == "auto":
+        window_length = int(30 / dx)
+    return x, savgol_filter(Y, window_length=window_length, polyorder=polyorder, axis=1), dx
+
+
+def _baseline(x: NDArray, Y: NDArray, dx: float, order: int = 1, roi: NDArray | None = None, method: str = "poly", **kwargs):
+    if method == "poly":
+        return x, Y - poly_baseline(x, Y, order=order, roi=roi), dx
+    return x, Y - als_baseline(Y, method=method, **kwargs), dx
+
+
+def _normalized(x: NDArray, Y: NDArray, dx: float, method: str = "minmax"):
+    if method == "minmax":
+        low = Y.min(axis=1, keepdims=True)
+        return x, (Y - low) / (Y.max(axis=1, keepdims=True) - low), dx
+    if method == "zscore":
+        return x, (Y - Y.mean(axis=1, keepdims=True)) / Y.std(axis=1, keepdims=True), dx
+    raise ValueError(f"method={method} is not supported. Use 'minmax' or 'zscore'. ")
+
+
+def _remove_spike(x: NDArray, Y: NDArray, dx: float):
+    # The spikes are found spectrum by spectrum, then repaired together by the kernel
+    rows, starts, stops = [], [], []
+    for i in range(Y.shape[0]):
+        sample = Sample(x=x, y=Y[i], interpolate=False)
+        sample._dx = dx
+        for region in sample.find_spike():
+            rows.append(i)
+            starts.append(region[0])
+            stops.append(region[-1] + 1)
+    return x, kernels.repair_spikes(np.array(Y, copy=True), np.array(rows), np.array(starts), np.array(stops)), dx
+
+
+def _despike(x: NDArray, Y: NDArray, dx: float, window_length: str | int = "auto", threshold: int = 3):
+    if window_length == "auto":
+        window_length = int(5 / dx)
+    return x, kernels.despike(Y, neigh=int(window_length), threshold=threshold), dx
+
+
+def _emsc(x: NDArray, Y: NDArray, dx: float, references: tuple = (), order: int = 5, normalize: bool = True):
+    from raman.model import EMSC
+    from raman.references import get_reference
+    from raman.search import resample
+
+    emsc = EMSC(raman_shift=x, order=order)
+    for reference in references:
+        if isinstance(reference, str):
+            resampled = get_reference(reference, x=x, normalize=None)
+            emsc.add_reference(resampled.y, name=resampled.name)
+        else:
+            emsc.add_reference(resample(reference.x, reference.y, x)[0], name=reference.name)
+    return x, emsc.correct_batch(Y, normalize=normalize), dx
+
+
+_STAGES: dict[str, Callable[..., tuple[NDArray, NDArray, float]]] = {
+    "crop": _crop,
+    "extract_range": _extract_range,
+    "interpolate": _interpolate,
+    "smoothing": _smoothing,
+    "baseline": _baseline,
+    "normalized": _normalized,
+    "remove_spike": _remove_spike,
+    "despike": _despike,
+    "emsc": _emsc,
+}
+
+
+def _run_step(step: Step, x: NDArray, Y: NDArray, dx: float) -> tuple[NDArray, NDArray, float]:
+    return _STAGES[step.name](x, Y, dx, **step.kwargs)
+
+
+############# Plan #############
+
+
+class Plan:
+    """
+    A recorded sequence of preprocessing operations. Every method returns a new plan, so plans can be shared.
+
+    Parameters
+    ----------
+    steps : iterable of Step
+        The operations, in order.
+    max_operators : int
+        The number of fused operators (one per segment and Raman Shift axis) kept by the plan.
+    """
+
+    def __init__(self, steps: Iterable[Step] = (), max_operators: int = 16):
+        self.steps: tuple[Step, ...] = tuple(steps)
+        self.max_operators: int = max_operators
+        self._optimized: Plan | None = None
+        self._operators: OrderedDict[tuple, tuple[NDArray, NDArray, NDArray, float]] = OrderedDict()
+
+    def _then(self, name: str, **kwargs) -> Self:
+        return type(self)(self.steps + (Step(name, **kwargs),), max_operators=self.max_operators)
+
+    ############# Recording #############
+
+    def remove_spike(self) -> Self:
+        """
+        `Sample.remove_spike()`, as run by the `Sample` constructor.
+        """
+        return self._then("remove_spike")
+
+    def despike(self, window_length: str | int = "auto", threshold: int = 3) -> Self:
+        return self._then("despike", window_length=window_length, threshold=threshold)
+
+    def interpolate(self, step: float = 1) -> Self:
+        return self._then("interpolate", step=step)
+
+    def extract_range(self, low: float, high: float) -> Self:
+        return self._then("extract_range", low=low, high=high)
+
+    def smoothing(self, window_length: str | int = "auto", polyorder: int = 2) -> Self:
+        return self._then("smoothing", window_length=window_length, polyorder=polyorder)
+
+    def baseline(self, order: int = 1, roi: NDArray | None = None, method: str = "poly", **kwargs) -> Self:
+        return self._then("baseline", order=order, roi=roi, method=method, **kwargs)
+
+    def normalized(self, method: str = "minmax") -> Self:
+        return self._then("normalized", method=method)
+
+    def emsc(self, references: Sample | str | list[Sample | str], order: int = 5, normalize: bool = True) -> Self:
+        """
+        EMSC correction (`raman.model.EMSC.correct_batch`) of every spectrum. A reference given as str is the name
+        of a reference in the database or a .txt file, read through `raman.references`.
+        """
+        if isinstance(references, (Sample, str)):
+            references = [references]
+        return self._then("emsc", references=tuple(references), order=order, normalize=normalize)
+
+    ############# Optimization #############
+
+    def optimize(self) -> "Plan":
+        """
+        The plan with the ROI crops pushed before the local stages and the linear stages fused. Cached.
+        """
+        if self._optimized is not None:
+            return self._optimized
+        steps = list(self.steps)
+
+        # ROI pushdown: walk back from every extract_range over the local stages before it
+        i = 0
+        while i < len(steps):
+            step = steps[i]
+            if step.name == "extract_range":
+                start = i
+                while start > 0 and steps[start - 1].local:
+                    start -= 1
+                if start < i:
+                    covers = tuple(steps[start:i])
+                    steps.insert(start, Step("crop", low=step.kwargs["low"], high=step.kwargs["high"], covers=covers))
+                    i += 1
+            i += 1
+
+        # Fusion of the runs of linear stages
+        fused: list[Step] = []
+        run: list[Step] = []
+        for step in steps + [Step("end")]:
+            if step.linear:
+                run.append(step)
+                continue
+            if len(run) > 1 and any(item.name not in ["crop", "extract_range"] for item in run):
+                fused.append(Step("fused", steps=tuple(run)))
+            else:
+                fused.extend(run)
+            run = []
+            if step.name != "end":
+                fused.append(step)
+
+        optimized = type(self)(fused, max_operators=self.max_operators)
+        optimized._optimized = optimized
+        self._optimized = optimized
+        return optimized
+
+    def explain(self) -> str:
+        """
+        The recorded and the optimized plan, one step per line.
+        """
+        lines = ["recorded:"] + [f"  {step}" for step in self.steps]
+        lines += ["optimized:"] + [f"  {step}" for step in self.optimize().steps]
+        return "\n".join(lines)
+
+    ############# Execution #############
+
+    def _operator(self, index: int, step: Step, x: NDArray, dx: float) -> tuple[NDArray, NDArray, NDArray, float]:
+        key = (index, axis_key(x), dx)
+        operator = self._operators.get(key)
+        if operator is not None:
+            self._operators.move_to_end(key)
+            return operator
+        steps = list(step.kwargs["steps"])
+        # Leading crops only select columns: apply them as a mask instead of through the matrix
+        columns = np.arange(x.shape[0])
+        x_in = x
+        while len(steps) > 0 and steps[0].name in ["crop", "extract_range"]:
+            x_in, selected, dx = _run_step(steps.pop(0), x_in, columns[None, :].astype(np.float64), dx)
+            columns = selected[0].astype(np.int64)
+        # Push the unit spectra through the stages: row i of the result is the response to a unit at column i
+        x_out, R, dx_out = x_in, np.eye(x_in.shape[0], dtype=np.float64), dx
+        for item in steps:
+            x_out, R, dx_out = _run_step(item, x_out, R, dx_out)
+        R.setflags(write=False)
+        operator = (columns, R, x_out, dx_out)
+        self._operators[key] = operator
+        while len(self._operators) > self.max_operators:
+            self._operators.popitem(last=False)
+        return operator
+
+    def run_array(self, x: NDArray, Y: NDArray, dx: float | None = None) -> tuple[NDArray, NDArray, float]:
+        """
+        Run the optimized plan on a stack of spectra sharing the Raman Shift `x`.
+
+        Returns
+        -------
+        tuple of (NDArray, NDArray, float) :
+            The new Raman Shift, the new intensities (n_spectra, n_shifts) and the new spacing.
+        """
+        optimized = self.optimize()
+        Y = np.atleast_2d(np.asarray(Y, dtype=np.float64))
+        dx = float(np.diff(x).mean()) if dx is None else dx
+        for index, step in enumerate(optimized.steps):
+            if step.name == "fused":
+                columns, R, x, dx = optimized._operator(index, step, x, dx)
+                Y = Y[:, columns] @ R
+            else:
+                x, Y, dx = _run_step(step, x, Y, dx)
+        return x, Y, dx
+
+    def run(self, samples: list[Sample]) -> list[Sample]:
+        """
+        Run the plan on samples, stacked per Raman Shift. The samples are updated in place and returned.
+        """
+        for group in axis_groups(samples).values():
+            x, Y, dx = self.run_array(group[0].x, np.vstack([sample.y for sample in group]), dx=float(group[0]._dx))
+            for sample, y in zip(group, Y):
+                sample.x = x
+                sample.y = y
+                sample._dx = dx
+        return samples
+
+    @property
+    def key(self) -> tuple:
+        """
+        A hashable identity of the recorded operations. Samples and arrays in the arguments count by identity.
+        """
+        return tuple((step.name, tuple((key, _identity(value)) for key, value in step.kwargs.items())) for step in self.steps)
+
+    def __len__(self) -> int:
+        return len(self.steps)
+
+    def __repr__(self) -> str:
+        return f"Plan({' -> '.join(map(repr, self.steps))})"
+
+
+############# Lazy Sample #############
+
+
+class LazySample:
+    """
+    A spectrum with a recorded plan. The `Sample` methods record the operation and return the lazy sample;
+    nothing runs until `collect` (or `collect_all` for many samples at once).
+
+    Parameters
+    ----------
+    sample : Sample
+        The raw spectrum (created with interpolate=False).
+    plan : Plan or None
+        The operations recorded so far.
+    """
+
+    def __init__(self, sample: Sample, plan: Plan | None = None):
+        self.sample: Sample = sample
+        self.plan: Plan = Plan() if plan is None else plan
+
+    @classmethod
+    def read_txt(cls, path: str | Path, name_format: list[str] = NAME_FORMAT, interpolate: bool = True) -> Self:
+        """
+        Read a file without preprocessing it. With `interpolate`, the spike removal and the interpolation of the
+        `Sample` constructor are recorded instead of run, so a later `extract_range` is pushed before the interpolation
+        (the spikes are still removed on the whole spectrum).
+        """
+        lazy = cls(read_txt(path, name_format=name_format, interpolate=False))
+        if interpolate:
+            lazy.plan = lazy.plan.remove_spike().interpolate(step=1)
+        return lazy
+
+    def _record(self, operation: str, *args, **kwargs) -> Self:
+        self.plan = getattr(self.plan, operation)(*args, **kwargs)
+        return self
+
+    def remove_spike(self) -> Self:
+        return self._record("remove_spike")
+
+    def despike(self, window_length: str | int = "auto", threshold: int = 3) -> Self:
+        return self._record("despike", window_length=window_length, threshold=threshold)
+
+    def interpolate(self, step: float = 1) -> Self:
+        return self._record("interpolate", step=step)
+
+    def extract_range(self, low: float, high: float) -> Self:
+        return self._record("extract_range", low=low, high=high)
+
+    def smoothing(self, window_length: str | int = "auto", polyorder: int = 2) -> Self:
+        return self._record("smoothing", window_length=window_length, polyorder=polyorder)
+
+    def baseline(self, order: int = 1, roi: NDArray | None = None, method: str = "poly", **kwargs) -> Self:
+        return self._record("baseline", order=order, roi=roi, method=method, **kwargs)
+
+    def normalized(self, method: str = "minmax") -> Self:
+        return self._record("normalized", method=method)
+
+    def emsc(self, references: Sample | str | list[Sample | str], order: int = 5, normalize: bool = True) -> Self:
+        return self._record("emsc", references, order=order, normalize=normalize)
+
+    def explain(self) -> str:
+        return self.plan.explain()
+
+    def collect(self) -> Sample:
+        """
+        Run the plan on a copy of the raw spectrum and return it.
+        """
+        return self.plan.run([self.sample._copy()])[0]
+
+    def __repr__(self) -> str:
+        return f"LazySample({self.sample.name}, {self.plan})"
+
+
+def collect_all(lazy_samples: Iterable[LazySample]) -> list[Sample]:
+    """
+    Run the plans of many lazy samples, once per distinct plan and batched per Raman Shift, in the input order.
+    """
+    lazy_samples = list(lazy_samples)
+    plans: dict[tuple, tuple[Plan, list[int]]] = {}
+    for i, lazy in enumerate(lazy_samples):
+        # Samples that recorded the same operations share one plan (and its fused operators)
+        plans.setdefault(lazy.plan.key, (lazy.plan, []))[1].append(i)
+    results: list[Sample | None] = [None] * len(lazy_samples)
+    for plan, indices in plans.values():
+        samples = plan.run([lazy_samples[i].sample._copy() for i in indices])
+        for i, sample in zip(indices, samples):
+            results[i] = sample
+    return results  # type: ignore
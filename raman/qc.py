@@ -0,0 +1,218 @@
+"""
+Quality control of raw acquisitions, before any processing.
+
+`QualityGate` checks a stack of raw spectra (the counts as read from the files) in a few vectorized passes, so bad
+acquisitions are tagged or dropped before the `Sample` constructor, the EMSC fit or the feature extraction run:
+
+- 'invalid': a non-finite count.
+- 'axis': the Raman Shift is not increasing, has a gap, does not cover `window`, or is off the expected axis.
+- 'saturated': counts at the top of the 16-bit range (0xFFFF) inside `window`. The laser line is outside it.
+- 'empty': the signal above the dark level is below `min_snr` times the noise of the spectrum.
+- 'spikes': more than `max_spikes` cosmic spikes (a jump up followed by a jump down within 3 points).
+
+    >>> gate = QualityGate.from_dark_frames({10: "data/noise/10s/txt", 30: "data/noise/30s/txt", 60: "data/noise/60s/txt"})
+    >>> passed = SampleSet(Path("data/pilot/s1"), name_format=[...]).screen(gate)
+    >>> passed.qc  # path -> reasons, for every screened file
+
+The reasons of a sample are recorded in `sample.meta['qc']` (an empty list when it passed).
+"""
+from raman.helper import read_spectrum
+from raman.axis import axis_key
+
+import numpy as np
+from numpy.typing import NDArray
+
+from pathlib import Path
+from typing import Any, Iterable, Self
+
+QC_REASONS: list[str] = ["invalid", "axis", "saturated", "empty", "spikes"]
+
+# The counts at which the detector is considered saturated (2 % below 0xFFFF, the exports top out at 64524)
+SATURATION: int = int(0.98 * 0xFFFF)
+
+
+class QualityGate:
+    """
+    Vectorized checks of raw spectra.
+
+    Parameters
+    ----------
+    window : tuple of (float, float)
+        The Raman Shift range that must be covered and where the counts are checked.
+    saturation : float
+        The count from which a point is saturated.
+    max_saturated : int
+        The largest number of saturated points in `window`.
+    dark_level : float or dict of int to float
+        The dark counts, or the dark counts per exposure (seconds). See `from_dark_frames`.
+    min_snr : float
+        The smallest median signal above the dark level, in units of the noise of the spectrum (estimated from the
+        point to point differences).
+    spike_threshold : float
+        The robust z-score of a point to point difference that counts as the edge of a spike.
+    max_spikes : int
+        The largest number of spikes in `window`.
+    axis : NDArray, str or None
+        The expected Raman Shift, or 'common' for the Raman Shift of most of the checked spectra (a spectrum taken
+        with another grating position is misaligned). Default is None, which only checks that the axis is regular.
+    axis_tolerance : float
+        How far (cm⁻¹) the Raman Shift may be from `axis`.
+    max_step_ratio : float
+        The largest step of the Raman Shift, relative to the previous step (a larger one is a gap).
+    """
+
+    def __init__(
+        self,
+        window: tuple[float, float] = (400, 1800),
+        saturation: float = SATURATION,
+        max_saturated: int = 0,
+        dark_level: float | dict[int, float] = 40.0,
+        min_snr: float = 5.0,
+        spike_threshold: float = 10.0,
+        max_spikes: int = 3,
+        axis: NDArray | str | None = None,
+        axis_tolerance: float = 2.0,
+        max_step_ratio: float = 1.5,
+    ):
+        self.window: tuple[float, float] = window
+        self.saturation: float = saturation
+        self.max_saturated: int = max_saturated
+        self.dark_level: float | dict[int, float] = dark_level
+        self.min_snr: float = min_snr
+        self.spike_threshold: float = spike_threshold
+        self.max_spikes: int = max_spikes
+        self.axis: NDArray | str | None = axis if axis is None or isinstance(axis, str) else np.asarray(axis, dtype=np.float64)
+        self.axis_tolerance: float = axis_tolerance
+        self.max_step_ratio: float = max_step_ratio
+
+    @classmethod
+    def from_dark_frames(cls, folders: dict[int, str | Path], **kwargs) -> Self:
+        """
+        A gate whose dark level per exposure is the median count of the dark frames (.txt) of `folders[exposure]`.
+        """
+        dark_level: dict[int, float] = {}
+        for exposure, folder in folders.items():
+            paths = sorted(Path(folder).glob("*.txt"))
+            if len(paths) == 0:
+                raise ValueError(f"No dark frame found in {Path(folder).as_posix()}")
+            dark_level[int(exposure)] = float(np.median([np.median(read_spectrum(path)[:, 1]) for path in paths]))
+        return cls(dark_level=dark_level, **kwargs)
+
+    def _dark(self, exposures: NDArray | None, n: int) -> NDArray:
+        if isinstance(self.dark_level, dict) == False:
+            return np.full(n, float(self.dark_level))  # type: ignore
+        levels: dict[int, float] = self.dark_level  # type: ignore
+        if exposures is None:
+            return np.full(n, float(np.median(list(levels.values()))))
+        # The dark level of the closest exposure with dark frames
+        known = np.array(sorted(levels))
+        closest = known[np.abs(np.asarray(exposures, dtype=np.float64)[:, None] - known[None, :]).argmin(axis=1)]
+        return np.array([levels[int(exposure)] for exposure in closest])
+
+    def _check_axis(self, x: NDArray) -> bool:
+        if np.isfinite(x).all() == False or x.shape[0] < 3:
+            return False
+        step = np.diff(x)
+        # The spacing changes smoothly along the detector: a gap is a step much larger than the previous one
+        if (step <= 0).any() or (step[1:] / step[:-1]).max() > self.max_step_ratio:
+            return False
+        return x[0] <= self.window[0] and x[-1] >= self.window[1]
+
+    def check(self, X: NDArray | list[NDArray], Y: NDArray | list[NDArray], exposures: Iterable[float] | None = None) -> dict[str, Any]:
+        """
+        Check raw spectra. Spectra sharing the same Raman Shift are checked together.
+
+        Parameters
+        ----------
+        X : NDArray of shape (n_shifts, ) or (n_spectra, n_shifts), or list of NDArray
+            The Raman Shift, shared or of every spectrum, in increasing order.
+        Y : NDArray of shape (n_spectra, n_shifts) or list of NDArray
+            The raw counts.
+        exposures : iterable of float or None
+            The exposure of every spectrum, to pick the dark level.
+
+        Returns
+        -------
+        dict :
+            'passed' (bool), 'saturated' (the number of saturated points), 'snr' (the median signal above the
+            dark level over the noise) and 'spikes' (the number of spikes), arrays of shape (n_spectra, );
+            'reasons', the list of failed checks of every spectrum.
+        """
+        Ys = [np.asarray(y, dtype=np.float64) for y in Y]
+        n = len(Ys)
+        if isinstance(X, np.ndarray) and X.ndim == 1:
+            Xs = [X] * n
+        else:
+            Xs = [np.asarray(x, dtype=np.float64) for x in X]
+        if len(Xs) != n:
+            raise ValueError(f"Expect one Raman Shift per spectrum. Got {len(Xs)} for {n} spectra.")
+        dark = self._dark(None if exposures is None else np.fromiter(exposures, dtype=np.float64), n)
+
+        saturated = np.zeros(n, dtype=np.int64)
+        snr = np.full(n, np.nan)
+        spikes = np.zeros(n, dtype=np.int64)
+        flags = {reason: np.zeros(n, dtype=bool) for reason in QC_REASONS}
+
+        groups: dict[tuple, list[int]] = {}
+        for i, (x, y) in enumerate(zip(Xs, Ys)):
+            if x.shape != y.shape:
+                flags["axis"][i] = True
+                continue
+            groups.setdefault(axis_key(x), []).append(i)
+        expected = self.axis
+        if isinstance(expected, str) and len(groups) > 0:
+            # 'common': the Raman Shift of most spectra
+            expected = Xs[max(groups.values(), key=len)[0]]
+        for rows in groups.values():
+            x = Xs[rows[0]]
+            if self._check_axis(x) == False:
+                flags["axis"][rows] = True
+                continue
+            if expected is not None and (expected.shape != x.shape or np.abs(expected - x).max() > self.axis_tolerance):
+                flags["axis"][rows] = True
+                continue
+            mask = (x >= self.window[0]) & (x <= self.window[1])
+            flags["invalid"][rows] = np.isfinite(np.vstack([Ys[i] for i in rows])).all(axis=1) == False
+            W = np.vstack([Ys[i][mask] for i in rows])
+            W = np.where(np.isfinite(W), W, 0)
+
+            saturated[rows] = (W >= self.saturation).sum(axis=1)
+
+            # The noise from the point to point differences: robust to the bands and the baseline
+            D = np.diff(W, axis=1)
+            center = np.median(D, axis=1, keepdims=True)
+            mad = 1.4826 * np.median(np.abs(D - center), axis=1, keepdims=True)
+            noise = np.maximum(mad[:, 0] / np.sqrt(2), 1e-12)
+            snr[rows] = (np.median(W, axis=1) - dark[rows]) / noise
+
+            Z = (D - center) / np.maximum(mad, 1e-12)
+            up, down = Z > self.spike_threshold, Z < -self.spike_threshold
+            hit = np.zeros_like(up)
+            for k in range(1, 4):
+                hit[:, :-k] |= up[:, :-k] & down[:, k:]
+            spikes[rows] = hit.sum(axis=1)
+
+        flags["saturated"] = saturated > self.max_saturated
+        flags["empty"] = (snr < self.min_snr) & (flags["axis"] == False)
+        flags["spikes"] = spikes > self.max_spikes
+        reasons = [[reason for reason in QC_REASONS if flags[reason][i]] for i in range(n)]
+        return {
+            "passed": np.array([len(reason) == 0 for reason in reasons], dtype=bool),
+            "saturated": saturated,
+            "snr": snr,
+            "spikes": spikes,
+            "reasons": reasons,
+        }
+
+    def check_files(self, paths: Iterable[str | Path], exposures: Iterable[float] | None = None) -> dict[str, Any]:
+        """
+        `check` on the raw counts of .txt files, read without building a `Sample`.
+        """
+        spectra = [read_spectrum(path) for path in paths]
+        return self.check([spectrum[:, 0] for spectrum in spectra], [spectrum[:, 1] for spectrum in spectra], exposures=exposures)
+
+    def __repr__(self) -> str:
+        return (
+            f"QualityGate(window={self.window}, saturation={self.saturation:g}, min_snr={self.min_snr:g}, "
+            f"max_spikes={self.max_spikes}, dark_level={self.dark_level})"
+        )
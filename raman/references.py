@@ -0,0 +1,278 @@
+"""
+A process-wide cache of prepared reference spectra.
+
+Loading a reference from the database costs a `find_one`, the pydantic validation, `to_sample` (spike search and
+cubic interpolation), then `extract_range` and `normalized`. `ReferenceCache` keeps every reference already
+prepared for a requested (range, grid, normalization), so EMSC runs and the glucose service load each reference
+once per process:
+
+    >>> from raman.references import get_reference
+    >>> glucose = get_reference("glucose", low=700, high=1500, normalize="minmax")
+    >>> skin = get_reference("data/skin/txt/skin1_600_785 nm_30 s_1_2024_12_09_13_41_06_01.txt", x=model.raman_shift)
+
+A source is the name of a reference in the database or the path of a .txt file. Entries are revalidated against
+a small version token of the source at most every `check_interval` seconds: the `_id`, `timestamp` and `revision`
+of the document (`Reference.save` increments `revision`), or the size and modification time of the file. When
+it changed, every entry of the source is prepared again.
+
+Returned samples share the cached read-only arrays; their operations assign new arrays and leave the cache intact.
+Worker processes started with fork inherit the cache. For other start methods, `ReferenceCache.share` puts the
+entries in shared memory and `ReferenceCache.attach` maps them in the worker without copying.
+"""
+from raman.sample import Sample
+from raman.axis import axis_key
+from raman.shared import SharedArray
+from raman.search import resample
+
+import numpy as np
+from numpy.typing import NDArray
+
+from collections import OrderedDict
+from pathlib import Path
+from time import monotonic
+from typing import Hashable, Self
+
+
+def _is_file(source: str) -> bool:
+    return source.endswith(".txt") or Path(source).exists()
+
+
+def source_token(source: str) -> tuple:
+    """
+    The version of a reference: (size, modification time) of a file, or (`_id`, `timestamp`, `revision`) of the
+    document, read with a projection so the arrays are not transferred.
+    """
+    if _is_file(source):
+        stat = Path(source).stat()
+        return ("file", stat.st_size, stat.st_mtime_ns)
+    from raman.database import collection_ref  # Connects to the database on import
+
+    item = collection_ref.find_one({"name": source}, projection={"_id": 1, "timestamp": 1, "revision": 1})
+    if item is None:
+        raise ValueError(f"Reference {source} is not in the database")
+    return ("database", str(item["_id"]), item.get("timestamp"), item.get("revision", 0))
+
+
+def load_reference(source: str) -> tuple[Sample, tuple]:
+    """
+    Read a reference with its token, prepared like `Reference.to_sample` (spikes removed, interpolated to 1 cm⁻¹).
+    """
+    if _is_file(source):
+        from raman.helper import read_spectrum
+
+        path = Path(source)
+        token = source_token(source)
+        spectrum = read_spectrum(path)
+        sample = Sample(x=spectrum[:, 0], y=spectrum[:, 1], path=path)
+        sample.name = path.stem.split("_")[0]
+        return sample, token
+    from raman.database import collection_ref
+    from raman.spectra import Reference
+
+    item = collection_ref.find_one({"name": source})
+    if item is None:
+        raise ValueError(f"Reference {source} is not in the database")
+    sample = Reference(**item).to_sample(verbose=False)
+    return sample, ("database", str(item["_id"]), item.get("timestamp"), item.get("revision", 0))
+
+
+def _frozen(sample: Sample, x: NDArray, y: NDArray) -> Sample:
+    # A copy whose original (what `reset_data` returns to) is the prepared, read-only data
+    frozen = sample._copy()
+    y.setflags(write=False)
+    frozen._x, frozen._y = x, y
+    frozen.reset_data()
+    return frozen
+
+
+class ReferenceCache:
+    """
+    A bounded LRU cache of references prepared for a (range, grid, normalization).
+
+    Parameters
+    ----------
+    max_entries : int
+        The largest number of prepared references kept. The least recently used are evicted first.
+    check_interval : float or None
+        The time (seconds) during which an entry is used without checking its source. 0 checks on every `get`,
+        None never checks (for example in a worker process).
+    """
+
+    def __init__(self, max_entries: int = 64, check_interval: float | None = 30.0):
+        self.max_entries: int = max_entries
+        self.check_interval: float | None = check_interval
+        self._entries: OrderedDict[Hashable, tuple[tuple, Sample]] = OrderedDict()
+        self._bases: dict[str, tuple[tuple, Sample]] = {}
+        self._checked: dict[str, tuple[tuple, float]] = {}
+        self.stats: dict[str, int] = {"hits": 0, "misses": 0, "loads": 0, "invalidations": 0, "evictions": 0}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _token(self, source: str, validate: bool) -> tuple | None:
+        checked = self._checked.get(source)
+        if checked is not None:
+            token, at = checked
+            if validate == False or self.check_interval is None or monotonic() - at < self.check_interval:
+                return token
+        elif validate == False:
+            return None
+        token = source_token(source)
+        if checked is not None and checked[0] != token:
+            self.invalidate(source)
+            self.stats["invalidations"] += 1
+        self._checked[source] = (token, monotonic())
+        return token
+
+    def _base(self, source: str, token: tuple | None) -> Sample:
+        base = self._bases.get(source)
+        if base is None or (token is not None and base[0] != token):
+            sample, loaded = load_reference(source)
+            self.stats["loads"] += 1
+            self._bases[source] = (loaded, sample)
+            self._checked[source] = (loaded, monotonic())
+            return sample
+        return base[1]
+
+    def get(
+        self,
+        source: str,
+        low: float | None = None,
+        high: float | None = None,
+        normalize: str | None = "minmax",
+        x: NDArray | None = None,
+        validate: bool = True,
+    ) -> Sample:
+        """
+        A reference prepared like `extract_range(low, high)`, resampled to `x`, then `normalized(normalize)`.
+
+        Parameters
+        ----------
+        source : str
+            The name of a reference in the database, or the path of a .txt file.
+        low, high : float or None
+            The Raman Shift range. Default is None, which keeps the whole spectrum (or the span of `x`).
+        normalize : str or None
+            Passed to `Sample.normalized`. None keeps the intensity.
+        x : NDArray or None
+            The grid to resample to (linear, the nearest end outside the reference). Default is None, the 1 cm⁻¹ axis.
+        validate : bool
+            Default is True, which checks the source when `check_interval` has elapsed. False never touches the
+            source for a cached reference (for worker processes that must not use an inherited database client).
+
+        Returns
+        -------
+        Sample :
+            A new sample sharing the cached read-only arrays.
+        """
+        source = Path(source).as_posix() if isinstance(source, Path) else source
+        key = (source, low, high, normalize, None if x is None else axis_key(x))
+        token = self._token(source, validate)
+        entry = self._entries.get(key)
+        if entry is not None and (token is None or entry[0] == token):
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry[1]._copy()
+
+        self.stats["misses"] += 1
+        sample = self._base(source, token)._copy()
+        if low is not None or high is not None:
+            sample.extract_range(low=-np.inf if low is None else low, high=np.inf if high is None else high)
+        if x is not None:
+            sample.y = resample(sample.x, sample.y, np.asarray(x, dtype=sample.dtype))[0]
+            sample.x = x
+        if normalize is not None:
+            sample.normalized(method=normalize)
+        self._put(key, self._bases[source][0], _frozen(sample, sample.x, np.array(sample.y)))
+        return self._entries[key][1]._copy()
+
+    def _put(self, key: Hashable, token: tuple, sample: Sample):
+        self._entries[key] = (token, sample)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def invalidate(self, source: str | None = None):
+        """
+        Drop the entries of a source, or every entry when `source` is None.
+        """
+        if source is None:
+            self._entries.clear()
+            self._bases.clear()
+            self._checked.clear()
+            return
+        for key in [key for key in self._entries if key[0] == source]:  # type: ignore
+            del self._entries[key]
+        self._bases.pop(source, None)
+        self._checked.pop(source, None)
+
+    def share(self) -> dict[Hashable, tuple]:
+        """
+        Copy the entries into shared memory for worker processes (see `attach`).
+        The caller owns the memory: keep the result alive while the workers run, then `release_shared` it.
+        """
+        shared: dict[Hashable, tuple] = {}
+        for key, (token, sample) in self._entries.items():
+            frozen = sample._copy()
+            frozen._x, frozen._y, frozen._cur_x, frozen._cur_y = None, None, None, None
+            shared[key] = (token, SharedArray.copy_of(sample.x), SharedArray.copy_of(sample.y), frozen)
+        return shared
+
+    @staticmethod
+    def release_shared(shared: dict[Hashable, tuple]):
+        for _, x, y, _ in shared.values():
+            x.release()
+            y.release()
+
+    @classmethod
+    def attach(cls, shared: dict[Hashable, tuple], max_entries: int = 64) -> Self:
+        """
+        A cache of the entries of `share`, mapped without copying. It never checks the sources, so workers do
+        not query the database; a reference that is not shared is loaded on first use.
+        """
+        cache = cls(max_entries=max(max_entries, len(shared)), check_interval=None)
+        for key, (token, x, y, sample) in shared.items():
+            x.array.setflags(write=False)
+            cache._put(key, token, _frozen(sample, x.array, y.array))
+            cache._checked[key[0]] = (token, monotonic())  # type: ignore
+        cache._shared = shared  # Keeps the mappings open
+        return cache
+
+    def __repr__(self) -> str:
+        return f"ReferenceCache(entries={len(self._entries)}/{self.max_entries}, stats={self.stats})"
+
+
+_cache: ReferenceCache | None = None
+
+
+def get_cache() -> ReferenceCache:
+    """
+    The process-wide cache, created on first use.
+    """
+    global _cache
+    if _cache is None:
+        _cache = ReferenceCache()
+    return _cache
+
+
+def set_cache(cache: ReferenceCache):
+    """
+    Replace the process-wide cache, for example with `ReferenceCache.attach` in a worker initializer.
+    """
+    global _cache
+    _cache = cache
+
+
+def get_reference(
+    source: str,
+    low: float | None = None,
+    high: float | None = None,
+    normalize: str | None = "minmax",
+    x: NDArray | None = None,
+    validate: bool = True,
+) -> Sample:
+    """
+    `ReferenceCache.get` on the process-wide cache.
+    """
+    return get_cache().get(source, low=low, high=high, normalize=normalize, x=x, validate=validate)
@@ -1,20 +1,21 @@
 from raman.helper import bold
+from raman.baseline import poly_baseline, als_baseline
+from raman.axis import intern_axis, arange_axis, same_axis, axis_groups
+from raman.memo import memoized_method
+from raman import kernels
 
 import numpy as np
 from numpy.typing import NDArray
 from scipy.interpolate import CubicSpline, interp1d  # type: ignore
-from scipy.signal import find_peaks, peak_widths  # type: ignore
+from scipy.signal import find_peaks  # type: ignore
 from scipy.signal import savgol_filter  # type: ignore
-from rampy.spectranization import despiking  # type: ignore
-from rampy import baseline  # type: ignore
 import matplotlib.pyplot as plt
 
 from pathlib import Path
 import os
-from typing import Self
+from typing import Any, Callable, Iterable, Self
 from datetime import datetime
-from copy import deepcopy
-from functools import reduce
+from copy import copy, deepcopy
 
 
 class Sample:
@@ -59,10 +60,40 @@ class Sample:
         The information which lens is used to collect the sample.
     slit : float
         The slit size used to collect the sample.
-
+    meta : dict
+        Any other metadata, for example the fields of a custom `name_format` that are not an attribute above.
+
+    Memory
+    ------
+    `Sample` uses `__slots__` and stores `x` and `y` with the `dtype` given to the constructor (default float64).
+    The original data is kept read-only and shared with `x` and `y` until an operation replaces them (copy-on-write),
+    so `reset_data` never copies. Pass `keep_original=False` to drop the original data after construction.
+    `x` is interned through `raman.axis`, so samples on the same Raman Shift share one read-only array
+    and `is_same_range` is an identity check.
     """
 
-    name: str = "unname"
+    __slots__ = (
+        "name",
+        "paths",
+        "date",
+        "exposure",
+        "accumulation",
+        "grating",
+        "laser",
+        "power",
+        "lens",
+        "slit",
+        "meta",
+        "_dx",
+        "_x",
+        "_y",
+        "_cur_x",
+        "_cur_y",
+        "_dtype",
+        "__weakref__",
+    )
+
+    name: str
     x: NDArray[np.float64]
     y: NDArray[np.float64]
     paths: set[Path]
@@ -84,6 +115,8 @@ class Sample:
         path: str | Path | None = None,
         interpolate: bool = True,
         verbose: bool = False,
+        dtype: type | np.dtype | None = None,
+        keep_original: bool = True,
     ):
         if isinstance(x, np.ndarray) == False:  # type: ignore
             raise TypeError(
@@ -96,9 +129,15 @@ class Sample:
         if x.shape != y.shape:
             raise ValueError(f"shape mismatch between x={x.shape} and y={y.shape}")
 
+        self.name = "unname"
+        self.meta: dict = {}
+        self._dtype: np.dtype = np.dtype(np.float64 if dtype is None else dtype)
+
         # Original Data that should not be replace so that we can always reset.
-        self._x: NDArray[np.float64] = deepcopy(x)
-        self._y: NDArray[np.float64] = deepcopy(y)
+        # They are read-only and shared with `x` and `y` until an operation replaces them.
+        self._x: NDArray[np.float64] | None = intern_axis(np.asarray(x, dtype=self._dtype))
+        self._y: NDArray[np.float64] | None = np.array(y, dtype=self._dtype)
+        self._y.setflags(write=False)
 
         self.paths: set[Path] = set({})
         if path:
@@ -114,14 +153,41 @@ class Sample:
                     print(f"Found {len(spike_regions)} spike(s) in path={path.as_posix() if path else ''}, self.remove_spike() is perform automatically.")  # type: ignore
                 self.remove_spike(auto=False, spike_regions=spike_regions)
             self.interpolate(step=1)
+        if keep_original == False:
+            self._x = None
+            self._y = None
+
+    @property
+    def x(self) -> NDArray[np.float64]:
+        return self._cur_x
+
+    @x.setter
+    def x(self, value: NDArray[np.float64]):
+        self._cur_x = intern_axis(np.asarray(value, dtype=self._dtype))
+
+    @property
+    def y(self) -> NDArray[np.float64]:
+        return self._cur_y
+
+    @y.setter
+    def y(self, value: NDArray[np.float64]):
+        self._cur_y = np.asarray(value, dtype=self._dtype)
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self._dtype
 
     @property
     def shape(self) -> tuple:
-        return self.data.shape
+        return (self.x.shape[0], 2)
 
     @property
     def data(self) -> np.ndarray:
-        return np.hstack([self.x.reshape(-1, 1), self.y.reshape(-1, 1)])
+        """
+        A new array of shape (n_samples, 2) with `x` and `y` as columns.
+        Prefer `sample.x`, `sample.y` or `sample[idx]` which do not build the whole array.
+        """
+        return np.column_stack([self.x, self.y])
 
     @property
     def mean(self) -> float:
@@ -141,9 +207,14 @@ class Sample:
     def reset_data(self):
         """
         Use to set/reset the data (`x` and `y`) with the original data.
+        The original data is shared (read-only) until an operation replaces `x` or `y`.
         """
-        self.x = deepcopy(self._x)  # type: ignore
-        self.y = deepcopy(self._y)  # type: ignore
+        if self._x is None or self._y is None:
+            raise RuntimeError(
+                f"The original data is not kept. Create the Sample with keep_original=True to reset."
+            )
+        self.x = self._x  # type: ignore
+        self.y = self._y  # type: ignore
         self._dx: float = np.diff(self.x).mean()  # type: ignore
 
     def at(self, shift: float | list[float]) -> np.ndarray:
@@ -193,10 +264,11 @@ class Sample:
             width = int(10 / self._dx)
 
         # peak_idxes, _ = find_peaks(self.y, height=height)
-        peak_idxes, _ = find_peaks(self.y, prominence=prominence)
+        # width=0 makes find_peaks return the widths too, without computing the prominences again in peak_widths
+        peak_idxes, properties = find_peaks(self.y, prominence=prominence, width=0)
         if verbose:
             print(f"Found {peak_idxes.shape[0]} peaks.")
-        widths, _, lefts, rights = peak_widths(self.y, peak_idxes)
+        widths, lefts, rights = properties["widths"], properties["left_ips"], properties["right_ips"]
         is_spikes = widths < width
         if verbose:
             print(
@@ -213,13 +285,9 @@ class Sample:
                     sep="\t",
                 )
 
-        spike_region: list[np.ndarray] = []
-        for left, right in zip(lefts[is_spikes], rights[is_spikes]):
-
-            window = np.arange(np.floor(left) - 1, np.ceil(right) + 1, dtype=np.int64)
-            spike_region.append(window)
-
-        return spike_region
+        starts = np.floor(lefts[is_spikes]).astype(np.int64) - 1
+        stops = np.ceil(rights[is_spikes]).astype(np.int64) + 1
+        return [np.arange(start, stop, dtype=np.int64) for start, stop in zip(starts, stops)]
 
     def remove_spike(
         self, auto: bool = True, spike_regions: list[np.ndarray] | None = None
@@ -246,6 +314,15 @@ class Sample:
         if isinstance(spike_regions, type(None)):
             raise ValueError(f"spike_regions is None. This should not happen.")
 
+        if len(spike_regions) > 0 and self.y.flags.writeable == False:
+            # copy-on-write, the original data is read-only
+            self.y = self.y.copy()
+        if all(len(region) > 0 and (np.diff(region) == 1).all() for region in spike_regions):
+            # Contiguous regions (as found by `find_spike`) are interpolated by the kernel, with the same result
+            starts = np.array([region[0] for region in spike_regions], dtype=np.int64)
+            stops = np.array([region[-1] + 1 for region in spike_regions], dtype=np.int64)
+            kernels.repair_spikes(self.y[None, :], np.zeros_like(starts), starts, stops)
+            return
         for spike_region in spike_regions:
             # create interpolate_window from left and right of the spike_region
             left = spike_region - len(spike_region)
@@ -257,9 +334,10 @@ class Sample:
             )
             self.y[spike_region] = corrector(spike_region)
 
+    @memoized_method
     def despike(self, window_length: str | int = "auto", threshold: int = 3):
         """
-        The wrapper of rampy.spectranization.despiking
+        The `rampy.spectranization.despiking` algorithm, run by `raman.kernels.despike`.
 
         Parameters
         ----------
@@ -275,8 +353,9 @@ class Sample:
                     f"window_length should be 'auto' or integer. Got {window_length=}"
                 )
             window_length = int(5 / self._dx)
-        self.y = despiking(self.x, self.y, neigh=window_length, threshold=threshold)
+        self.y = kernels.despike(self.y, neigh=window_length, threshold=threshold)[0]
 
+    @memoized_method
     def interpolate(self, step: float):
         """
         Use to interpolate with `scipy.interpolate.CubicSpline` the signal.
@@ -288,12 +367,13 @@ class Sample:
         """
         minx = np.floor(self.x.min())
         maxx = np.ceil(self.x.max())
-        new_x = np.arange(minx, maxx + step, step=step)
+        new_x = arange_axis(minx, maxx + step, step=step, dtype=self._dtype)
         y_interp = CubicSpline(self.x, self.y, bc_type="natural")
         self.y = y_interp(new_x)
         self.x = new_x
         self._dx = step
 
+    @memoized_method
     def normalized(self, method: str = "minmax"):
         """
         This will perform normalization on Sample.y
@@ -313,6 +393,7 @@ class Sample:
                 f"method={method} is not supported. Use 'minmax' or 'zscore'. "
             )
 
+    @memoized_method
     def smoothing(
         self, window_length: str | int = "auto", polyorder=2, test: bool = False
     ) -> np.ndarray:
@@ -338,39 +419,55 @@ class Sample:
                 )
             window_length = int(30 / self._dx)
 
-        y = deepcopy(self.y)
-        y = savgol_filter(x=y, window_length=window_length, polyorder=polyorder)
+        y = savgol_filter(x=self.y, window_length=window_length, polyorder=polyorder)
         if test == False:
             self.y = y
         return y
 
-    ######### Test this #########
-
+    @memoized_method
     def baseline(
-        self, order: int, roi: np.ndarray | None = None, test: bool = False
+        self,
+        order: int = 1,
+        roi: np.ndarray | None = None,
+        test: bool = False,
+        method: str = "poly",
+        **kwargs,
     ) -> np.ndarray:
         """
-        This is the wrapper for rampy.baseline and will only use method='poly'
+        Fit the baseline of sample.y and subtract it. See `raman.baseline` for the batched engine.
 
         Parameters
         ----------
         order : int
-            The order of the polynomial to fit the baseline.
+            Only for method='poly'. The order of the polynomial to fit the baseline.
+        roi : NDArray of shape (n_regions, 2) or None
+            Only for method='poly'. Each row is a [low, high] Raman Shift range to fit the baseline on.
+            Default is None, which uses the whole range.
+        test : bool
+            Default is False.
+            When this is True, the baseline will not be subtracted from the sample.y.
+        method : str
+            'poly' fits a polynomial on `roi`.
+            'asls' or 'arpls' fits a penalized least squares baseline. `kwargs` are passed to `raman.baseline.als_baseline`.
+
         Returns
         -------
         NDArray :
             The baseline of the sample.y
         """
-        if order < 1:
-            raise ValueError(f"order must be greater than 0. Got {order=}")
-        if roi is None:
-            roi = self.x
-
-        y = baseline(self.x, self.y, method="poly", order=order, roi=roi)
+        if method == "poly":
+            y = poly_baseline(self.x, self.y, order=order, roi=roi)
+        elif method in ["asls", "arpls"]:
+            y = als_baseline(self.y, method=method, **kwargs)
+        else:
+            raise ValueError(
+                f"method={method} is not supported. Use 'poly', 'asls' or 'arpls'. "
+            )
         if test == False:
-            self.y = y
+            self.y = self.y - y
         return y
 
+    @memoized_method
     def extract_range(self, low: float, high: float):
         """
         Use to extract Raman Shift range [low, high]
@@ -401,21 +498,36 @@ class Sample:
             raise TypeError(
                 f"sample must be type={type(self)}. sample is type={type(sample)}"
             )
-        a = self.x
-        b = sample.x
-
-        if a.shape != b.shape:
-            return False
-
-        return bool((a == b).all())
+        return same_axis(self.x, sample.x)
+
+    def __setstate__(self, state):
+        # Unpickled or deep-copied samples keep the read-only original and re-intern their axes.
+        _, slots = state
+        for key, value in slots.items():
+            object.__setattr__(self, key, value)
+        if getattr(self, "_y", None) is not None:
+            self._y.setflags(write=False)
+        for key in ["_x", "_cur_x"]:
+            if getattr(self, key, None) is not None:
+                object.__setattr__(self, key, intern_axis(getattr(self, key)))
+
+    def _copy(self) -> Self:
+        """
+        A shallow copy that shares the (read-only) original data and the current arrays.
+        Every operation that returns a new `Sample` assigns a new `y` instead of writing in place.
+        """
+        new_sample = copy(self)
+        new_sample.paths = set(self.paths)
+        new_sample.meta = dict(self.meta)
+        return new_sample
 
     def __radd__(self, b) -> Self:
         return self.__add__(b)
 
     def __add__(self, b: Self) -> Self:
         if isinstance(b, int):
-            new_sample = deepcopy(self)
-            new_sample.y += b
+            new_sample = self._copy()
+            new_sample.y = new_sample.y + b
             return new_sample
 
         if isinstance(b, Sample) == False:
@@ -426,8 +538,8 @@ class Sample:
         if self.is_same_range(b) == False:
             raise ValueError(f"Expect both a + b to have the same Raman Shift range.")
 
-        new_sample = deepcopy(self)
-        new_sample.y += b.y
+        new_sample = self._copy()
+        new_sample.y = new_sample.y + b.y
         new_sample.exposure += b.exposure
         new_sample.paths = new_sample.paths.union(b.paths)
         return new_sample
@@ -437,8 +549,8 @@ class Sample:
 
     def __mul__(self, b: float) -> Self:
         if isinstance(b, float):
-            new_sample = deepcopy(self)
-            new_sample.y *= b
+            new_sample = self._copy()
+            new_sample.y = new_sample.y * b
             return new_sample
         else:
             raise TypeError(f"Expect a * b to be type={float}. b is type={type(b)}")
@@ -458,7 +570,7 @@ class Sample:
         if self.exposure != b.exposure:
             raise ValueError(f"Expect both a | b to have the same exposure.")
 
-        new_sample = deepcopy(self)
+        new_sample = self._copy()
         acc1 = self.accumulation
         acc2 = b.accumulation
         y1 = acc1 * self.y
@@ -490,7 +602,12 @@ class Sample:
         plt.plot(self.x, self.y, label=label, alpha=0.8, linewidth=0.8, color=color)  # type: ignore
 
     def __getitem__(self, idx):
-        return self.data[idx]
+        # Index `x` and `y` directly so that only the selected part is copied.
+        if isinstance(idx, tuple) and len(idx) == 2 and isinstance(idx[1], (int, np.integer)):
+            return (self.x, self.y)[idx[1]][idx[0]]
+        if isinstance(idx, tuple):
+            return self.data[idx]
+        return np.stack([self.x[idx], self.y[idx]], axis=-1)
 
     def __repr__(self) -> str:
         return self.__str__()
@@ -524,24 +641,71 @@ def _load_raman_from_txt(path: Path) -> tuple[np.ndarray, np.ndarray]:
     return deepcopy(measure[:, 0]), deepcopy(measure[:, 1])
 
 
+NAME_FORMAT: list[str] = [
+    "name",
+    "lens",
+    "power",
+    "grating",
+    "laser",
+    "exposure",
+    "accumulation",
+    "year",
+    "month",
+    "date",
+    "hour",
+    "minute",
+    "second",
+    "01",
+]
+
+
+def parse_filename(path: str | Path, name_format: list[str] = NAME_FORMAT) -> dict:
+    """
+    Parse the metadata of a .txt file exported from Horiba LS6 software from its filename.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        A path (or filename) of the .txt file.
+    name_format : list of str, optional
+        A list indicates the naming scheme of the file. See `read_txt`.
+
+    Returns
+    -------
+    dict :
+        The metadata with the same keys as the `Sample` attributes (`name`, `exposure`, ..., `date`).
+    """
+    # 24_600_785 nm_60 s_1_2024_03_19_10_30_09_01
+    # 24_5x_0-71_600_785 nm_60 s_1_2024_03_19_10_30_09_01
+    filename: str = os.path.splitext(Path(path).name)[0]
+    values: list[str] = filename.split("_")
+    if len(values) != len(name_format):
+        raise ValueError(
+            f"name_format ({len(name_format)}) is not match the filename ({len(values)}) after split.\nname_format={name_format}.\nfilename={values}"
+        )
+
+    metadata: dict = {}
+    datetime_str: list[str] = []
+    for key, value in zip(name_format, values):
+        if key in ["year", "month", "date", "hour", "minute", "second"]:
+            datetime_str.append(value)
+        else:
+            if key in ["exposure"]:
+                value = int(value.split(" ")[0])  # type: ignore
+            elif key in ["power", "slit"]:
+                value = float(value.replace("-", "."))  # type: ignore
+            elif key in ["accumulation"]:
+                value = int(value)  # type: ignore
+            elif key == "01":
+                continue
+            metadata[key] = value
+    metadata["date"] = datetime.strptime("".join(datetime_str), "%Y%m%d%H%M%S")
+    return metadata
+
+
 def read_txt(
     path: str | Path,
-    name_format: list[str] = [
-        "name",
-        "lens",
-        "power",
-        "grating",
-        "laser",
-        "exposure",
-        "accumulation",
-        "year",
-        "month",
-        "date",
-        "hour",
-        "minute",
-        "second",
-        "01",
-    ],
+    name_format: list[str] = NAME_FORMAT,
     interpolate: bool = True,
     verbose: bool = False,
 ) -> Sample:
@@ -554,7 +718,7 @@ def read_txt(
         A path to the .txt file. Could be either `str` or `pathlib.Path`
     name_format : list of str, optional
         A list indicates the naming scheme of the file.
-        Default naming scheme is `name_grating_laser_exposure_accumelation_year_month_date_hour_minute_second_01`.
+        Default naming scheme is `name_lens_power_grating_laser_exposure_accumelation_year_month_date_hour_minute_second_01`.
     interpolate : bool
         Default is True.
         This will pass to the Sample(interpolate). It indicates whether you want to perform interpolation during object creation or not.
@@ -572,43 +736,195 @@ def read_txt(
     if path.exists() == False:  # type: ignore
         raise FileNotFoundError(f"Path={path.as_posix()} is not exist.")  # type: ignore
 
-    # 24_600_785 nm_60 s_1_2024_03_19_10_30_09_01
-    # 24_5x_0-71_600_785 nm_60 s_1_2024_03_19_10_30_09_01
-    filename: str = os.path.splitext(path.name)[0]  # type: ignore
-    values: list[str] = filename.split("_")
-    if len(values) != len(name_format):
-        raise ValueError(
-            f"name_format ({len(name_format)}) is not match the filename ({len(values)}) after split.\nname_format={name_format}.\nfilename={values}"
-        )
+    metadata = parse_filename(path, name_format=name_format)
 
     x, y = _load_raman_from_txt(path=path)  # type: ignore
 
     sample = Sample(x=x, y=y, path=path, interpolate=interpolate, verbose=verbose)
-
-    datetime_str: list[str] = []
-    for key, value in zip(name_format, values):
-        if key in ["year", "month", "date", "hour", "minute", "second"]:
-            datetime_str.append(value)
-        else:
-            if key in ["exposure"]:
-                value = int(value.split(" ")[0])  # type: ignore
-            elif key in ["power"]:
-                value = float(value.replace("-", "."))  # type: ignore
-            elif key in ["accumulation"]:
-                value = int(value)  # type: ignore
-            elif key == "01":
-                continue
+    for key, value in metadata.items():
+        if key in Sample.__slots__:
             sample.__setattr__(key, value)
-    sample.__setattr__("date", datetime.strptime("".join(datetime_str), "%Y%m%d%H%M%S"))
+        else:
+            sample.meta[key] = value
     return sample
 
 
 def accumulate(samples: list[Sample]) -> Sample:
+    """
+    `samples[0] | samples[1] | ...` in one weighted sum (`weights @ Y`) instead of pairwise.
+    """
     if isinstance(samples, list) == False:
         raise TypeError(f"Method expect list[Sample] but got {type(samples)}")
     if len(samples) == 1:
         return samples[0]
-    return reduce(lambda a, b: a | b, samples)
+    first = samples[0]
+    for sample in samples[1:]:
+        if isinstance(sample, Sample) == False:
+            raise TypeError(f"Expect a | b to be type={type(first)}. b is type={type(sample)}")
+        if first.is_same_range(sample) == False:
+            raise ValueError(f"Expect both a | b to have the same Raman Shift range.")
+        if first.exposure != sample.exposure:
+            raise ValueError(f"Expect both a | b to have the same exposure.")
+    weights = np.array([sample.accumulation for sample in samples], dtype=np.float64)
+    new_sample = first._copy()
+    new_sample.y = (weights @ np.vstack([sample.y for sample in samples])) / weights.sum()
+    new_sample.accumulation = sum(sample.accumulation for sample in samples)
+    new_sample.paths = set().union(*[sample.paths for sample in samples])
+    return new_sample
+
+
+def _factorize(keys: Iterable) -> tuple[NDArray[np.int64], list]:
+    # The code of every key in the sorted list of the distinct keys
+    if isinstance(keys, np.ndarray) and keys.dtype.kind in "biufUSM":
+        uniques, codes = np.unique(keys, return_inverse=True)
+        return codes.reshape(-1), uniques.tolist()
+    index: dict[Any, int] = {}
+    codes = np.fromiter((index.setdefault(key, len(index)) for key in keys), dtype=np.int64)
+    uniques = sorted(index, key=_sort_key)
+    rank = np.empty(len(uniques), dtype=np.int64)
+    rank[[index[key] for key in uniques]] = np.arange(len(uniques))
+    return rank[codes], uniques
+
+
+def _sort_key(key: Any) -> tuple:
+    # None sorts first; tuple keys are compared field by field
+    if isinstance(key, tuple):
+        return tuple(map(_sort_key, key))
+    return (key is not None, key)
+
+
+def grouped_mean(
+    Y: NDArray[np.float64],
+    keys: Iterable,
+    weights: NDArray[np.float64] | None = None,
+) -> tuple[NDArray, NDArray[np.float64], NDArray[np.float64], list[NDArray[np.int64]]]:
+    """
+    The weighted mean spectrum of every group of rows of a stack, in one segmented reduction.
+
+    The rows are summed per group in one pass by `raman.kernels.weighted_sum` (with NumPy, one matrix product for
+    up to 256 groups, otherwise a sort by group and `np.add.reduceat`), whatever the order of the input.
+
+    Parameters
+    ----------
+    Y : NDArray of shape (n_spectra, n_shifts)
+        The intensity of the spectra, sharing the same Raman Shift.
+    keys : iterable of shape (n_spectra, )
+        The group of every row (any hashable value, for example the name or a (name, glucose) tuple).
+    weights : NDArray of shape (n_spectra, ) or None
+        The weight of every row, for example the accumulation. Default is None, which weights every row 1.
+
+    Returns
+    -------
+    NDArray of shape (n_groups, ) :
+        The group keys, sorted.
+    NDArray of shape (n_groups, n_shifts) :
+        The weighted mean of every group: sum(w * y) / sum(w).
+    NDArray of shape (n_groups, ) :
+        The total weight of every group.
+    list of NDArray :
+        The rows of every group, in the input order.
+    """
+    Y = np.atleast_2d(Y)
+    codes, uniques = _factorize(keys)
+    if codes.shape[0] != Y.shape[0]:
+        raise ValueError(f"Expect one key per spectrum. Got {codes.shape[0]} keys for {Y.shape[0]} spectra.")
+    weights = np.ones(Y.shape[0]) if weights is None else np.asarray(weights, dtype=np.float64)
+    order = np.argsort(codes, kind="stable")
+    starts = np.flatnonzero(np.r_[True, np.diff(codes[order]) != 0]) if order.shape[0] > 0 else np.array([], dtype=np.int64)
+    sums, totals = kernels.weighted_sum(Y, codes, weights, len(uniques))
+    group_keys = np.empty(len(uniques), dtype=object)
+    group_keys[:] = uniques
+    return group_keys, sums / totals[:, None], totals, np.split(order, starts[1:])
+
+
+def accumulate_groups(
+    samples: list[Sample], key: Callable[[Sample], Any] = lambda sample: sample.name, sort: bool = False
+) -> list[Sample]:
+    """
+    Accumulate the samples of every group like `accumulate` (`a | b`), without sorting the input first.
+    The accumulation-weighted means of all groups are computed together with `grouped_mean`.
+
+    Parameters
+    ----------
+    samples : list of Sample
+        The samples. Samples of the same group must share the same Raman Shift and exposure.
+    key : callable
+        The group of a sample. Default is its name.
+    sort : bool
+        Default is False, which returns the groups in order of first appearance, like `itertools.groupby`
+        on grouped input, so the result stays aligned with lists built in acquisition order.
+        True sorts the groups by key (note that str keys sort "s1_10" before "s1_2").
+
+    Returns
+    -------
+    list of Sample :
+        One sample per group. It keeps the fields of the first sample of the group with
+        the total `accumulation`, the union of the `paths`, and `meta['first_date']`, `meta['last_date']`
+        and `meta['n']` (the number of merged samples).
+    """
+    if len(samples) == 0:
+        return []
+    keys = [key(sample) for sample in samples]
+    groups = axis_groups(samples)
+    # Group per (key, axis) so the stack is only built from samples sharing the Raman Shift
+    rows = {id(sample): i for i, sample in enumerate(samples)}
+    merged: list[tuple[Any, int, Sample]] = []
+    for members in groups.values():
+        indices = [rows[id(sample)] for sample in members]
+        _, Y = stack(members)
+        weights = np.array([getattr(sample, "accumulation", 1) for sample in members], dtype=np.float64)
+        group_keys, means, totals, parts = grouped_mean(Y, [keys[i] for i in indices], weights=weights)
+        for group_key, mean, total, part in zip(group_keys, means, totals, parts):
+            group = [members[i] for i in part]
+            first = group[0]
+            exposures = {getattr(sample, "exposure", None) for sample in group}
+            if len(exposures) > 1:
+                raise ValueError(f"Expect the samples of group {group_key} to have the same exposure. Got {exposures}")
+            new_sample = first._copy()
+            new_sample.y = mean
+            new_sample.accumulation = int(total) if float(total).is_integer() else float(total)
+            new_sample.paths = set().union(*[sample.paths for sample in group])
+            dates = [sample.date for sample in group if getattr(sample, "date", None) is not None]
+            if len(dates) > 0:
+                new_sample.meta["first_date"] = min(dates)
+                new_sample.meta["last_date"] = max(dates)
+            new_sample.meta["n"] = len(group)
+            merged.append((group_key, indices[part[0]], new_sample))
+    positions = [position for _, position, _ in merged]
+    if sort:
+        order = _factorize([group_key for group_key, _, _ in merged])[0]
+    else:
+        # The first position of every key, as a group may span several axes
+        first: dict[Any, int] = {}
+        for group_key, position, _ in merged:
+            first[group_key] = min(first.get(group_key, position), position)
+        order = np.array([first[group_key] for group_key, _, _ in merged], dtype=np.int64)
+    return [merged[i][2] for i in np.lexsort((positions, order))]
+
+
+def stack(samples: list[Sample]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Stack the intensity of `samples` that share the same Raman Shift into one array.
+
+    Parameters
+    ----------
+    samples : list of Sample
+        The samples to stack. All of them must have the same Raman Shift range.
+
+    Returns
+    -------
+    NDArray of shape (n_shifts, ) :
+        The shared Raman Shift.
+    NDArray of shape (n_samples, n_shifts) :
+        The intensity of every sample, one row per sample.
+    """
+    if len(samples) == 0:
+        raise ValueError(f"samples must not be empty.")
+    first = samples[0]
+    for sample in samples[1:]:
+        if first.is_same_range(sample) == False:
+            raise ValueError(f"Expect all samples to have the same Raman Shift range.")
+    return first.x, np.vstack([sample.y for sample in samples])
 
 
 # if __name__ == '__main__':
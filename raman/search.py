@@ -0,0 +1,383 @@
+"""
+Similarity search over a library of spectra.
+
+Every spectrum added to a `SpectrumIndex` is resampled to the common Raman Shift of the index, normalized
+for the chosen metric and (optionally) projected on a few principal components. A query is then a single
+matrix product against the library, so cosine, correlation and spectral angle (SAM) distances of many
+queries against 100k+ entries are computed in one pass, chunk by chunk, with a partial sort for the top k.
+"""
+from raman.sample import Sample, read_txt, NAME_FORMAT
+from raman.axis import intern_axis, axis_groups
+
+import numpy as np
+from numpy.typing import NDArray
+from scipy.interpolate import interp1d  # type: ignore
+
+from pathlib import Path
+from typing import Any, Iterable, Self
+
+METRICS: list[str] = ["cosine", "correlation", "sam"]
+
+
+def resample(x: NDArray, Y: NDArray, axis: NDArray) -> NDArray:
+    """
+    Linearly resample spectra to `axis`. Shifts outside of `x` take the value at the nearest end.
+
+    Parameters
+    ----------
+    x : NDArray of shape (n_shifts, )
+        The Raman Shift of the spectra, in increasing order.
+    Y : NDArray of shape (n_spectra, n_shifts)
+        The intensity of the spectra.
+    axis : NDArray of shape (n_axis, )
+        The target Raman Shift.
+
+    Returns
+    -------
+    NDArray of shape (n_spectra, n_axis)
+    """
+    Y = np.atleast_2d(Y)
+    if x.shape == axis.shape and (x is axis or bool((x == axis).all())):
+        return Y
+    return interp1d(x, Y, axis=1, assume_sorted=True)(np.clip(axis, x[0], x[-1]))
+
+
+class SpectrumIndex:
+    """
+    A growing library of spectra on one Raman Shift, searchable by cosine, correlation or SAM distance.
+
+    - 'cosine' : 1 - cos(a, b).
+    - 'correlation' : 1 - Pearson correlation, i.e. the cosine of the mean-centered spectra.
+    - 'sam' : the spectral angle arccos(cos(a, b)) in radians.
+
+    With `n_components`, the normalized spectra are projected on their first principal directions
+    (fitted on the first `add`, or explicitly with `fit`), which keeps the library small and the queries fast.
+    Later spectra are projected on the same directions, so the index grows without rebuilding.
+
+    Parameters
+    ----------
+    x : NDArray of shape (n_shifts, )
+        The common Raman Shift every spectrum is resampled to.
+    metric : str
+        One of 'cosine', 'correlation' or 'sam'.
+    n_components : int or None
+        Default is None, which keeps the full spectra.
+    dtype : type or np.dtype
+        The dtype of the stored library. Default is `np.float32`.
+    chunk_rows : int
+        Number of library entries scored at a time by `query`, which bounds the memory of a query.
+
+    Examples
+    --------
+    >>> index = SpectrumIndex.from_files(Path("data/SERs/txt").glob("*.txt"), x=np.arange(400, 1800, 1.0))
+    >>> distances, indices = index.query(sample, k=5)
+    >>> [index.labels[i] for i in indices[0]]
+    """
+
+    def __init__(
+        self,
+        x: NDArray,
+        metric: str = "cosine",
+        n_components: int | None = None,
+        dtype: type | np.dtype = np.float32,
+        chunk_rows: int = 65536,
+    ):
+        if metric not in METRICS:
+            raise ValueError(f"Expect metric to be one of {METRICS}. Got {metric=}")
+        self.x: NDArray = intern_axis(np.asarray(x, dtype=np.float64))
+        self.metric: str = metric
+        self.n_components: int | None = n_components
+        self.dtype: np.dtype = np.dtype(dtype)
+        self.chunk_rows: int = chunk_rows
+        self.components: NDArray | None = None
+        self.labels: list[Any] = []
+        self._data: NDArray = np.empty((0, self.width), dtype=self.dtype)
+        self._n: int = 0
+
+    @property
+    def width(self) -> int:
+        """
+        Number of values stored per entry.
+        """
+        return self.x.shape[0] if self.n_components is None else self.n_components
+
+    @property
+    def data(self) -> NDArray:
+        """
+        The (normalized, projected) library, of shape (len(self), width).
+        """
+        return self._data[: self._n]
+
+    def __len__(self) -> int:
+        return self._n
+
+    def _normalize(self, Y: NDArray) -> NDArray:
+        Y = np.array(Y, dtype=np.float64)
+        if self.metric == "correlation":
+            Y -= Y.mean(axis=1, keepdims=True)
+        norm = np.linalg.norm(Y, axis=1, keepdims=True)
+        norm[norm == 0] = 1
+        return Y / norm
+
+    def _encode(self, Y: NDArray) -> NDArray:
+        Y = self._normalize(Y)
+        if self.n_components is not None:
+            if self.components is None:
+                self.fit(Y, normalized=True)
+            # Projecting on orthonormal directions keeps the dot products, up to the dropped components.
+            Y = Y @ self.components.T  # type: ignore
+            norm = np.linalg.norm(Y, axis=1, keepdims=True)
+            norm[norm == 0] = 1
+            Y /= norm
+        return Y.astype(self.dtype, copy=False)
+
+    def fit(self, Y: NDArray, normalized: bool = False) -> Self:
+        """
+        Fit the principal directions used with `n_components` on spectra already on `self.x`.
+        Entries already in the index are projected with the previous directions, so call it before `add`.
+
+        Parameters
+        ----------
+        Y : NDArray of shape (n_spectra, n_shifts)
+            The spectra, at least `n_components` of them.
+        normalized : bool
+            Default is False. True if `Y` is already normalized for the metric.
+        """
+        if self.n_components is None:
+            raise ValueError(f"fit is only used with n_components.")
+        if self._n > 0:
+            raise ValueError(f"Cannot change the principal directions of an index of {self._n} entries.")
+        if normalized == False:
+            Y = self._normalize(Y)
+        if Y.shape[0] < self.n_components:
+            raise ValueError(f"Expect at least n_components={self.n_components} spectra to fit. Got {Y.shape[0]}")
+        # No mean removal: the directions must keep the dot products (the cosine) of the normalized spectra.
+        _, _, Vt = np.linalg.svd(Y, full_matrices=False)
+        self.components = Vt[: self.n_components]
+        return self
+
+    def _resample_samples(self, samples: list[Sample]) -> NDArray:
+        Y = np.empty((len(samples), self.x.shape[0]), dtype=np.float64)
+        position = {id(sample): i for i, sample in enumerate(samples)}
+        for group in axis_groups(samples).values():
+            rows = [position[id(sample)] for sample in group]
+            Y[rows] = resample(group[0].x, np.vstack([sample.y for sample in group]), self.x)
+        return Y
+
+    def _as_array(self, spectra: NDArray | Sample | list[Sample], x: NDArray | None) -> NDArray:
+        if isinstance(spectra, Sample):
+            spectra = [spectra]
+        if isinstance(spectra, list) and len(spectra) > 0 and isinstance(spectra[0], Sample):
+            return self._resample_samples(spectra)  # type: ignore
+        Y = np.atleast_2d(np.asarray(spectra, dtype=np.float64))
+        if x is not None:
+            Y = resample(np.asarray(x), Y, self.x)
+        if Y.shape[1] != self.x.shape[0]:
+            raise ValueError(f"Expect spectra with {self.x.shape[0]} shifts (or pass `x`). Got shape={Y.shape}")
+        return Y
+
+    def add(
+        self, spectra: NDArray | Sample | list[Sample], labels: Iterable[Any] | None = None, x: NDArray | None = None
+    ) -> NDArray:
+        """
+        Add spectra to the library.
+
+        Parameters
+        ----------
+        spectra : Sample, list of Sample or NDArray of shape (n_spectra, n_shifts)
+            Samples are resampled to `self.x`. An array is taken as is, or resampled from `x` when given.
+        labels : iterable or None
+            One label per spectrum (for example a name, a path or a database id).
+            Default is None, which uses `sample.name` for samples and the entry number otherwise.
+        x : NDArray or None
+            The Raman Shift of an array of spectra.
+
+        Returns
+        -------
+        NDArray of int :
+            The entry numbers of the added spectra.
+        """
+        Y = self._encode(self._as_array(spectra, x))
+        n = Y.shape[0]
+        if labels is None:
+            if isinstance(spectra, Sample):
+                labels = [spectra.name]
+            elif isinstance(spectra, list) and n > 0 and isinstance(spectra[0], Sample):
+                labels = [sample.name for sample in spectra]
+            else:
+                labels = range(self._n, self._n + n)
+        labels = list(labels)
+        if len(labels) != n:
+            raise ValueError(f"Expect {n} labels. Got {len(labels)}")
+
+        if self._n + n > self._data.shape[0]:
+            # Grow geometrically so that adding one spectrum at a time stays amortized O(1).
+            grown = np.empty((max(self._n + n, 2 * self._data.shape[0], 64), self.width), dtype=self.dtype)
+            grown[: self._n] = self.data
+            self._data = grown
+        self._data[self._n : self._n + n] = Y
+        self.labels += labels
+        self._n += n
+        return np.arange(self._n - n, self._n)
+
+    def _distance(self, similarity: NDArray) -> NDArray:
+        if self.metric == "sam":
+            return np.arccos(np.clip(similarity, -1, 1))
+        return 1 - similarity
+
+    def query(
+        self,
+        spectra: NDArray | Sample | list[Sample],
+        k: int = 5,
+        x: NDArray | None = None,
+        mask: NDArray | None = None,
+    ) -> tuple[NDArray, NDArray]:
+        """
+        Find the `k` nearest library entries of every query spectrum.
+
+        Parameters
+        ----------
+        spectra : Sample, list of Sample or NDArray of shape (n_queries, n_shifts)
+            The query spectra, resampled like in `add`.
+        k : int
+            Number of neighbours.
+        x : NDArray or None
+            The Raman Shift of an array of spectra.
+        mask : NDArray of bool of shape (len(self), ) or None
+            Only search the entries where `mask` is True (for example the entries of one subject).
+
+        Returns
+        -------
+        NDArray of shape (n_queries, k) :
+            The distances, from the nearest.
+        NDArray of int of shape (n_queries, k) :
+            The entry numbers (index into `self.labels`), from the nearest.
+        """
+        if self._n == 0:
+            raise ValueError(f"The index is empty.")
+        Q = self._encode(self._as_array(spectra, x))
+        candidates = np.arange(self._n) if mask is None else np.flatnonzero(np.asarray(mask)[: self._n])
+        k = min(k, candidates.shape[0])
+        if k == 0:
+            raise ValueError(f"mask does not select any entry.")
+
+        best_score = np.full((Q.shape[0], 0), -np.inf, dtype=self.dtype)
+        best_index = np.empty((Q.shape[0], 0), dtype=np.int64)
+        for start in range(0, candidates.shape[0], self.chunk_rows):
+            rows = candidates[start : start + self.chunk_rows]
+            block = self.data[rows] if mask is not None else self.data[rows[0] : rows[-1] + 1]
+            score = np.concatenate([best_score, Q @ block.T], axis=1)
+            index = np.concatenate([best_index, np.broadcast_to(rows, (Q.shape[0], rows.shape[0]))], axis=1)
+            top = np.argpartition(-score, k - 1, axis=1)[:, :k] if score.shape[1] > k else np.argsort(-score, axis=1)
+            best_score = np.take_along_axis(score, top, axis=1)
+            best_index = np.take_along_axis(index, top, axis=1)
+        order = np.argsort(-best_score, axis=1)
+        best_score = np.take_along_axis(best_score, order, axis=1)
+        best_index = np.take_along_axis(best_index, order, axis=1)
+        return self._distance(best_score.astype(np.float64)), best_index
+
+    def distances(self, spectra: NDArray | Sample | list[Sample], x: NDArray | None = None) -> NDArray:
+        """
+        The distance of every query spectrum to every library entry, of shape (n_queries, len(self)).
+        """
+        Q = self._encode(self._as_array(spectra, x))
+        return self._distance((Q @ self.data.T).astype(np.float64))
+
+    ############# Building and persistence #############
+
+    @classmethod
+    def from_samples(cls, samples: list[Sample], x: NDArray | None = None, labels: Iterable[Any] | None = None, **kwargs) -> Self:
+        """
+        Build an index from samples. Default `x` is the Raman Shift of the first sample.
+        """
+        if len(samples) == 0:
+            raise ValueError(f"samples must not be empty.")
+        index = cls(x=samples[0].x if x is None else x, **kwargs)
+        index.add(samples, labels=labels)
+        return index
+
+    @classmethod
+    def from_files(
+        cls,
+        paths: Iterable[str | Path],
+        x: NDArray | None = None,
+        name_format: list[str] = NAME_FORMAT,
+        batch_size: int = 1024,
+        **kwargs,
+    ) -> Self:
+        """
+        Build an index from .txt files, reading `batch_size` files at a time. Entries are labelled by path.
+        """
+        index: Self | None = None
+        batch: list[Sample] = []
+
+        def flush():
+            nonlocal index
+            if index is None:
+                index = cls(x=batch[0].x if x is None else x, **kwargs)
+            index.add(batch, labels=[next(iter(sample.paths)).as_posix() for sample in batch])
+            batch.clear()
+
+        for path in paths:
+            batch.append(read_txt(path, name_format=name_format, interpolate=False))
+            if len(batch) == batch_size:
+                flush()
+        if len(batch) > 0:
+            flush()
+        if index is None:
+            raise ValueError(f"paths must not be empty.")
+        return index
+
+    @classmethod
+    def from_collection(
+        cls, kind: str = "reference", query: dict | None = None, x: NDArray | None = None, **kwargs
+    ) -> Self:
+        """
+        Build an index from a `raman.spectra` collection ('finger', 'blood' or 'reference').
+        Entries are labelled by the database `_id`. Needs the MongoDB of `raman.database`.
+        """
+        from raman.spectra import iter_samples  # Connects to the database on import
+
+        samples = list(iter_samples(kind=kind, query=query))
+        if len(samples) == 0:
+            raise ValueError(f"No {kind} spectrum matches {query=}")
+        ids = [sample.meta["_id"] for sample in samples]
+        return cls.from_samples(samples, x=x, labels=ids, **kwargs)
+
+    def save(self, path: str | Path):
+        """
+        Save the index to a .npz file. Labels are stored as strings.
+        """
+        np.savez(
+            path,
+            x=self.x,
+            data=self.data,
+            labels=np.array([str(label) for label in self.labels]),
+            components=np.empty((0, 0)) if self.components is None else self.components,
+            metric=self.metric,
+            n_components=-1 if self.n_components is None else self.n_components,
+        )
+
+    @classmethod
+    def load(cls, path: str | Path, **kwargs) -> Self:
+        """
+        Load an index written by `save`.
+        """
+        with np.load(path) as file:
+            n_components = int(file["n_components"])
+            index = cls(
+                x=file["x"],
+                metric=str(file["metric"]),
+                n_components=None if n_components < 0 else n_components,
+                dtype=file["data"].dtype,
+                **kwargs,
+            )
+            if index.n_components is not None:
+                index.components = file["components"]
+            index._data = file["data"].copy()
+            index._n = index._data.shape[0]
+            index.labels = file["labels"].tolist()
+        return index
+
+    def __repr__(self) -> str:
+        return f"SpectrumIndex(n={self._n}, shifts={self.x.shape[0]}, metric={self.metric}, n_components={self.n_components})"
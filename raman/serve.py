@@ -0,0 +1,361 @@
+"""
+A local glucose estimation service.
+
+`GlucoseEstimator` holds the references and the fitted regression, loaded once, and turns a batch of raw spectra
+into glucose estimates in one vectorized pass: resampling to the model Raman Shift, Savitzky-Golay smoothing,
+min-max normalization, batched EMSC (`raman.model.EMSC.correct_batch`) and prediction.
+
+`serve` runs an asyncio HTTP server (standard library only, bound to localhost by default). Concurrent requests are
+gathered by a `MicroBatcher` into batches of up to `max_batch` spectra, waiting at most `max_delay` seconds.
+
+    POST /predict   {"x": [...], "y": [...]}, {"spectra": [{"x": [...], "y": [...]}, ...]} or a raw .txt file
+                    A glucose that cannot be estimated (for example a flat spectrum) is null.
+    GET  /metrics   request and batch counters, queue depth and latency percentiles
+    GET  /health
+"""
+from raman.sample import Sample
+from raman.model import EMSC
+from raman.helper import parse_spectrum
+from raman.axis import arange_axis
+from raman.references import get_reference
+
+import numpy as np
+from numpy.typing import NDArray
+from scipy.signal import savgol_filter  # type: ignore
+
+import asyncio
+import json
+from collections import deque
+from time import perf_counter
+from typing import Any, Callable
+
+
+class GlucoseEstimator:
+    """
+    Preprocessing, EMSC correction and regression of spectra, batched.
+
+    Parameters
+    ----------
+    model : object with `predict`
+        The fitted regression, for example a `raman.model.IncrementalPLS`, taking the corrected spectra on `x`.
+    references : list of Sample or str
+        The EMSC references. The first one is the analyte (see `raman.model.EMSC`). A str is the name of a reference
+        in the database or a .txt file, read through `raman.references`.
+    x : NDArray or None
+        The Raman Shift of the model. Default is None, which uses `model.raman_shift`.
+    order : int
+        The polynomial order of the EMSC baseline.
+    window_length : int
+        The window of the Savitzky-Golay smoothing, in samples of `x`. Default is 30 cm⁻¹ like `Sample.smoothing`.
+    polyorder : int
+        The polynomial order of the smoothing.
+    """
+
+    def __init__(
+        self,
+        model: Any,
+        references: list[Sample | str],
+        x: NDArray | None = None,
+        order: int = 5,
+        window_length: int | None = None,
+        polyorder: int = 2,
+    ):
+        if x is None:
+            x = getattr(model, "raman_shift", None)
+            if x is None:
+                raise ValueError(f"The model has no raman_shift. Pass `x`.")
+        self.model: Any = model
+        self.x: NDArray = np.asarray(x, dtype=np.float64)
+        dx = float(np.diff(self.x).mean())
+        self.window_length: int = int(30 / dx) if window_length is None else window_length
+        self.polyorder: int = polyorder
+        self.emsc: EMSC = EMSC(raman_shift=self.x, order=order)
+        for reference in references:
+            if isinstance(reference, str):
+                reference = get_reference(reference, normalize=None)
+            self.emsc.add_reference(self._prepare(self._resample([(reference.x, reference.y)]))[0], name=reference.name)
+
+    @classmethod
+    def on_grid(cls, model: Any, references: list[Sample | str], low: float, high: float, step: float = 1, **kwargs):
+        """
+        An estimator on the grid `np.arange(low, high + step, step)`, the axis of interpolated samples.
+        """
+        return cls(model, references, x=arange_axis(low, high + step, step), **kwargs)
+
+    def _resample(self, spectra: list[tuple[NDArray, NDArray]]) -> NDArray:
+        Y = np.empty((len(spectra), self.x.shape[0]), dtype=np.float64)
+        for i, (x, y) in enumerate(spectra):
+            order = np.argsort(x, kind="stable")
+            Y[i] = np.interp(self.x, x[order], y[order])
+        return Y
+
+    def _prepare(self, Y: NDArray) -> NDArray:
+        Y = savgol_filter(Y, window_length=self.window_length, polyorder=self.polyorder, axis=1)
+        low = Y.min(axis=1, keepdims=True)
+        span = Y.max(axis=1, keepdims=True) - low
+        # The smoothing leaves a ripple of rounding errors on a flat spectrum: its range is never exactly 0
+        flat = span[:, 0] <= 1e-9 * np.abs(Y).mean(axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            Y = (Y - low) / span
+        Y[flat] = np.nan
+        return Y
+
+    def features(self, spectra: list[tuple[NDArray, NDArray]]) -> NDArray:
+        """
+        The corrected spectra of shape (n_spectra, len(x)) fed to the model. Use it to train the model too. The row of
+        a flat spectrum, which cannot be normalized, is NaN.
+
+        Parameters
+        ----------
+        spectra : list of tuple of (NDArray, NDArray)
+            The raw (Raman Shift, intensity) of every spectrum.
+        """
+        return self.emsc.correct_batch(self._prepare(self._resample(spectra)))
+
+    def predict(self, spectra: list[tuple[NDArray, NDArray]]) -> NDArray:
+        """
+        The glucose estimate of every raw (Raman Shift, intensity) spectrum, NaN for a flat spectrum.
+        """
+        features = self.features(spectra)
+        valid = np.isfinite(features).all(axis=1)
+        glucose = np.full(len(spectra), np.nan)
+        if valid.any():
+            glucose[valid] = np.asarray(self.model.predict(features[valid])).reshape(int(valid.sum()), -1)[:, 0]
+        return glucose
+
+
+class LatencyStats:
+    """
+    Counters and a window of the last `window` request latencies.
+    """
+
+    def __init__(self, window: int = 10000):
+        self.latencies: deque[float] = deque(maxlen=window)
+        self.batch_sizes: deque[int] = deque(maxlen=window)
+        self.requests: int = 0
+        self.errors: int = 0
+        self.batches: int = 0
+
+    def summary(self) -> dict[str, Any]:
+        latencies = np.array(self.latencies) * 1000
+        percentiles = np.percentile(latencies, [50, 90, 99]) if latencies.size > 0 else [np.nan] * 3
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "batches": self.batches,
+            "mean_batch_size": float(np.mean(self.batch_sizes)) if self.batch_sizes else 0.0,
+            "latency_ms": {
+                "p50": float(percentiles[0]),
+                "p90": float(percentiles[1]),
+                "p99": float(percentiles[2]),
+                "max": float(latencies.max()) if latencies.size > 0 else float("nan"),
+            },
+        }
+
+
+class MicroBatcher:
+    """
+    Gather items submitted concurrently into batches for `func(list of items) -> list of results`.
+
+    A batch is run as soon as `max_batch` items are waiting or `max_delay` seconds after its first item.
+    `func` runs in a thread, so the event loop keeps accepting requests while a batch is computed.
+    When `func` raises on a batch, its items are run one by one, so only the items that fail get the error.
+    """
+
+    def __init__(self, func: Callable[[list], Any], max_batch: int = 64, max_delay: float = 0.005, stats: LatencyStats | None = None):
+        self.func: Callable[[list], Any] = func
+        self.max_batch: int = max_batch
+        self.max_delay: float = max_delay
+        self.stats: LatencyStats = LatencyStats() if stats is None else stats
+        self._queue: asyncio.Queue[tuple[Any, asyncio.Future]] = asyncio.Queue()
+        self._task: asyncio.Task | None = None
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def submit(self, item: Any) -> Any:
+        """
+        Queue one item and wait for its result.
+        """
+        self.start()
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch:
+                if self._queue.empty() == False:
+                    batch.append(self._queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            self.stats.batches += 1
+            self.stats.batch_sizes.append(len(batch))
+            items = [item for item, _ in batch]
+            try:
+                results = await loop.run_in_executor(None, self.func, items)
+            except Exception as error:
+                results = [error] if len(batch) == 1 else await loop.run_in_executor(None, self._run_each, items)
+            for (_, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    def _run_each(self, items: list) -> list:
+        # The result of every item, or the exception it raised
+        results = []
+        for item in items:
+            try:
+                results.append(self.func([item])[0])
+            except Exception as error:
+                results.append(error)
+        return results
+
+
+############# HTTP #############
+
+
+def _check_spectrum(x: NDArray, y: NDArray):
+    if x.ndim != 1 or y.ndim != 1 or x.shape != y.shape:
+        raise ValueError(f"Expect x and y of the same length. Got shapes {x.shape} and {y.shape}")
+    if x.shape[0] < 2:
+        raise ValueError(f"Expect at least 2 points. Got {x.shape[0]}")
+    if np.isfinite(x).all() == False or np.isfinite(y).all() == False:
+        raise ValueError(f"Expect finite x and y values.")
+
+
+def _parse_payload(body: bytes, content_type: str) -> list[tuple[NDArray, NDArray]]:
+    if "json" in content_type:
+        payload = json.loads(body)
+        items = payload["spectra"] if "spectra" in payload else [payload]
+        spectra = [(np.asarray(item["x"], dtype=np.float64), np.asarray(item["y"], dtype=np.float64)) for item in items]
+    else:
+        spectrum = parse_spectrum(body.decode())
+        spectra = [(spectrum[:, 0], spectrum[:, 1])]
+    if len(spectra) == 0:
+        raise ValueError(f"Expect at least one spectrum.")
+    # Checked before queueing, so a bad spectrum is rejected alone instead of failing the batch it joins
+    for x, y in spectra:
+        _check_spectrum(x, y)
+    return spectra
+
+
+def _response(status: int, payload: dict) -> bytes:
+    reason = {200: "OK", 400: "Bad Request", 404: "Not Found", 500: "Internal Server Error"}[status]
+    body = json.dumps(payload).encode()
+    head = f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n"
+    return head.encode() + body
+
+
+class GlucoseService:
+    """
+    The HTTP front of a `GlucoseEstimator` with micro-batching. See `serve`.
+    """
+
+    def __init__(self, estimator: GlucoseEstimator, max_batch: int = 64, max_delay: float = 0.005):
+        self.estimator: GlucoseEstimator = estimator
+        self.stats: LatencyStats = LatencyStats()
+        self.batcher: MicroBatcher = MicroBatcher(self._predict, max_batch=max_batch, max_delay=max_delay, stats=self.stats)
+
+    def _predict(self, spectra: list[tuple[NDArray, NDArray]]) -> list[float | None]:
+        # NaN and inf are not valid JSON, they are sent as null
+        return [float(value) if np.isfinite(value) else None for value in self.estimator.predict(spectra)]
+
+    def metrics(self) -> dict[str, Any]:
+        return {**self.stats.summary(), "queue_depth": self.batcher.queue_depth}
+
+    async def predict(self, spectra: list[tuple[NDArray, NDArray]]) -> list[float | None]:
+        return list(await asyncio.gather(*[self.batcher.submit(spectrum) for spectrum in spectra]))
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        start = perf_counter()
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+            lines = head.decode("latin-1").split("\r\n")
+            method, target, _ = lines[0].split(" ", 2)
+            headers = {line.split(":", 1)[0].strip().lower(): line.split(":", 1)[1].strip() for line in lines[1:] if ":" in line}
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+            if method == "GET" and target == "/health":
+                response = _response(200, {"status": "ok"})
+            elif method == "GET" and target == "/metrics":
+                response = _response(200, self.metrics())
+            elif method == "POST" and target == "/predict":
+                self.stats.requests += 1
+                try:
+                    spectra = _parse_payload(body, headers.get("content-type", ""))
+                except (ValueError, KeyError, TypeError) as error:
+                    self.stats.errors += 1
+                    response = _response(400, {"error": f"Cannot read the spectra: {error}"})
+                else:
+                    glucose = await self.predict(spectra)
+                    response = _response(200, {"glucose": glucose[0] if len(glucose) == 1 else glucose})
+                    self.stats.latencies.append(perf_counter() - start)
+            else:
+                response = _response(404, {"error": f"{method} {target} is not found"})
+        except (asyncio.IncompleteReadError, ValueError) as error:
+            response = _response(400, {"error": str(error)})
+        except Exception as error:
+            self.stats.errors += 1
+            response = _response(500, {"error": str(error)})
+        writer.write(response)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8765) -> asyncio.Server:
+        self.batcher.start()
+        return await asyncio.start_server(self.handle, host=host, port=port)
+
+
+def serve(estimator: GlucoseEstimator, host: str = "127.0.0.1", port: int = 8765, max_batch: int = 64, max_delay: float = 0.005):
+    """
+    Run the service until interrupted.
+
+    Parameters
+    ----------
+    estimator : GlucoseEstimator
+        The loaded references and model.
+    host : str
+        Default is localhost, so the service is not reachable from other machines.
+    port : int
+        The TCP port.
+    max_batch : int
+        The largest number of spectra predicted together.
+    max_delay : float
+        The longest time (seconds) a spectrum waits for others before its batch runs.
+    """
+
+    async def main():
+        service = GlucoseService(estimator, max_batch=max_batch, max_delay=max_delay)
+        server = await service.start(host=host, port=port)
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(main())
@@ -0,0 +1,245 @@
+import numpy as np
+from numpy.typing import NDArray
+
+import atexit
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable, Self
+
+# The worker processes shared by every `map_rows` call, started on first use (see `get_pool`).
+_pool: ProcessPoolExecutor | None = None
+_pool_workers: int = 0
+_pool_lock = threading.Lock()
+
+
+class SharedArray:
+    """
+    A NumPy array backed by `multiprocessing.shared_memory`.
+
+    The process that creates a `SharedArray` owns the memory and unlinks it on `release` (or when leaving the `with` block).
+    Pickling a `SharedArray` only sends its name, shape and dtype; the receiving process attaches to the same memory
+    without copying, and only closes its own mapping on `release`.
+
+    Parameters
+    ----------
+    shape : tuple of int
+        The shape of the array.
+    dtype : type or np.dtype
+        The dtype of the array.
+    name : str or None
+        Attach to an existing shared memory block with this name. Default is None, which creates a new block.
+
+    Examples
+    --------
+    >>> with SharedArray.copy_of(Y) as shared:
+    ...     pool.submit(work, shared, 0, 100)   # `work` writes into `shared.array[0:100]`
+    ...     Y = shared.array.copy()
+    """
+
+    def __init__(self, shape: tuple[int, ...], dtype: type | np.dtype = np.float64, name: str | None = None):
+        self.shape: tuple[int, ...] = tuple(shape)
+        self.dtype: np.dtype = np.dtype(dtype)
+        nbytes = max(int(np.prod(self.shape)) * self.dtype.itemsize, 1)
+        self.owner: bool = name is None
+        if self.owner:
+            self._shm: SharedMemory | None = SharedMemory(create=True, size=nbytes)
+        else:
+            self._shm = _attach(name)  # type: ignore
+        self.name: str = self._shm.name
+        self.array: NDArray = np.ndarray(self.shape, dtype=self.dtype, buffer=self._shm.buf)
+
+    @classmethod
+    def copy_of(cls, array: NDArray) -> Self:
+        """
+        Create a new `SharedArray` with a copy of `array`.
+        """
+        shared = cls(shape=array.shape, dtype=array.dtype)
+        shared.array[...] = array
+        return shared
+
+    def release(self):
+        """
+        Drop the array view and close the mapping. The owner also unlinks the shared memory.
+        """
+        if self._shm is None:
+            return
+        # The buffer cannot be closed while a NumPy view still exports it.
+        self.array = None  # type: ignore
+        self._shm.close()
+        if self.owner:
+            self._shm.unlink()
+        self._shm = None
+
+    def __reduce__(self):
+        return (SharedArray, (self.shape, self.dtype, self.name))
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+    def __del__(self):
+        try:
+            self.release()
+        except Exception:
+            pass
+
+    def __repr__(self) -> str:
+        return f"SharedArray(name={self.name}, shape={self.shape}, dtype={self.dtype}, owner={self.owner})"
+
+
+def _attach(name: str) -> SharedMemory:
+    try:
+        # Python >= 3.13, the attaching process must not unlink the memory when it exits.
+        return SharedMemory(name=name, track=False)  # type: ignore
+    except TypeError:
+        return SharedMemory(name=name)
+
+
+def _run_rows(func: Callable, Y: SharedArray, out: SharedArray, x: NDArray | None, start: int, stop: int, kwargs: dict):
+    # Runs in the worker: both arrays are attached without copying and the result is written in place.
+    try:
+        block = Y.array[start:stop]
+        result = func(block, x, **kwargs) if x is not None else func(block, **kwargs)
+        out.array[start:stop] = result
+    finally:
+        Y.release()
+        if out is not Y:
+            out.release()
+
+
+def get_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    The process pool of `map_rows`, created on the first call and kept for the next ones, so the worker processes
+    are started once per process instead of once per call. It is replaced when `workers` changes or it is broken.
+    """
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers or getattr(_pool, "_broken", False):
+            if _pool is not None:
+                _pool.shutdown(wait=False, cancel_futures=True)
+            _pool, _pool_workers = ProcessPoolExecutor(max_workers=workers), workers
+        return _pool
+
+
+def shutdown_pool():
+    """
+    Stop the worker processes of `map_rows`. They are started again by the next call.
+    """
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True)
+        _pool, _pool_workers = None, 0
+
+
+atexit.register(shutdown_pool)
+
+
+def map_rows(
+    func: Callable[..., NDArray],
+    Y: NDArray,
+    x: NDArray | None = None,
+    workers: int = 2,
+    out_shape: tuple[int, ...] | None = None,
+    in_place: bool = False,
+    **kwargs: Any,
+) -> NDArray:
+    """
+    Apply `func` to blocks of rows of `Y` in worker processes, moving the data through shared memory.
+
+    `func(Y[start:stop], x, **kwargs)` (or `func(Y[start:stop], **kwargs)` when `x` is None) must be a module-level
+    function that returns the result for those rows. `x` (the shared Raman Shift) is small and is pickled once per block.
+
+    Parameters
+    ----------
+    func : callable
+        The function to apply to every block of rows.
+    Y : NDArray of shape (n_spectra, n_shifts)
+        The spectra.
+    x : NDArray or None
+        The Raman Shift passed to `func`.
+    workers : int
+        Number of worker processes (of the pool shared between calls, see `get_pool`).
+        With 1 worker `func` is called on the whole `Y` in this process.
+    out_shape : tuple of int or None
+        The shape of the result. Default is None, which is the shape of `Y`.
+    in_place : bool
+        Default is False. When True the result is written into the shared copy of `Y` instead of a second buffer
+        (`out_shape` must then be the shape of `Y`).
+    kwargs :
+        Passed to `func`.
+
+    Returns
+    -------
+    NDArray :
+        The result, with `out_shape`.
+    """
+    if workers <= 1 or Y.shape[0] <= 1:
+        return func(Y, x, **kwargs) if x is not None else func(Y, **kwargs)
+
+    out_shape = Y.shape if out_shape is None else tuple(out_shape)
+    if in_place and out_shape != Y.shape:
+        raise ValueError(f"in_place=True requires out_shape={Y.shape}. Got {out_shape=}")
+
+    bounds = np.linspace(0, Y.shape[0], min(workers, Y.shape[0]) + 1).astype(int)
+    with SharedArray.copy_of(Y) as shared_Y:
+        with (SharedArray(shape=out_shape, dtype=Y.dtype) if not in_place else shared_Y) as shared_out:
+            executor = get_pool(workers)
+            try:
+                futures = [
+                    executor.submit(_run_rows, func, shared_Y, shared_out, x, start, stop, kwargs)
+                    for start, stop in zip(bounds[:-1], bounds[1:])
+                ]
+                for future in futures:
+                    future.result()
+            except BrokenProcessPool:
+                # A worker died (for example killed for memory): start a new pool for the next call
+                shutdown_pool()
+                raise
+            return shared_out.array.copy()
+
+
+def _sample_method_rows(Y: NDArray, x: NDArray, operation: str, kwargs: dict) -> NDArray:
+    from raman.sample import Sample
+
+    for i in range(Y.shape[0]):
+        sample = Sample(x=x, y=Y[i], interpolate=False)
+        getattr(sample, operation)(**kwargs)
+        if sample.y.shape != Y[i].shape:
+            raise ValueError(f"Sample.{operation} changes the length of the spectrum and cannot be run with map_samples.")
+        Y[i] = sample.y
+    return Y
+
+
+def map_samples(samples: list, operation: str, workers: int = 2, **kwargs: Any):
+    """
+    Call `Sample.<operation>(**kwargs)` on every sample in worker processes, like
+    `for sample in samples: sample.<operation>(**kwargs)`.
+
+    Samples are stacked per shared Raman Shift and sent to the workers through shared memory,
+    which write the new intensities in place. Only methods that keep the length of the spectrum
+    (for example 'normalized', 'smoothing', 'baseline', 'despike', 'remove_spike') are supported.
+
+    Parameters
+    ----------
+    samples : list of Sample
+        The samples to update.
+    operation : str
+        The name of the `Sample` method.
+    workers : int
+        Number of worker processes.
+    kwargs :
+        Passed to the method.
+    """
+    from raman.axis import axis_groups
+
+    for group in axis_groups(samples).values():
+        x = group[0].x
+        Y = np.vstack([sample.y for sample in group])
+        Y = map_rows(_sample_method_rows, Y, x=x, workers=workers, in_place=True, operation=operation, kwargs=kwargs)
+        for sample, y in zip(group, Y):
+            sample.y = y
@@ -3,6 +3,11 @@ from .reference import Reference
 from .blood import Blood
 from ..sample import Sample as _Sample
 from ..database import collection_finger as _collection_finger
+from ..database import collection_blood as _collection_blood
+from ..database import collection_ref as _collection_ref
+
+from typing import Any as _Any, Iterator as _Iterator
+import pandas as _pd
 
 
 def load_spectra_of_subject(subject_id: str) -> list[Finger]:
@@ -36,3 +41,91 @@ def load_spectra_of_subject_as_sample(subject_id: str) -> list[_Sample]:
         sample = finger.to_sample()
         samples.append(sample)
     return samples
+
+
+def _collections(kind: str):
+    collections = {"finger": _collection_finger, "blood": _collection_blood, "reference": _collection_ref}
+    if kind not in collections:
+        raise ValueError(f"Expect kind to be one of {list(collections)}. Got {kind=}")
+    return collections[kind]
+
+
+def iter_samples(
+    kind: str = "finger",
+    query: dict[str, _Any] | None = None,
+    interpolate: bool = False,
+    batch_size: int = 256,
+) -> _Iterator[_Sample]:
+    """Stream the spectra of a collection as Sample objects, without loading the whole result.
+
+    Args:
+        kind (str): 'finger', 'blood' or 'reference'.
+        query (dict | None): MongoDB query. Default is every spectrum.
+        interpolate (bool): Passed to `to_sample`.
+        batch_size (int): Number of documents fetched from the database at a time.
+    Yields:
+        Sample: One Sample per document, in timestamp order, with the document `_id` in `sample.meta`.
+    """
+    models = {"finger": Finger, "blood": Blood, "reference": Reference}
+    if kind not in models:
+        raise ValueError(f"Expect kind to be one of {list(models)}. Got {kind=}")
+    cursor = _collections(kind).find(query or {}).sort("timestamp", 1).batch_size(batch_size)
+    for item in cursor:
+        sample = models[kind](**item).to_sample(interpolate=interpolate, verbose=False)
+        sample.meta["_id"] = item["_id"]
+        yield sample
+
+
+def mean_spectra(
+    kind: str = "finger",
+    by: str | list[str] | None = "glucose",
+    match: dict[str, _Any] | None = None,
+    weight: str | None = "accumulation",
+) -> list[_Sample]:
+    """Mean spectrum of every group, averaged element-wise on the database server.
+
+    Only the mean spectra are transferred, instead of every document with both arrays.
+    `raman.aggregate.EmbeddedStore.mean_spectra` gives the same result on local data.
+
+    Args:
+        kind (str): 'finger', 'blood' or 'reference'.
+        by (str | list[str] | None): The grouping fields, for example 'glucose' or ['subject_id', 'glucose'].
+            None averages every matching document.
+        match (dict | None): MongoDB query selecting the documents.
+        weight (str | None): The weighting field. Default is 'accumulation', like `Sample.__or__`. None is a plain mean.
+    Returns:
+        list[Sample]: One sample per group, exposure and Raman Shift axis (not interpolated), sorted by group,
+            with the group fields and the number of documents `n` in `sample.meta`.
+    """
+    from ..aggregate import mean_spectra_pipeline, _mean_samples, _by
+
+    pipeline = mean_spectra_pipeline(by=by, match=match, weight=weight)
+    groups = _collections(kind).aggregate(pipeline, allowDiskUse=True)
+    return _mean_samples(groups, _by(by))
+
+
+def band_statistics(
+    bands: list[tuple[float, float]],
+    kind: str = "finger",
+    by: str | list[str] | None = "glucose",
+    match: dict[str, _Any] | None = None,
+) -> _pd.DataFrame:
+    """Statistics of band averages per group, computed on the database server.
+
+    The band value of a spectrum is its mean intensity with a Raman Shift in [low, high].
+    `raman.aggregate.EmbeddedStore.band_statistics` gives the same result on local data.
+
+    Args:
+        bands (list[tuple[float, float]]): The (low, high) windows, in cm⁻¹.
+        kind (str): 'finger', 'blood' or 'reference'.
+        by (str | list[str] | None): The grouping fields. None summarizes every matching document.
+        match (dict | None): MongoDB query selecting the documents.
+    Returns:
+        pandas.DataFrame: One row per group and band with the group fields, `band`, `low`, `high`,
+            `n`, `mean`, `std`, `min` and `max`.
+    """
+    from ..aggregate import band_statistics_pipeline, _band_frame, _by
+
+    bands = [(float(low), float(high)) for low, high in bands]
+    groups = _collections(kind).aggregate(band_statistics_pipeline(bands, by=by, match=match), allowDiskUse=True)
+    return _band_frame(groups, bands, _by(by))
@@ -157,6 +157,7 @@ class Blood(BaseModel):
         sample.lens = self.lens
         sample.date = self.timestamp
         sample.slit = self.slit
+        sample.meta["glucose"] = self.glucose
         return sample
 
     def save(self):
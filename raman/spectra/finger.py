@@ -132,6 +132,8 @@ class Finger(BaseModel):
         sample.power = self.power
         sample.lens = self.lens
         sample.date = self.timestamp
+        sample.meta["subject_id"] = self.subject_id
+        sample.meta["glucose"] = self.glucose
         return sample
 
     def save(self):
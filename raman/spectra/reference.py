@@ -148,7 +148,8 @@ class Reference(BaseModel):
                     f"Duplicate entry for {self.name} at {self.timestamp}"
                 )
         else:
-            collection_ref.update_one({"_id": self._id}, {"$set": self.model_dump()})
+            # The revision tells `raman.references` caches that the reference changed
+            collection_ref.update_one({"_id": self._id}, {"$set": self.model_dump(), "$inc": {"revision": 1}})
 
     def delete(self):
         if self._id is None:
@@ -0,0 +1,290 @@
+"""
+Synthetic spectra for load and scaling tests.
+
+`SpectrumGenerator` mixes reference spectra (from the database or .txt files, read through `raman.references`)
+with random coefficients, adds a fluorescence baseline, detector noise and cosmic spikes, and streams the result
+batch by batch, so millions of spectra can be produced without holding them in memory:
+
+    counts = Poisson(photons * (sum_k c_k * reference_k + baseline)) + dark + Normal(0, read_noise) + spikes
+
+- the references are resampled to the Raman Shift `x` and min-max normalized,
+- every coefficient c_k is drawn uniformly from its range,
+- the baseline is a Bernstein polynomial with non-negative random coefficients, so it is smooth and positive,
+- the dark signal is a dark frame (for example `data/noise/10s/txt`) drawn at random, or a constant offset,
+- spikes are a few pixels wide, their number per spectrum is Poisson distributed,
+- the counts are rounded and clipped to the 16-bit range of the detector.
+
+Every batch is drawn from its own seed (derived from `seed` and the batch index), so a batch can be generated
+again, or in another process, without generating the ones before it.
+
+    >>> generator = SpectrumGenerator(
+    ...     {"glucose": "glucose", "skin": "data/skin/txt/skin1_600_785 nm_30 s_1_2024_12_09_13_41_06_01.txt"},
+    ...     coefficients={"glucose": (0, 0.2), "skin": (0.5, 1)},
+    ...     dark_frames="data/noise/30s/txt",
+    ... )
+    >>> for Y, params in generator.generate(1_000_000, batch_size=10_000):
+    ...     ...
+    >>> generator.write("synthetic.parquet", 1_000_000)
+"""
+from raman.sample import Sample, NAME_FORMAT
+from raman.axis import arange_axis
+from raman.search import resample
+from raman.helper import read_spectrum
+
+import numpy as np
+from numpy.typing import NDArray
+from scipy.special import comb  # type: ignore
+
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Iterator
+
+# The largest count of the 16-bit detector
+MAX_COUNT: int = 65535
+
+
+def load_dark_frames(source: str | Path | list[str | Path], x: NDArray) -> NDArray:
+    """
+    Read dark frames (.txt files, or every .txt file of a folder) resampled to the Raman Shift `x`.
+
+    Returns
+    -------
+    NDArray of shape (n_frames, n_shifts) :
+        The dark counts of every frame.
+    """
+    if isinstance(source, (str, Path)) and Path(source).is_dir():
+        paths = sorted(Path(source).glob("*.txt"))
+    else:
+        paths = [Path(path) for path in ([source] if isinstance(source, (str, Path)) else source)]
+    if len(paths) == 0:
+        raise ValueError(f"No dark frame found in {source}")
+    frames = np.empty((len(paths), x.shape[0]))
+    for i, path in enumerate(paths):
+        spectrum = read_spectrum(path)
+        frames[i] = np.interp(x, spectrum[:, 0], spectrum[:, 1])
+    return frames
+
+
+class SpectrumGenerator:
+    """
+    Generate realistic synthetic spectra from references.
+
+    Parameters
+    ----------
+    components : dict of str to (Sample or str)
+        The references to mix, by name. A str is the name of a reference in the database or a .txt file.
+    coefficients : dict of str to tuple of (float, float) or None
+        The [low, high) range of the mixing coefficient of every component. Default is None, which uses (0, 1).
+    x : NDArray or None
+        The Raman Shift of the spectra. Default is None, which is 400 to 1800 cm⁻¹ by 1 cm⁻¹.
+    photons : float
+        The expected counts of a component with coefficient 1 at its maximum.
+    baseline_order : int
+        The order of the fluorescence baseline.
+    baseline_level : float
+        The largest coefficient of the baseline, relative to a component (the baseline stays below it).
+    dark_frames : str, pathlib.Path, list or NDArray or None
+        The dark frames (see `load_dark_frames`), or an array of them on `x`. Default is None, which adds `offset`.
+    offset : float
+        The constant dark signal when there is no dark frame.
+    read_noise : float
+        The standard deviation of the Gaussian read noise, in counts.
+    spike_rate : float
+        The mean number of cosmic spikes per spectrum.
+    spike_height : tuple of (float, float)
+        The range of the spike heights, in counts.
+    exposure : int
+        The exposure (seconds) written in the metadata.
+    seed : int
+        The seed of the whole stream.
+    """
+
+    def __init__(
+        self,
+        components: dict[str, Sample | str],
+        coefficients: dict[str, tuple[float, float]] | None = None,
+        x: NDArray | None = None,
+        photons: float = 2000.0,
+        baseline_order: int = 3,
+        baseline_level: float = 2.0,
+        dark_frames: str | Path | list[str | Path] | NDArray | None = None,
+        offset: float = 40.0,
+        read_noise: float = 4.0,
+        spike_rate: float = 0.1,
+        spike_height: tuple[float, float] = (500, 20000),
+        exposure: int = 30,
+        seed: int = 0,
+    ):
+        if len(components) == 0:
+            raise ValueError(f"components must not be empty.")
+        coefficients = {} if coefficients is None else coefficients
+        for name in coefficients:
+            if name not in components:
+                raise ValueError(f"The coefficient of {name} has no component. Components are {list(components)}")
+        self.x: NDArray = arange_axis(400, 1801, 1) if x is None else np.asarray(x, dtype=np.float64)
+        self.names: list[str] = list(components)
+        self.references: NDArray = np.vstack([self._reference(component) for component in components.values()])
+        self.ranges: NDArray = np.array([coefficients.get(name, (0, 1)) for name in self.names], dtype=np.float64)
+        self.photons: float = photons
+        self.baseline_level: float = baseline_level
+        self.dark: NDArray | None = None
+        if dark_frames is not None:
+            self.dark = dark_frames if isinstance(dark_frames, np.ndarray) else load_dark_frames(dark_frames, self.x)
+        self.offset: float = offset
+        self.read_noise: float = read_noise
+        self.spike_rate: float = spike_rate
+        self.spike_height: tuple[float, float] = spike_height
+        self.exposure: int = exposure
+        self.seed: int = seed
+
+        # The Bernstein basis of the baseline on the scaled Raman Shift
+        t = (self.x - self.x[0]) / (self.x[-1] - self.x[0])
+        k = np.arange(baseline_order + 1)
+        self.basis: NDArray = comb(baseline_order, k)[:, None] * t[None, :] ** k[:, None] * (1 - t[None, :]) ** (baseline_order - k)[:, None]
+
+    def _reference(self, component: Sample | str) -> NDArray:
+        if isinstance(component, str):
+            from raman.references import get_reference
+
+            return get_reference(component, x=self.x, normalize="minmax").y
+        y = resample(component.x, component.y, self.x)[0]
+        return (y - y.min()) / (y.max() - y.min())
+
+    @property
+    def n_shifts(self) -> int:
+        return self.x.shape[0]
+
+    def batch(self, index: int, size: int) -> tuple[NDArray, dict[str, NDArray]]:
+        """
+        Generate the batch `index` of `size` spectra.
+
+        Returns
+        -------
+        NDArray of shape (size, n_shifts) :
+            The counts (float32).
+        dict of NDArray :
+            'coefficients' (size, n_components), 'baseline' (size, baseline_order + 1), 'dark' (the dark frame
+            of every spectrum, -1 without dark frames) and 'spikes' (the number of spikes of every spectrum).
+        """
+        rng = np.random.default_rng([self.seed, index])
+        low, high = self.ranges[:, 0], self.ranges[:, 1]
+        coefficients = low + (high - low) * rng.random((size, len(self.names)))
+        baseline = self.baseline_level * rng.random((size, self.basis.shape[0]))
+        expected = self.photons * (coefficients @ self.references + baseline @ self.basis)
+        Y = rng.poisson(np.maximum(expected, 0)).astype(np.float32)
+
+        if self.dark is not None:
+            dark = rng.integers(0, self.dark.shape[0], size=size)
+            Y += self.dark[dark]
+        else:
+            dark = np.full(size, -1)
+            Y += self.offset
+        Y += rng.normal(0, self.read_noise, size=Y.shape).astype(np.float32)
+
+        spikes = rng.poisson(self.spike_rate, size=size)
+        rows = np.repeat(np.arange(size), spikes)
+        if rows.size > 0:
+            width = rng.integers(1, 4, size=rows.size)
+            start = rng.integers(0, self.n_shifts - 3, size=rows.size)
+            height = rng.uniform(*self.spike_height, size=rows.size)
+            for offset in range(3):
+                inside = offset < width
+                # A spike decays from its first pixel
+                np.add.at(Y, (rows[inside], start[inside] + offset), height[inside] / (1 + 2 * offset))
+
+        np.clip(np.rint(Y, out=Y), 0, MAX_COUNT, out=Y)
+        return Y, {"coefficients": coefficients, "baseline": baseline, "dark": dark, "spikes": spikes}
+
+    def generate(self, n: int, batch_size: int = 10000) -> Iterator[tuple[NDArray, dict[str, NDArray]]]:
+        """
+        Stream `n` spectra, `batch_size` at a time (see `batch`).
+        """
+        for index, start in enumerate(range(0, n, batch_size)):
+            yield self.batch(index, min(batch_size, n - start))
+
+    def samples(self, n: int, batch_size: int = 10000, name: str = "synthetic") -> Iterator[Sample]:
+        """
+        Stream `n` spectra as `Sample` on the shared Raman Shift, one second apart.
+        The mixing coefficients are in `meta` under the component names.
+        """
+        date = datetime(2025, 1, 1)
+        i = 0
+        for Y, params in self.generate(n, batch_size=batch_size):
+            for y, coefficients, spikes in zip(Y, params["coefficients"], params["spikes"]):
+                sample = Sample(x=self.x, y=y, interpolate=False)
+                sample.name = name
+                sample.date = date + timedelta(seconds=i)
+                sample.exposure = self.exposure
+                sample.accumulation = 1
+                sample.grating = "600"
+                sample.laser = "785 nm"
+                sample.lens = "synthetic"
+                sample.power = 0.0
+                sample.meta.update({component: float(value) for component, value in zip(self.names, coefficients)})
+                sample.meta["spikes"] = int(spikes)
+                i += 1
+                yield sample
+
+    def write(self, path: str | Path, n: int, batch_size: int = 10000, name: str = "synthetic") -> int:
+        """
+        Write `n` spectra to a file or a folder, batch by batch.
+
+        - .parquet or .h5/.hdf5: through `raman.columnar`, with the metadata.
+        - .npy: the counts (float32) in one memory-mapped array, and the parameters in a '-params.npz' next to it.
+        - a folder: one .txt file per spectrum, named with `NAME_FORMAT` like the instrument exports.
+
+        Returns
+        -------
+        int :
+            Number of spectra written.
+        """
+        path = Path(path)
+        if path.suffix in [".parquet", ".h5", ".hdf5"]:
+            from raman.columnar import write_parquet, write_hdf5
+
+            writer = write_parquet if path.suffix == ".parquet" else write_hdf5
+            return writer(self.samples(n, batch_size=batch_size, name=name), path, batch_size=batch_size)
+        if path.suffix == ".npy":
+            Y_out = np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=(n, self.n_shifts))
+            parts: dict[str, list[NDArray]] = {}
+            start = 0
+            for Y, params in self.generate(n, batch_size=batch_size):
+                Y_out[start : start + Y.shape[0]] = Y
+                start += Y.shape[0]
+                for key, value in params.items():
+                    parts.setdefault(key, []).append(value)
+            Y_out.flush()
+            np.savez(
+                path.with_name(f"{path.stem}-params.npz"),
+                x=self.x,
+                components=np.array(self.names),
+                **{key: np.concatenate(value) for key, value in parts.items()},
+            )
+            return n
+        if path.suffix != "":
+            raise ValueError(f"Unknown output format {path.suffix}. Use .parquet, .h5, .hdf5, .npy or a folder.")
+        path.mkdir(parents=True, exist_ok=True)
+        x = np.flip(self.x)
+        count = 0
+        for sample in self.samples(n, batch_size=batch_size, name=name):
+            values: dict[str, Any] = {
+                "name": sample.name,
+                "lens": sample.lens,
+                "power": "0-0",
+                "grating": sample.grating,
+                "laser": sample.laser,
+                "exposure": f"{sample.exposure} s",
+                "accumulation": sample.accumulation,
+                "01": "01",
+            }
+            stamp = sample.date.strftime("%Y_%m_%d_%H_%M_%S").split("_")
+            values.update(zip(["year", "month", "date", "hour", "minute", "second"], stamp))
+            filename = "_".join(str(values[key]) for key in NAME_FORMAT)
+            np.savetxt(path / f"{filename}.txt", np.column_stack([x, np.flip(sample.y)]), fmt=("%.2f", "%.0f"), delimiter="\t")
+            count += 1
+        return count
+
+    def __repr__(self) -> str:
+        ranges = ", ".join(f"{name}={low:g}..{high:g}" for name, (low, high) in zip(self.names, self.ranges))
+        dark = "none" if self.dark is None else f"{self.dark.shape[0]} frames"
+        return f"SpectrumGenerator({ranges}, shifts={self.n_shifts}, dark={dark}, spike_rate={self.spike_rate})"